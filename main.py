@@ -4,15 +4,30 @@ import os
 import json
 import pickle
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
-from typing import List, Dict, Tuple
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from typing import List, Dict, Tuple, Iterator, Optional
+from collections import OrderedDict, deque
+from collections.abc import Mapping
 import uvicorn
 from pathlib import Path
+import shutil
 import tempfile
+import tarfile
+import zipfile
+import zlib
 import logging
+import asyncio
+import abc
 import concurrent.futures
+import contextlib
+import copy
+import multiprocessing
+import functools
+import itertools
+import hashlib
 import threading
 import time
+import uuid
 import psutil
 import gc
 from annoy import AnnoyIndex
@@ -23,555 +38,4281 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Disney Pin Image Matching API", version="1.0.0")
 
+# Versões do estado dos índices (compartilhadas entre gerações do matcher, nunca se repetem)
+_index_versions = itertools.count(1)
+
+# 🔢 Kernel de distância Hamming vetorizado (descriptors ORB empacotados em uint64)
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count  # NumPy >= 2.0
+else:
+    _POPCOUNT_TABLE16 = np.array([bin(value).count('1') for value in range(1 << 16)], dtype=np.uint8)
+
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        """Popcount por tabela de 16 bits (NumPy < 2.0)"""
+        halves = np.ascontiguousarray(words).view(np.uint16).reshape(words.shape + (4,))
+        return _POPCOUNT_TABLE16[halves].sum(axis=-1, dtype=np.uint8)
+
+
+def pack_descriptors(descriptors: np.ndarray) -> np.ndarray:
+    """Reinterpreta descriptors ORB (N, 32) uint8 como (N, 4) uint64 sem cópia quando possível"""
+    return np.ascontiguousarray(descriptors, dtype=np.uint8).view(np.uint64)
+
+
+def hamming_distance_matrix(packed1: np.ndarray, packed2: np.ndarray) -> np.ndarray:
+    """Matriz (N1, N2) uint16 de distâncias Hamming entre descriptors empacotados"""
+    distances = np.zeros((len(packed1), len(packed2)), dtype=np.uint16)
+    for word in range(packed1.shape[1]):
+        distances += _popcount(packed1[:, word, None] ^ packed2[None, :, word])
+    return distances
+
+
+def match_stats_by_segment(packed_query: np.ndarray, packed_db: np.ndarray,
+                           segment_lengths: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Estatísticas de matches com cross-check da consulta contra várias imagens de uma vez.
+
+    `packed_db` empilha os descriptors de várias imagens (segmentos contíguos de
+    `segment_lengths` linhas). Distância e índice são combinados em chaves uint32
+    (distância << 16 | índice), de modo que um único mínimo devolve a menor
+    distância e o primeiro índice que a atinge (mesmo desempate do argmin).
+    Retorna, por imagem: matches < 25, < 40, < 60 e a soma das distâncias < 40.
+    """
+    n_query, n_db = len(packed_query), len(packed_db)
+    if n_query > 0xFFFF or n_db > 0xFFFF:
+        raise ValueError("Bloco grande demais para chaves de 16 bits")
+
+    segment_starts = np.concatenate(([0], np.cumsum(segment_lengths)[:-1])).astype(np.int64)
+    distances = hamming_distance_matrix(packed_query, packed_db)
+    keys = distances.astype(np.uint32)
+    keys <<= 16
+
+    # Ida: melhor descriptor de cada imagem para cada consulta
+    forward_keys = np.minimum.reduceat(keys | np.arange(n_db, dtype=np.uint32), segment_starts, axis=1)
+    forward = forward_keys & 0xFFFF
+    segment_min = forward_keys >> 16
+
+    # Volta: melhor consulta para cada descriptor do banco
+    keys |= np.arange(n_query, dtype=np.uint32)[:, None]
+    backward = keys.min(axis=0) & 0xFFFF
+
+    mutual = backward[forward] == np.arange(n_query, dtype=np.uint32)[:, None]
+    match_distances = np.where(mutual, segment_min, 0xFFFF)
+    good_mask = match_distances < 40
+
+    return (
+        np.count_nonzero(match_distances < 25, axis=0),
+        np.count_nonzero(good_mask, axis=0),
+        np.count_nonzero(match_distances < 60, axis=0),
+        np.where(good_mask, match_distances, 0).sum(axis=0, dtype=np.int64)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def masks_with_weight(bits: int, weight: int) -> np.ndarray:
+    """Todas as máscaras de `bits` bits com exatamente `weight` bits ligados (sondagem multi-probe)"""
+    masks = [0]
+    for _ in range(weight):
+        masks = {mask | (1 << bit) for mask in masks for bit in range(bits) if not mask >> bit & 1}
+    return np.array(sorted(masks), dtype=np.int64)
+
+
+def merge_top_k(query_idx: np.ndarray, keys: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Mantém as k menores chaves distintas de cada consulta.
+
+    As chaves int64 (distância << 40 | linha) tornam a ordenação determinística;
+    um mesmo descriptor encontrado mais de uma vez gera chaves iguais e conta
+    uma única vez. Retorna os pares ordenados por (consulta, chave).
+    """
+    order = np.lexsort((keys, query_idx))
+    query_idx, keys = query_idx[order], keys[order]
+
+    distinct = np.ones(len(query_idx), dtype=bool)
+    distinct[1:] = (query_idx[1:] != query_idx[:-1]) | (keys[1:] != keys[:-1])
+    query_idx, keys = query_idx[distinct], keys[distinct]
+
+    rank = np.arange(len(query_idx)) - np.searchsorted(query_idx, query_idx, side='left')
+    return query_idx[rank < k], keys[rank < k]
+
+
+def perceptual_hash(image: np.ndarray) -> np.uint64:
+    """pHash de 64 bits: sinais das 8x8 frequências mais baixas da DCT (32x32, cinza) contra a mediana"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    return np.packbits(low > np.median(low[1:])).view(np.uint64)[0]
+
+
+def file_fingerprint(file_path: str, block_size: int = 1 << 20) -> Dict:
+    """Tamanho, mtime (ns) e SHA-256 do arquivo (entrada do manifesto de ingestão)"""
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+
+class DescriptorStore(Mapping):
+    """Armazena os descritores ORB de todas as imagens em um único array contíguo.
+
+    Os descritores ficam em uma matriz uint8 (N_desc, 32) e um array int64 de
+    offsets indica onde começa cada imagem. Carregado com ``np.memmap`` o
+    arquivo é compartilhado via page cache entre processos e cada acesso
+    devolve uma view (zero-copy) dos descritores da imagem.
+    """
+
+    def __init__(self, descriptors: np.ndarray, offsets: np.ndarray, image_paths: List[str]):
+        self.descriptors = descriptors
+        self.offsets = offsets
+        self.image_paths = list(image_paths)
+        self.path_to_idx = {path: idx for idx, path in enumerate(self.image_paths)}
+        self.files = None  # (store, offsets, caminhos) quando aberto do disco via memmap
+
+    def __reduce_ex__(self, protocol):
+        # Store mapeado do disco é reaberto pelo caminho (processos dos pools) em vez de copiado
+        if self.files is not None:
+            return DescriptorStore.reopen, (*self.files, self.total_descriptors)
+        return super().__reduce_ex__(protocol)
+
+    @classmethod
+    def from_dict(cls, features: Dict[str, np.ndarray], descriptor_dim: int = 32) -> "DescriptorStore":
+        """Empacota um dict {imagem: descritores} em um store em memória"""
+        image_paths = list(features.keys())
+        offsets = np.zeros(len(image_paths) + 1, dtype=np.int64)
+        for idx, path in enumerate(image_paths):
+            offsets[idx + 1] = offsets[idx] + len(features[path])
+
+        descriptors = np.empty((int(offsets[-1]), descriptor_dim), dtype=np.uint8)
+        for idx, path in enumerate(image_paths):
+            descriptors[offsets[idx]:offsets[idx + 1]] = features[path]
+
+        return cls(descriptors, offsets, image_paths)
+
+    @staticmethod
+    def write(features: Mapping, store_file: str, offsets_file: str, paths_file: str,
+              descriptor_dim: int = 32):
+        """Grava os descritores direto no arquivo (sem concatenar tudo em memória)"""
+        image_paths = list(features.keys())
+        offsets = np.zeros(len(image_paths) + 1, dtype=np.int64)
+        for idx, path in enumerate(image_paths):
+            offsets[idx + 1] = offsets[idx] + len(features[path])
+
+        # Escreve em arquivos temporários e troca com os.replace: um store antigo
+        # ainda mapeado em memória continua válido até ser liberado
+        store = np.lib.format.open_memmap(
+            store_file + '.tmp', mode='w+', dtype=np.uint8, shape=(int(offsets[-1]), descriptor_dim)
+        )
+        for idx, path in enumerate(image_paths):
+            store[offsets[idx]:offsets[idx + 1]] = features[path]
+        store.flush()
+        del store
+
+        with open(offsets_file + '.tmp', 'wb') as f:
+            np.save(f, offsets)
+        with open(paths_file + '.tmp', 'w') as f:
+            json.dump(image_paths, f)
+
+        for path in (store_file, offsets_file, paths_file):
+            os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, store_file: str, offsets_file: str, paths_file: str) -> "DescriptorStore":
+        """Abre o store em modo somente leitura via memmap"""
+        descriptors = np.load(store_file, mmap_mode='r')
+        offsets = np.load(offsets_file)
+        with open(paths_file, 'r') as f:
+            image_paths = json.load(f)
+
+        if len(offsets) != len(image_paths) + 1 or offsets[-1] != len(descriptors):
+            raise ValueError("Store de descritores inconsistente (offsets x descritores)")
+
+        store = cls(descriptors, offsets, image_paths)
+        store.files = tuple(os.path.abspath(path) for path in (store_file, offsets_file, paths_file))
+        return store
+
+    @classmethod
+    def reopen(cls, store_file: str, offsets_file: str, paths_file: str,
+               total_descriptors: int) -> "DescriptorStore":
+        """Reabre um store serializado pelo caminho, conferindo que o arquivo não foi trocado"""
+        store = cls.load(store_file, offsets_file, paths_file)
+        if store.total_descriptors != total_descriptors:
+            raise ValueError(f"Store {store_file} mudou no disco ({store.total_descriptors} != {total_descriptors} descritores)")
+        return store
+
+    @property
+    def total_descriptors(self) -> int:
+        return int(self.offsets[-1])
+
+    def descriptors_at(self, image_idx: int) -> np.ndarray:
+        """Descritores da imagem pelo índice inteiro"""
+        return self.descriptors[self.offsets[image_idx]:self.offsets[image_idx + 1]]
+
+    def __getitem__(self, image_path: str) -> np.ndarray:
+        return self.descriptors_at(self.path_to_idx[image_path])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.image_paths)
+
+    def __len__(self) -> int:
+        return len(self.image_paths)
+
+    def __contains__(self, image_path) -> bool:
+        return image_path in self.path_to_idx
+
+
+class IndexGenerations:
+    """Gerações versionadas dos arquivos de índice em disco (`gen-000001`, `gen-000002`, ...).
+
+    Uma construção grava num diretório novo: os arquivos que não mudam entram
+    como hard links da geração anterior e os regravados substituem o link
+    (`.tmp` + `os.replace`), sem tocar nas outras gerações. Ao fechar, o
+    `manifest.json` (tamanho e SHA-256 de cada arquivo, parâmetros de ORB e
+    Annoy) é gravado por último e o ponteiro `CURRENT` é trocado atomicamente;
+    diretório sem manifesto é construção interrompida e nunca é carregado.
+    Mantém as `keep` gerações mais recentes, além da ativa.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+    POINTER_FILE = "CURRENT"
+
+    def __init__(self, root: str, keep: int = 3, verify_checksums: bool = True):
+        self.root = root
+        self.keep = keep
+        self.verify_checksums = verify_checksums  # SHA-256 na carga (senão só tamanhos)
+        self.building = {}  # diretório em construção -> {arquivo: (inode do link, entrada herdada)}
+        self.lock = threading.Lock()
+
+    def names(self) -> List[str]:
+        """Gerações fechadas (com manifesto), da mais antiga para a mais nova"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if name.startswith('gen-') and os.path.exists(os.path.join(self.root, name, self.MANIFEST_FILE))
+        )
+
+    def read_manifest(self, index_dir: str) -> Optional[Dict]:
+        if not index_dir:
+            return None
+        try:
+            with open(os.path.join(index_dir, self.MANIFEST_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def current(self) -> Optional[str]:
+        """Nome da geração apontada por CURRENT"""
+        try:
+            with open(os.path.join(self.root, self.POINTER_FILE), 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def set_current(self, index_dir: str):
+        pointer = os.path.join(self.root, self.POINTER_FILE)
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(os.path.basename(index_dir))
+        os.replace(pointer + '.tmp', pointer)
+
+    def validate(self, index_dir: str) -> Optional[str]:
+        """Motivo pelo qual a geração não pode ser carregada (None se íntegra)"""
+        manifest = self.read_manifest(index_dir)
+        if manifest is None:
+            return "manifesto ausente ou ilegível"
+        for file_name, entry in manifest['files'].items():
+            file_path = os.path.join(index_dir, file_name)
+            if not os.path.exists(file_path):
+                return f"{file_name} ausente"
+            if os.path.getsize(file_path) != entry['size']:
+                return f"{file_name} com {os.path.getsize(file_path):,} bytes, manifesto diz {entry['size']:,}"
+            if self.verify_checksums and file_fingerprint(file_path)['sha256'] != entry['sha256']:
+                return f"SHA-256 de {file_name} não confere"
+        return None
+
+    def select(self) -> Optional[str]:
+        """Diretório a carregar: a geração de CURRENT ou, se corrompida, a mais nova íntegra"""
+        names = self.names()
+        current = self.current()
+        candidates = ([current] if current in names else []) + [name for name in reversed(names) if name != current]
+        for name in candidates:
+            index_dir = os.path.join(self.root, name)
+            problem = self.validate(index_dir)
+            if problem is None:
+                if name != current:
+                    logger.warning(f"⚠️  Geração {current} indisponível, carregando {name}")
+                    self.set_current(index_dir)
+                self.prune(index_dir)
+                return index_dir
+            logger.warning(f"⚠️  Geração {name} ignorada: {problem}")
+        return None
+
+    def previous(self, index_dir: str) -> Optional[str]:
+        """Geração íntegra mais nova anterior a `index_dir`"""
+        active = os.path.basename(index_dir)
+        for name in reversed(self.names()):
+            if name < active and self.validate(os.path.join(self.root, name)) is None:
+                return os.path.join(self.root, name)
+        return None
+
+    def begin(self, parent_dir: str, file_names: List[str]) -> str:
+        """Cria o diretório da próxima geração com hard links dos arquivos de `parent_dir`"""
+        with self.lock:
+            os.makedirs(self.root, exist_ok=True)
+            numbers = [int(name[4:]) for name in os.listdir(self.root) if name.startswith('gen-') and name[4:].isdigit()]
+            index_dir = os.path.join(self.root, f"gen-{max(numbers, default=0) + 1:06d}")
+            os.makedirs(index_dir)
+            self.building[index_dir] = linked = {}
+
+        inherited = (self.read_manifest(parent_dir) or {}).get('files', {})
+        for file_name in file_names:
+            source = os.path.join(parent_dir, file_name)
+            if not os.path.exists(source):
+                continue
+            target = os.path.join(index_dir, file_name)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)  # Sistema de arquivos sem hard links
+            linked[file_name] = (os.stat(target).st_ino, inherited.get(file_name))
+        return index_dir
+
+    def commit(self, index_dir: str, params: Dict):
+        """Fecha a geração: manifesto por último e CURRENT apontando para ela.
+
+        Arquivos que continuam sendo o link herdado reaproveitam o SHA-256 do
+        manifesto anterior; só os regravados são lidos de novo.
+        """
+        with self.lock:
+            linked = self.building.pop(index_dir, {})
+        files = {}
+        for file_name in sorted(os.listdir(index_dir)):
+            if file_name == self.MANIFEST_FILE or file_name.endswith('.tmp'):
+                continue
+            file_path = os.path.join(index_dir, file_name)
+            inode, entry = linked.get(file_name, (None, None))
+            if entry is None or os.stat(file_path).st_ino != inode:
+                fingerprint = file_fingerprint(file_path)
+                entry = {'size': fingerprint['size'], 'sha256': fingerprint['sha256']}
+            files[file_name] = entry
+
+        manifest = {'generation': os.path.basename(index_dir), 'created_at': time.time(), **params, 'files': files}
+        manifest_path = os.path.join(index_dir, self.MANIFEST_FILE)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        self.set_current(index_dir)
+        logger.info(f"🗃️ Geração {manifest['generation']} ativada ({len(files)} arquivos, "
+                    f"{sum(entry['size'] for entry in files.values()) / 1024**2:.1f} MB)")
+        self.prune(index_dir)
+
+    def discard(self, index_dir: str):
+        """Descarta uma geração cuja construção falhou"""
+        with self.lock:
+            self.building.pop(index_dir, None)
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+    def prune(self, active_dir: str):
+        """Remove gerações além das `keep` mais novas (nunca a ativa) e construções interrompidas.
+
+        Uma geração antiga ainda em uso pela memória continua válida: arquivos
+        mapeados sobrevivem à remoção do diretório.
+        """
+        with self.lock:
+            names = self.names()
+            keep = set(names[-self.keep:]) | {os.path.basename(active_dir)}
+            building = {os.path.basename(index_dir) for index_dir in self.building}
+            for name in os.listdir(self.root):
+                if name.startswith('gen-') and name not in keep and name not in building:
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def list(self, active_dir: str) -> List[Dict]:
+        """Resumo das gerações fechadas, da mais nova para a mais antiga"""
+        generations = []
+        for name in reversed(self.names()):
+            manifest = self.read_manifest(os.path.join(self.root, name)) or {}
+            generations.append({
+                "generation": name,
+                "active": name == os.path.basename(active_dir),
+                "created_at": manifest.get('created_at'),
+                "total_images": manifest.get('total_images'),
+                "total_descriptors": manifest.get('total_descriptors'),
+                "size_bytes": sum(entry['size'] for entry in manifest.get('files', {}).values())
+            })
+        return generations
+
+
+class BowIndex:
+    """Bag-of-visual-words binário: árvore de vocabulário k-majority + arquivo invertido tf-idf.
+
+    Cada nó interno da árvore guarda `branching` centros binários de 256 bits
+    (empacotados em uint64). Um descriptor desce `depth` níveis escolhendo o
+    centro mais próximo em Hamming e a folha alcançada é a sua palavra visual.
+    O arquivo invertido guarda, em formato CSR por palavra, as imagens que a
+    contêm e o peso tf-idf (normalizado L2 por imagem), de modo que a consulta
+    só toca as listas das palavras presentes nela.
+    """
+
+    def __init__(self, centers: np.ndarray, branching: int, depth: int, idf: np.ndarray,
+                 postings_ptr: np.ndarray, postings_image: np.ndarray, postings_weight: np.ndarray,
+                 n_images: int, n_descriptors: int):
+        self.centers = centers
+        self.branching = branching
+        self.depth = depth
+        self.idf = idf
+        self.postings_ptr = postings_ptr
+        self.postings_image = postings_image
+        self.postings_weight = postings_weight
+        self.n_images = n_images
+        self.n_descriptors = n_descriptors
+
+    @property
+    def n_words(self) -> int:
+        return self.branching ** self.depth
+
+    @staticmethod
+    def _level_offset(level: int, branching: int) -> int:
+        """Posição do primeiro nó de um nível na lista de nós internos (ordem por nível)"""
+        return (branching ** level - 1) // (branching - 1)
+
+    @staticmethod
+    def _kmajority(packed: np.ndarray, branching: int, iterations: int,
+                   rng: np.random.Generator) -> np.ndarray:
+        """Agrupa descriptors empacotados em `branching` centros binários (k-majority).
+
+        Como o k-means, alterna atribuição ao centro mais próximo (Hamming) e
+        atualização, mas o novo centro é o voto majoritário de cada bit.
+        """
+        initial = rng.choice(len(packed), size=branching, replace=len(packed) < branching)
+        centers = packed[initial].copy()
+
+        for _ in range(iterations):
+            assignment = hamming_distance_matrix(packed, centers).argmin(axis=1)
+            counts = np.bincount(assignment, minlength=branching)
+            nonempty = np.flatnonzero(counts)
+            starts = (np.cumsum(counts) - counts)[nonempty]
+
+            order = np.argsort(assignment, kind='stable')
+            bits = np.unpackbits(np.ascontiguousarray(packed[order]).view(np.uint8), axis=1)
+            bit_sums = np.add.reduceat(bits, starts, axis=0, dtype=np.int32)
+
+            new_centers = centers.copy()
+            majority = (bit_sums * 2 > counts[nonempty, None]).astype(np.uint8)
+            new_centers[nonempty] = np.packbits(majority, axis=1).view(np.uint64)
+            if np.array_equal(new_centers, centers):
+                break
+            centers = new_centers
+
+        return centers
+
+    @classmethod
+    def train(cls, packed_sample: np.ndarray, branching: int, depth: int, iterations: int,
+              seed: int = 0) -> np.ndarray:
+        """Treina a árvore nível a nível; retorna os centros (n_nós_internos, branching, palavras)"""
+        rng = np.random.default_rng(seed)
+        centers = np.zeros(
+            (cls._level_offset(depth, branching), branching, packed_sample.shape[1]), dtype=np.uint64
+        )
+        node = np.zeros(len(packed_sample), dtype=np.int64)
+
+        for level in range(depth):
+            offset = cls._level_offset(level, branching)
+            order = np.argsort(node, kind='stable')
+            level_nodes, starts, counts = np.unique(node[order], return_index=True, return_counts=True)
+
+            # Cada nó é treinado só com os descriptors que chegaram até ele
+            for level_node, start, count in zip(level_nodes.tolist(), starts.tolist(), counts.tolist()):
+                members = packed_sample[order[start:start + count]]
+                centers[offset + level_node] = cls._kmajority(members, branching, iterations, rng)
+
+            node = node * branching + np.concatenate([
+                cls._descend(packed_sample[start:start + 16384], centers[offset + node[start:start + 16384]])
+                for start in range(0, len(packed_sample), 16384)
+            ])
+
+        return centers
+
+    @staticmethod
+    def _descend(packed: np.ndarray, node_centers: np.ndarray) -> np.ndarray:
+        """Filho mais próximo (Hamming) de cada descriptor entre os centros do seu nó"""
+        distances = _popcount(packed[:, None, :] ^ node_centers).sum(axis=2, dtype=np.uint16)
+        return distances.argmin(axis=1)
+
+    def assign(self, packed: np.ndarray, chunk_rows: int = 16384) -> np.ndarray:
+        """Palavra visual (folha da árvore) de cada descriptor empacotado"""
+        words = np.empty(len(packed), dtype=np.int64)
+        for start in range(0, len(packed), chunk_rows):
+            chunk = np.asarray(packed[start:start + chunk_rows])
+            node = np.zeros(len(chunk), dtype=np.int64)
+            for level in range(self.depth):
+                offset = self._level_offset(level, self.branching)
+                node = node * self.branching + self._descend(chunk, self.centers[offset + node])
+            words[start:start + len(chunk)] = node
+        return words
+
+    @classmethod
+    def build(cls, store: DescriptorStore, branching: int, depth: int, iterations: int,
+              train_sample: int, seed: int = 0) -> "BowIndex":
+        """Treina o vocabulário em uma amostra do store e monta o arquivo invertido tf-idf"""
+        packed = pack_descriptors(store.descriptors)
+        n_descriptors = len(packed)
+        n_images = len(store)
+
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n_descriptors, size=min(train_sample, n_descriptors), replace=False))
+        centers = cls.train(packed[sample_rows], branching, depth, iterations, seed)
+
+        index = cls(centers, branching, depth, None, None, None, None, n_images, n_descriptors)
+        words = index.assign(packed)
+
+        # Pares (palavra, imagem) únicos, já ordenados por palavra (CSR)
+        descriptors_per_image = np.diff(store.offsets)
+        image_of_descriptor = np.repeat(np.arange(n_images, dtype=np.int64), descriptors_per_image)
+        pairs, term_counts = np.unique(words * n_images + image_of_descriptor, return_counts=True)
+        post_word = pairs // n_images
+        post_image = pairs % n_images
+
+        document_freq = np.bincount(post_word, minlength=index.n_words)
+        idf = np.log(n_images / np.maximum(document_freq, 1))
+        weights = term_counts / descriptors_per_image[post_image] * idf[post_word]
+        norms = np.sqrt(np.bincount(post_image, weights=weights ** 2, minlength=n_images))
+        weights /= np.maximum(norms[post_image], 1e-12)
+
+        index.idf = idf.astype(np.float32)
+        index.postings_ptr = np.concatenate(([0], np.cumsum(document_freq))).astype(np.int64)
+        index.postings_image = post_image.astype(np.int32)
+        index.postings_weight = weights.astype(np.float32)
+        return index
+
+    def query(self, packed_query: np.ndarray,
+              max_df_ratio: float = 1.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Score tf-idf (cosseno) das imagens que compartilham palavras com a consulta.
+
+        Palavras presentes em mais de `max_df_ratio` das imagens (stop words)
+        são ignoradas. Retorna (índices das imagens, scores, palavras em comum).
+        """
+        words, query_counts = np.unique(self.assign(packed_query), return_counts=True)
+        starts = self.postings_ptr[words]
+        lengths = self.postings_ptr[words + 1] - starts
+
+        keep = lengths <= max_df_ratio * self.n_images
+        words, query_counts, starts, lengths = words[keep], query_counts[keep], starts[keep], lengths[keep]
+
+        query_weights = query_counts / len(packed_query) * self.idf[words]
+        norm = np.sqrt(np.sum(query_weights ** 2))
+        if norm == 0 or lengths.sum() == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, np.empty(0, dtype=np.float64), empty
+        query_weights /= norm
+
+        # Concatena as listas invertidas das palavras da consulta
+        positions = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        images = self.postings_image[positions]
+        contributions = self.postings_weight[positions] * np.repeat(query_weights, lengths)
+
+        candidate_idxs, inverse = np.unique(images, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions, minlength=len(candidate_idxs))
+        shared_words = np.bincount(inverse, minlength=len(candidate_idxs))
+        return candidate_idxs.astype(np.int64), scores, shared_words
+
+    def save(self, path: str):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                centers=self.centers,
+                branching=self.branching,
+                depth=self.depth,
+                idf=self.idf,
+                postings_ptr=self.postings_ptr,
+                postings_image=self.postings_image,
+                postings_weight=self.postings_weight,
+                n_images=self.n_images,
+                n_descriptors=self.n_descriptors
+            )
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> "BowIndex":
+        with np.load(path) as data:
+            return cls(
+                data['centers'], int(data['branching']), int(data['depth']), data['idf'],
+                data['postings_ptr'], data['postings_image'], data['postings_weight'],
+                int(data['n_images']), int(data['n_descriptors'])
+            )
+
+
+class SignatureIndex:
+    """Assinatura global por imagem para o pré-filtro da fase 0.
+
+    Cada imagem vira um histograma das palavras de um vocabulário pequeno
+    (mesma árvore k-majority do BoVW, 32^2 = 1024 palavras) com raiz quadrada
+    nas contagens, peso idf e norma L2. As assinaturas formam uma única
+    matriz densa (imagens x palavras) na ordem do store, e pontuar todas as
+    imagens é um produto matriz-vetor.
+    """
+
+    def __init__(self, vocabulary: BowIndex, signatures: np.ndarray):
+        self.vocabulary = vocabulary
+        self.signatures = signatures
+
+    @property
+    def n_images(self) -> int:
+        return len(self.signatures)
+
+    def _histograms(self, words: np.ndarray, image_of_word: np.ndarray, n_images: int) -> np.ndarray:
+        """Histogramas (raiz quadrada das contagens) de um bloco de imagens"""
+        n_words = self.vocabulary.n_words
+        counts = np.bincount(image_of_word * n_words + words, minlength=n_images * n_words)
+        return np.sqrt(counts.reshape(n_images, n_words), dtype=np.float32)
+
+    def _normalize(self, histograms: np.ndarray) -> np.ndarray:
+        weighted = histograms * self.vocabulary.idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        return weighted / np.maximum(norms, 1e-12)
+
+    @classmethod
+    def build(cls, store: DescriptorStore, branching: int, depth: int, iterations: int,
+              train_sample: int, seed: int = 0, chunk_images: int = 4096) -> "SignatureIndex":
+        """Treina o vocabulário em uma amostra do store e calcula a assinatura de cada imagem"""
+        packed = pack_descriptors(store.descriptors)
+        n_images = len(store)
+
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(len(packed), size=min(train_sample, len(packed)), replace=False))
+        centers = BowIndex.train(packed[sample_rows], branching, depth, iterations, seed)
+        vocabulary = BowIndex(centers, branching, depth, None, None, None, None, n_images, len(packed))
+        index = cls(vocabulary, np.empty((n_images, vocabulary.n_words), dtype=np.float32))
+
+        # Histogramas em blocos de imagens (limita a memória do bincount)
+        for start in range(0, n_images, chunk_images):
+            end = min(start + chunk_images, n_images)
+            row_start, row_end = int(store.offsets[start]), int(store.offsets[end])
+            image_of_word = np.repeat(np.arange(end - start, dtype=np.int64), np.diff(store.offsets[start:end + 1]))
+            index.signatures[start:end] = index._histograms(
+                vocabulary.assign(packed[row_start:row_end]), image_of_word, end - start
+            )
+
+        document_freq = np.count_nonzero(index.signatures, axis=0)
+        vocabulary.idf = np.log(n_images / np.maximum(document_freq, 1)).astype(np.float32)
+        index.signatures = index._normalize(index.signatures)
+        return index
+
+    def scores(self, packed_query: np.ndarray) -> np.ndarray:
+        """Similaridade (cosseno) da consulta com todas as imagens"""
+        words = self.vocabulary.assign(packed_query)
+        query = self._normalize(self._histograms(words, np.zeros(len(words), dtype=np.int64), 1))
+        return self.signatures @ query[0]
+
+    def ranking(self, packed_query: np.ndarray, limit: int = None) -> np.ndarray:
+        """Índices das imagens em ordem decrescente de similaridade (apenas as `limit` melhores)"""
+        scores = self.scores(packed_query)
+        if limit is not None and limit < len(scores):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            return top[np.argsort(-scores[top], kind='stable')]
+        return np.argsort(-scores, kind='stable')
+
+    def save(self, path: str):
+        vocabulary = self.vocabulary
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, centers=vocabulary.centers, branching=vocabulary.branching, depth=vocabulary.depth,
+                     idf=vocabulary.idf, signatures=self.signatures, n_descriptors=vocabulary.n_descriptors)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> "SignatureIndex":
+        with np.load(path) as data:
+            signatures = data['signatures']
+            vocabulary = BowIndex(
+                data['centers'], int(data['branching']), int(data['depth']), data['idf'],
+                None, None, None, len(signatures), int(data['n_descriptors'])
+            )
+            return cls(vocabulary, signatures)
+
+
+class MihIndex:
+    """Multi-index hashing: k-NN exato em Hamming sobre códigos binários.
+
+    Usado para os descriptors ORB (256 bits) e para os pHash (64 bits). Cada
+    código é dividido em `n_substrings` substrings de 8 ou 16 bits (ORB: 16 de
+    16 bits ou 32 de 8 bits) e cada substring indexa uma tabela de endereçamento direto (CSR:
+    `ptr[t, valor]` delimita as linhas do store em `order[t]`). Se dois códigos
+    estão a distância <= m*(s+1)-1, alguma substring difere em no máximo s bits;
+    por isso a consulta sonda as tabelas com raio crescente s = 0, 1, 2... e
+    para assim que o k-ésimo vizinho está dentro desse limite.
+    """
+
+    def __init__(self, order: np.ndarray, ptr: np.ndarray, n_images: int, n_descriptors: int):
+        self.order = order
+        self.ptr = ptr
+        self.n_substrings = order.shape[0]
+        self.substring_bits = (ptr.shape[1] - 1).bit_length() - 1
+        self.n_images = n_images
+        self.n_descriptors = n_descriptors
+
+    @staticmethod
+    def substrings(packed: np.ndarray, substring_bits: int) -> np.ndarray:
+        """Substrings de cada código como colunas (N, n_substrings)"""
+        return np.ascontiguousarray(packed).view(np.uint16 if substring_bits == 16 else np.uint8)
+
+    @classmethod
+    def from_codes(cls, packed: np.ndarray, n_substrings: int, n_images: int) -> "MihIndex":
+        """Monta uma tabela por substring (ordenação estável das linhas por valor)"""
+        code_bits = packed.shape[1] * 64
+        if code_bits % n_substrings or code_bits // n_substrings not in (8, 16):
+            raise ValueError(f"{n_substrings} substrings de um código de {code_bits} bits devem ter 8 ou 16 bits")
+        substring_bits = code_bits // n_substrings
+        subs = cls.substrings(packed, substring_bits)
+        n_buckets = 1 << substring_bits
+
+        order = np.empty((n_substrings, len(subs)), dtype=np.int32)
+        ptr = np.zeros((n_substrings, n_buckets + 1), dtype=np.int64)
+        for table in range(n_substrings):
+            column = np.asarray(subs[:, table])
+            order[table] = np.argsort(column, kind='stable')
+            ptr[table, 1:] = np.cumsum(np.bincount(column, minlength=n_buckets))
+
+        return cls(order, ptr, n_images, len(subs))
+
+    @classmethod
+    def build(cls, store: DescriptorStore, n_substrings: int) -> "MihIndex":
+        """Índice sobre os descriptors ORB do store"""
+        return cls.from_codes(pack_descriptors(store.descriptors), n_substrings, len(store))
+
+    def knn(self, packed_db: np.ndarray, packed_query: np.ndarray, k: int,
+            max_radius: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """k vizinhos exatos de cada consulta entre os códigos a distância <= max_radius.
+
+        Retorna arrays planos (índice da consulta, linha do store, distância)
+        ordenados por (consulta, distância, linha), com o mesmo desempate da
+        busca exata por força bruta.
+        """
+        n_query = len(packed_query)
+        subs_query = self.substrings(packed_query, self.substring_bits).astype(np.int64)
+        max_level = min(-(-(max_radius + 1) // self.n_substrings) - 1, self.substring_bits)
+
+        best_query = np.empty(0, dtype=np.int64)
+        best_keys = np.empty(0, dtype=np.int64)
+        active = np.arange(n_query, dtype=np.int64)
+
+        for level in range(max_level + 1):
+            if len(active) == 0:
+                break
+
+            # Sonda, em todas as tabelas, os buckets a exatamente `level` bits da consulta
+            masks = masks_with_weight(self.substring_bits, level)
+            rows_found, queries_found = [], []
+            for table in range(self.n_substrings):
+                buckets = (subs_query[active, table][:, None] ^ masks[None, :]).ravel()
+                starts = self.ptr[table, buckets]
+                lengths = self.ptr[table, buckets + 1] - starts
+                total = int(lengths.sum())
+                if total == 0:
+                    continue
+                positions = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+                rows_found.append(self.order[table, positions])
+                queries_found.append(np.repeat(np.repeat(active, len(masks)), lengths))
+
+            if rows_found:
+                # Um código achado em várias tabelas gera chaves iguais, removidas na fusão
+                queries = np.concatenate(queries_found)
+                rows = np.concatenate(rows_found).astype(np.int64)
+                distances = _popcount(packed_db[rows] ^ packed_query[queries]).sum(axis=1, dtype=np.int64)
+                within = distances <= max_radius
+
+                # Funde com os melhores já encontrados (chave = distância << 40 | linha)
+                best_query, best_keys = merge_top_k(
+                    np.concatenate((best_query, queries[within])),
+                    np.concatenate((best_keys, (distances[within] << 40) | rows[within])),
+                    k
+                )
+
+            # Tudo a distância <= bound já foi encontrado: consultas com k vizinhos até ele terminam
+            bound = self.n_substrings * (level + 1) - 1
+            settled = np.bincount(best_query[(best_keys >> 40) <= bound], minlength=n_query)
+            active = active[settled[active] < k]
+
+        return best_query, best_keys & ((1 << 40) - 1), (best_keys >> 40).astype(np.uint16)
+
+    def save(self, path: str):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, order=self.order, ptr=self.ptr, n_images=self.n_images,
+                     n_descriptors=self.n_descriptors)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> "MihIndex":
+        with np.load(path) as data:
+            return cls(data['order'], data['ptr'], int(data['n_images']), int(data['n_descriptors']))
+
+
+class ImageRowIndex(abc.ABC):
+    """Base dos índices incrementais que guardam sua própria cópia dos descriptors.
+
+    Os descriptors de cada imagem ocupam linhas contíguas (`image_row_start`,
+    `image_row_count`) e `row_image` leva cada linha à sua imagem. Imagens
+    removidas apenas saem de `path_to_image` (tombstone); suas linhas ficam
+    órfãs até a próxima compactação.
+    """
+
+    def __init__(self, descriptors: np.ndarray, row_image: np.ndarray, image_paths: List[str],
+                 image_row_start: np.ndarray, image_row_count: np.ndarray, image_alive: np.ndarray):
+        self.descriptors = descriptors
+        self.row_image = row_image
+        self.image_paths = list(image_paths)
+        self.image_row_start = image_row_start
+        self.image_row_count = image_row_count
+        self.image_alive = image_alive
+        self.path_to_image = {
+            path: idx for idx, path in enumerate(self.image_paths) if self.image_alive[idx]
+        }
+
+    @staticmethod
+    def _empty_rows(descriptor_dim: int) -> Tuple:
+        return (
+            np.empty((0, descriptor_dim), dtype=np.uint8),
+            np.empty(0, dtype=np.int32),
+            [],
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=bool)
+        )
+
+    def descriptors_of(self, image_path: str) -> np.ndarray:
+        image_idx = self.path_to_image[image_path]
+        start = self.image_row_start[image_idx]
+        return self.descriptors[start:start + self.image_row_count[image_idx]]
+
+    def _append_images(self, features: Mapping) -> np.ndarray:
+        """Anexa as linhas das imagens (substituindo as já indexadas); retorna as novas linhas"""
+        paths = [path for path in features.keys() if len(features[path]) > 0]
+        self.delete([path for path in paths if path in self.path_to_image])
+        if not paths:
+            return np.empty(0, dtype=np.int32)
+
+        counts = np.array([len(features[path]) for path in paths], dtype=np.int64)
+        new_descriptors = np.concatenate([np.asarray(features[path], dtype=np.uint8) for path in paths])
+        first_row = len(self.descriptors)
+        first_image = len(self.image_paths)
+        new_images = np.arange(first_image, first_image + len(paths), dtype=np.int32)
+
+        self.descriptors = np.concatenate((self.descriptors, new_descriptors))
+        self.row_image = np.concatenate((self.row_image, np.repeat(new_images, counts)))
+        self.image_row_start = np.concatenate((self.image_row_start, first_row + np.cumsum(counts) - counts))
+        self.image_row_count = np.concatenate((self.image_row_count, counts))
+        self.image_alive = np.concatenate((self.image_alive, np.ones(len(paths), dtype=bool)))
+        self.image_paths.extend(paths)
+        self.path_to_image.update(zip(paths, new_images.tolist()))
+
+        return np.arange(first_row, first_row + len(new_descriptors), dtype=np.int32)
+
+    def _remove_images(self, image_paths: List[str]) -> List[int]:
+        """Marca as imagens como removidas; retorna seus índices"""
+        image_idxs = [self.path_to_image.pop(path) for path in image_paths if path in self.path_to_image]
+        self.image_alive[image_idxs] = False
+        return image_idxs
+
+    @abc.abstractmethod
+    def insert(self, features: Mapping, **insert_kwargs) -> int:
+        """Insere (ou substitui) imagens; retorna o número de descriptors inseridos"""
+
+    @abc.abstractmethod
+    def delete(self, image_paths: List[str]) -> int:
+        """Remove imagens do índice; retorna o número de imagens removidas"""
+
+    def sync(self, features: Mapping, **insert_kwargs) -> Tuple[int, int]:
+        """Aplica ao índice apenas as diferenças para `features` (imagens novas, alteradas e removidas)"""
+        stale = [
+            path for path in self.path_to_image
+            if path not in features or not np.array_equal(self.descriptors_of(path), features[path])
+        ]
+        n_deleted = self.delete(stale)
+        new_features = {path: features[path] for path in features if path not in self.path_to_image}
+        self.insert(new_features, **insert_kwargs)
+        return len(new_features), n_deleted
+
+    def _row_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'descriptors': self.descriptors,
+            'row_image': self.row_image,
+            'image_paths': np.array(self.image_paths, dtype=str),
+            'image_row_start': self.image_row_start,
+            'image_row_count': self.image_row_count,
+            'image_alive': self.image_alive
+        }
+
+    @staticmethod
+    def _rows_from(data) -> Tuple:
+        return (
+            data['descriptors'], data['row_image'], data['image_paths'].tolist(),
+            data['image_row_start'], data['image_row_count'], data['image_alive']
+        )
+
+
+class LshIndex(ImageRowIndex):
+    """LSH por amostragem de bits (multi-probe) com inserção e remoção incrementais.
+
+    Cada uma das `n_tables` tabelas usa como chave `n_bits` bits sorteados dos
+    256 do descriptor ORB. As tabelas são arrays ordenados por chave (linhas
+    do índice em `sorted_rows[t]`): inserir um lote é um merge com
+    ``np.insert`` e remover filtra as linhas das tabelas, sem reconstruir nada.
+    A consulta sonda, em cada tabela, a chave do descriptor e as chaves a até
+    `probe_radius` bits dela (multi-probe).
+    """
+
+    def __init__(self, positions: np.ndarray, sorted_keys: List[np.ndarray], sorted_rows: List[np.ndarray],
+                 *rows):
+        super().__init__(*rows)
+        self.positions = positions
+        self.sorted_keys = list(sorted_keys)
+        self.sorted_rows = list(sorted_rows)
+
+    @property
+    def n_tables(self) -> int:
+        return self.positions.shape[0]
+
+    @property
+    def n_bits(self) -> int:
+        return self.positions.shape[1]
+
+    @property
+    def n_live_rows(self) -> int:
+        return len(self.sorted_rows[0]) if self.sorted_rows else 0
+
+    @property
+    def n_dead_rows(self) -> int:
+        return len(self.descriptors) - self.n_live_rows
+
+    @classmethod
+    def create(cls, n_tables: int, n_bits: int, descriptor_dim: int = 32, seed: int = 0) -> "LshIndex":
+        """Índice vazio com `n_bits` posições sorteadas (sem repetição) por tabela"""
+        rng = np.random.default_rng(seed)
+        positions = np.stack([
+            np.sort(rng.choice(descriptor_dim * 8, size=n_bits, replace=False)) for _ in range(n_tables)
+        ])
+        return cls(
+            positions,
+            [np.empty(0, dtype=np.int64) for _ in range(n_tables)],
+            [np.empty(0, dtype=np.int32) for _ in range(n_tables)],
+            *cls._empty_rows(descriptor_dim)
+        )
+
+    def hash(self, descriptors: np.ndarray, chunk_rows: int = 16384) -> np.ndarray:
+        """Chaves (n_tables, N) dos descriptors uint8 em todas as tabelas"""
+        weights = np.int64(1) << np.arange(self.n_bits, dtype=np.int64)
+        keys = np.empty((self.n_tables, len(descriptors)), dtype=np.int64)
+        for start in range(0, len(descriptors), chunk_rows):
+            bits = np.unpackbits(np.asarray(descriptors[start:start + chunk_rows]), axis=1)
+            keys[:, start:start + len(bits)] = (bits[:, self.positions].astype(np.int64) @ weights).T
+        return keys
+
+    def insert(self, features: Mapping) -> int:
+        """Insere (ou substitui) imagens em lote; retorna o número de descriptors inseridos"""
+        new_rows = self._append_images(features)
+        if len(new_rows) == 0:
+            return 0
+
+        # Merge do lote (ordenado) em cada tabela
+        new_keys = self.hash(self.descriptors[new_rows[0]:])
+        for table in range(self.n_tables):
+            order = np.argsort(new_keys[table], kind='stable')
+            positions = np.searchsorted(self.sorted_keys[table], new_keys[table][order], side='right')
+            self.sorted_keys[table] = np.insert(self.sorted_keys[table], positions, new_keys[table][order])
+            self.sorted_rows[table] = np.insert(self.sorted_rows[table], positions, new_rows[order])
+
+        return len(new_rows)
+
+    def delete(self, image_paths: List[str]) -> int:
+        """Remove imagens das tabelas; retorna o número de imagens removidas"""
+        image_idxs = self._remove_images(image_paths)
+        if not image_idxs:
+            return 0
+
+        dead_rows = ~self.image_alive[self.row_image]
+        for table in range(self.n_tables):
+            keep = ~dead_rows[self.sorted_rows[table]]
+            self.sorted_keys[table] = self.sorted_keys[table][keep]
+            self.sorted_rows[table] = self.sorted_rows[table][keep]
+
+        return len(image_idxs)
+
+    def compact(self) -> "LshIndex":
+        """Novo índice só com as imagens vivas (descarta linhas órfãs)"""
+        compacted = LshIndex.create(self.n_tables, self.n_bits, self.descriptors.shape[1])
+        compacted.positions = self.positions
+        compacted.insert({path: self.descriptors_of(path) for path in self.path_to_image})
+        return compacted
+
+    def knn(self, packed_query: np.ndarray, query_descriptors: np.ndarray, k: int,
+            probe_radius: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """k vizinhos aproximados por consulta entre os candidatos das tabelas.
+
+        Retorna arrays planos (índice da consulta, linha do índice, distância)
+        ordenados por (consulta, distância, linha).
+        """
+        packed_db = pack_descriptors(self.descriptors)
+        masks = np.concatenate([masks_with_weight(self.n_bits, weight) for weight in range(probe_radius + 1)])
+        query_keys = self.hash(query_descriptors)
+        n_query = len(query_descriptors)
+
+        rows_found, queries_found = [], []
+        for table in range(self.n_tables):
+            probes = (query_keys[table][:, None] ^ masks[None, :]).ravel()
+            starts = np.searchsorted(self.sorted_keys[table], probes, side='left')
+            lengths = np.searchsorted(self.sorted_keys[table], probes, side='right') - starts
+            total = int(lengths.sum())
+            if total == 0:
+                continue
+            positions = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+            rows_found.append(self.sorted_rows[table][positions])
+            queries_found.append(np.repeat(np.repeat(np.arange(n_query, dtype=np.int64), len(masks)), lengths))
+
+        if not rows_found:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.uint16)
+
+        queries = np.concatenate(queries_found)
+        rows = np.concatenate(rows_found).astype(np.int64)
+        distances = _popcount(packed_db[rows] ^ packed_query[queries]).sum(axis=1, dtype=np.int64)
+        best_query, best_keys = merge_top_k(queries, (distances << 40) | rows, k)
+        return best_query, best_keys & ((1 << 40) - 1), (best_keys >> 40).astype(np.uint16)
+
+    def save(self, path: str):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                positions=self.positions,
+                sorted_keys=np.stack(self.sorted_keys),
+                sorted_rows=np.stack(self.sorted_rows),
+                **self._row_arrays()
+            )
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> "LshIndex":
+        with np.load(path) as data:
+            return cls(
+                data['positions'], list(data['sorted_keys']), list(data['sorted_rows']),
+                *cls._rows_from(data)
+            )
+
+
+class GraphIndex(ImageRowIndex):
+    """Grafo navegável de mundo pequeno (NSW) em Hamming com inserção incremental.
+
+    Cada linha guarda até `max_degree` vizinhos (`neighbors`, -1 = vazio). A
+    busca é um beam search guloso executado em lote para todos os descriptors
+    de consulta: cada consulta mantém os `ef` melhores nós vistos, expande o
+    melhor ainda não expandido e termina quando todos já foram expandidos.
+    Pontos de entrada sorteados fazem o papel das camadas superiores do HNSW.
+
+    A inserção é feita em lotes: os candidatos de cada novo nó (busca no grafo
+    + força bruta dentro do lote) passam pela heurística de diversidade do
+    HNSW e os vizinhos escolhidos recebem a aresta reversa, mantendo os
+    `max_degree` mais próximos. Imagens removidas continuam navegáveis, mas
+    são filtradas dos resultados.
+    """
+
+    INF = np.iinfo(np.int64).max
+    ROW_MASK = (1 << 40) - 1
+
+    def __init__(self, neighbors: np.ndarray, entry_points: np.ndarray, *rows):
+        super().__init__(*rows)
+        self.neighbors = neighbors
+        self.entry_points = entry_points
+
+    @property
+    def max_degree(self) -> int:
+        return self.neighbors.shape[1]
+
+    @property
+    def n_dead_rows(self) -> int:
+        return int(np.count_nonzero(~self.image_alive[self.row_image]))
+
+    @classmethod
+    def create(cls, max_degree: int, descriptor_dim: int = 32) -> "GraphIndex":
+        return cls(
+            np.empty((0, max_degree), dtype=np.int32),
+            np.empty(0, dtype=np.int64),
+            *cls._empty_rows(descriptor_dim)
+        )
+
+    def _keys(self, packed_db: np.ndarray, rows: np.ndarray, packed_query: np.ndarray) -> np.ndarray:
+        """Chaves (distância << 40 | linha) de cada consulta para as linhas (Q, K); -1 vira INF"""
+        distances = _popcount(packed_db[rows] ^ packed_query[:, None, :]).sum(axis=2, dtype=np.int64)
+        keys = (distances << 40) | rows
+        keys[rows < 0] = self.INF
+        return keys
+
+    def beam_search(self, packed_db: np.ndarray, packed_query: np.ndarray, ef: int,
+                    expand_width: int = 1) -> Tuple[np.ndarray, int]:
+        """Beam search em lote; retorna as `ef` melhores chaves de cada consulta (ordenadas) e as expansões.
+
+        Durante a busca o pool usa chaves (distância << 41 | linha << 1 | expandido):
+        um único ``np.sort`` ordena, e uma repetição do mesmo nó fica ao lado da
+        sua versão expandida, que é a mantida. A cada passo cada consulta
+        expande até `expand_width` nós.
+        """
+        n_query = len(packed_query)
+        entry_keys = np.sort(self._keys(
+            packed_db, np.broadcast_to(self.entry_points, (n_query, len(self.entry_points))), packed_query
+        ), axis=1)
+
+        pool = np.full((n_query, ef), self.INF, dtype=np.int64)
+        n_entry = min(ef, entry_keys.shape[1])
+        pool[:, :n_entry] = ((entry_keys[:, :n_entry] >> 40) << 41) | ((entry_keys[:, :n_entry] & self.ROW_MASK) << 1)
+
+        active = np.arange(n_query)
+        expansions = 0
+        while len(active) > 0:
+            active_pool = pool[active]
+            unexpanded = (active_pool & 1) == 0
+            pending = unexpanded.any(axis=1)
+            active, active_pool, unexpanded = active[pending], active_pool[pending], unexpanded[pending]
+            if len(active) == 0:
+                break
+
+            # Melhores nós ainda não expandidos de cada consulta
+            slot = np.cumsum(unexpanded, axis=1) - 1
+            lanes, positions = np.nonzero(unexpanded & (slot < expand_width))
+            chosen_rows = (active_pool[lanes, positions] >> 1) & self.ROW_MASK
+            active_pool[lanes, positions] |= 1
+            expansions += len(lanes)
+
+            neighbor_rows = self.neighbors[chosen_rows].astype(np.int64)
+            distances = _popcount(
+                packed_db[neighbor_rows] ^ packed_query[active[lanes]][:, None, :]
+            ).sum(axis=2, dtype=np.int64)
+            new_keys = np.where(neighbor_rows >= 0, (distances << 41) | (neighbor_rows << 1), self.INF)
+
+            block = np.full((len(active), expand_width, self.max_degree), self.INF, dtype=np.int64)
+            block[lanes, slot[lanes, positions]] = new_keys
+            merged = np.sort(np.concatenate((active_pool, block.reshape(len(active), -1)), axis=1), axis=1)
+
+            duplicate = (merged[:, :-1] >> 1) == (merged[:, 1:] >> 1)
+            merged[:, :-1][duplicate] = self.INF
+            pool[active] = np.sort(merged, axis=1)[:, :ef]
+
+        keys = ((pool >> 41) << 40) | ((pool >> 1) & self.ROW_MASK)
+        return np.where(pool == self.INF, self.INF, keys), expansions
+
+    def knn(self, packed_query: np.ndarray, k: int, ef: int,
+            expand_width: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """k vizinhos aproximados (imagens vivas) por consulta.
+
+        Retorna (índice da consulta, linha do índice, distância, expansões),
+        com os arrays ordenados por (consulta, distância, linha).
+        """
+        if len(self.entry_points) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.uint16), 0
+
+        pool, expansions = self.beam_search(pack_descriptors(self.descriptors), packed_query, max(ef, k), expand_width)
+        query_idx = np.repeat(np.arange(len(packed_query), dtype=np.int64), pool.shape[1])
+        keys = pool.ravel()
+
+        valid = keys != self.INF
+        query_idx, keys = query_idx[valid], keys[valid]
+        alive = self.image_alive[self.row_image[keys & self.ROW_MASK]]
+        query_idx, keys = query_idx[alive], keys[alive]
+
+        rank = np.arange(len(query_idx)) - np.searchsorted(query_idx, query_idx, side='left')
+        query_idx, keys = query_idx[rank < k], keys[rank < k]
+        return query_idx, keys & self.ROW_MASK, (keys >> 40).astype(np.uint16), expansions
+
+    def _select_diverse(self, packed_db: np.ndarray, candidates: np.ndarray, chunk_rows: int = 256) -> np.ndarray:
+        """Heurística de vizinhos do HNSW em lote.
+
+        Percorre os candidatos (chaves ordenadas por distância) e aceita um
+        candidato só se ele está mais perto do nó do que de todos os já
+        aceitos, o que espalha as arestas em direções diferentes. As vagas que
+        sobram são preenchidas com os descartados mais próximos.
+        """
+        n_nodes, n_candidates = candidates.shape
+        selected = np.zeros((n_nodes, n_candidates), dtype=bool)
+        candidate_rows = np.where(candidates == self.INF, 0, candidates & self.ROW_MASK)
+        node_distances = candidates >> 40
+
+        for start in range(0, n_nodes, chunk_rows):
+            packed = packed_db[candidate_rows[start:start + chunk_rows]]
+            pairwise = _popcount(packed[:, :, None, :] ^ packed[:, None, :, :]).sum(axis=3, dtype=np.int64)
+            chunk_selected = selected[start:start + chunk_rows]
+            chunk_distances = node_distances[start:start + chunk_rows]
+            for j in range(n_candidates):
+                # Mais perto do nó que de qualquer vizinho já aceito
+                dominated = (chunk_selected[:, :j] & (pairwise[:, j, :j] <= chunk_distances[:, j:j + 1])).any(axis=1)
+                chunk_selected[:, j] = ~dominated & (chunk_selected.sum(axis=1) < self.max_degree)
+
+        selected &= candidates != self.INF
+        # Aceitos primeiro (em ordem de distância), depois os descartados mais próximos
+        order = np.argsort(~selected, axis=1, kind='stable')[:, :self.max_degree]
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def insert(self, features: Mapping, ef_construction: int = 64, expand_width: int = 1,
+               batch_size: int = 1024, n_entry_points: int = 1024, seed: int = 0) -> int:
+        """Insere (ou substitui) imagens em lotes, ligando os novos nós ao grafo"""
+        new_rows = self._append_images(features)
+        if len(new_rows) == 0:
+            return 0
+
+        self.neighbors = np.concatenate((
+            self.neighbors, np.full((len(new_rows), self.max_degree), -1, dtype=np.int32)
+        ))
+        packed_db = pack_descriptors(self.descriptors)
+        rng = np.random.default_rng(seed + len(self.descriptors))
+
+        for batch_start in range(0, len(new_rows), batch_size):
+            batch = new_rows[batch_start:batch_start + batch_size].astype(np.int64)
+            packed_batch = packed_db[batch]
+
+            # Candidatos: força bruta dentro do lote + busca no grafo já existente
+            candidates = self._keys(packed_db, np.broadcast_to(batch, (len(batch), len(batch))), packed_batch)
+            np.fill_diagonal(candidates, self.INF)
+            if len(self.entry_points) > 0:
+                graph_keys, _ = self.beam_search(packed_db, packed_batch, ef_construction, expand_width)
+                candidates = np.concatenate((graph_keys, candidates), axis=1)
+
+            pool_size = min(2 * self.max_degree, candidates.shape[1])
+            nearest = np.sort(np.partition(candidates, pool_size - 1, axis=1)[:, :pool_size], axis=1)
+            nearest = self._select_diverse(packed_db, nearest)
+            degree = nearest.shape[1]
+            forward = np.where(nearest == self.INF, -1, nearest & self.ROW_MASK)
+            self.neighbors[batch, :degree] = forward
+
+            # Arestas reversas: cada vizinho mantém os max_degree mais próximos entre os atuais e os novos
+            sources = np.repeat(batch, degree)
+            targets = forward.ravel()
+            reverse_keys = (nearest.ravel() >> 40 << 40) | sources
+            valid = targets >= 0
+            sources, targets, reverse_keys = sources[valid], targets[valid], reverse_keys[valid]
+
+            unique_targets = np.unique(targets)
+            current = self.neighbors[unique_targets].astype(np.int64)
+            current_keys = self._keys(packed_db, current, packed_db[unique_targets])
+            group = np.concatenate((
+                np.repeat(np.arange(len(unique_targets)), self.max_degree),
+                np.searchsorted(unique_targets, targets)
+            ))
+            keys = np.concatenate((current_keys.ravel(), reverse_keys))
+            finite = keys != self.INF
+            group, keys = merge_top_k(group[finite], keys[finite], self.max_degree)
+
+            rank = np.arange(len(group)) - np.searchsorted(group, group, side='left')
+            updated = np.full((len(unique_targets), self.max_degree), -1, dtype=np.int32)
+            updated[group, rank] = keys & self.ROW_MASK
+            self.neighbors[unique_targets] = updated
+
+            # Pontos de entrada sorteados entre os nós já ligados
+            missing = n_entry_points - len(self.entry_points)
+            if missing > 0:
+                extra = rng.choice(batch, size=min(missing, len(batch)), replace=False)
+                self.entry_points = np.concatenate((self.entry_points, np.sort(extra)))
+
+        return len(new_rows)
+
+    def delete(self, image_paths: List[str]) -> int:
+        """Remove imagens dos resultados (os nós continuam no grafo até a compactação)"""
+        return len(self._remove_images(image_paths))
+
+    def compact(self, **insert_kwargs) -> "GraphIndex":
+        """Novo grafo só com as imagens vivas"""
+        compacted = GraphIndex.create(self.max_degree, self.descriptors.shape[1])
+        compacted.insert({path: self.descriptors_of(path) for path in self.path_to_image}, **insert_kwargs)
+        return compacted
+
+    def save(self, path: str):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, neighbors=self.neighbors, entry_points=self.entry_points, **self._row_arrays())
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> "GraphIndex":
+        with np.load(path) as data:
+            return cls(data['neighbors'], data['entry_points'], *cls._rows_from(data))
+
+
+class DeltaIndex(ImageRowIndex):
+    """Imagens adicionadas online desde a última construção do Annoy.
+
+    Pequeno o bastante para busca exata: a consulta compara cada descriptor
+    com todas as linhas vivas. Quem altera o delta trabalha numa cópia
+    (`copy`) e publica a cópia pronta, então buscas em andamento nunca veem
+    um delta pela metade.
+    """
+
+    @classmethod
+    def create(cls, descriptor_dim: int = 32) -> "DeltaIndex":
+        return cls(*cls._empty_rows(descriptor_dim))
+
+    @property
+    def live_rows(self) -> np.ndarray:
+        return np.flatnonzero(self.image_alive[self.row_image])
+
+    def insert(self, features: Mapping) -> int:
+        """Insere (ou substitui) imagens; retorna o número de descriptors inseridos"""
+        return len(self._append_images(features))
+
+    def delete(self, image_paths: List[str]) -> int:
+        """Remove imagens (linhas órfãs até a compactação); retorna o número de imagens removidas"""
+        return len(self._remove_images(image_paths))
+
+    def copy(self) -> "DeltaIndex":
+        """Cópia que pode ser alterada sem afetar buscas que leem este delta"""
+        return DeltaIndex(self.descriptors, self.row_image, self.image_paths, self.image_row_start,
+                          self.image_row_count, self.image_alive.copy())
+
+    def save(self, path: str, tombstones: frozenset, metadata: Dict):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                **self._row_arrays(),
+                tombstones=np.array(sorted(tombstones), dtype=str),
+                metadata=np.array(json.dumps(metadata))
+            )
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["DeltaIndex", frozenset, Dict]:
+        with np.load(path) as data:
+            return (
+                cls(*cls._rows_from(data)),
+                frozenset(data['tombstones'].tolist()),
+                json.loads(str(data['metadata']))
+            )
+
+
+class ResultCache:
+    """Cache LRU de resultados de busca com orçamento em bytes.
+
+    As chaves combinam o hash do upload, o top_k e a configuração de busca
+    ativa. `clear()` incrementa a geração: uma busca iniciada antes de uma
+    reconstrução não grava seu resultado (já desatualizado) depois dela.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # chave -> (valor, bytes)
+        self.bytes_used = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, generation: int):
+        """Guarda o valor (tamanho estimado pelo JSON) se a geração ainda é a atual"""
+        size = len(json.dumps(value, default=str))
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if key in self.entries:
+                self._drop(key)
+            self._store(key, value, size)
+            self._evict()
+
+    def _store(self, key, value, size: int):
+        self.entries[key] = (value, size)
+        self.bytes_used += size
+
+    def _drop(self, key):
+        self.bytes_used -= self.entries.pop(key)[1]
+
+    def _evict(self):
+        while self.bytes_used > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def resize(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes_used = 0
+            self.generation += 1
+
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes_used": self.bytes_used,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "generation": self.generation
+            }
+
+
+class NearDuplicateCache(ResultCache):
+    """Segundo nível do cache: resultados indexados pelo pHash da imagem decodificada.
+
+    Reenvios recomprimidos ou redimensionados (apps de mensagem) não repetem os
+    bytes, mas o pHash fica a poucos bits. A chave é (escopo, pHash), onde o
+    escopo é top_k + configuração de busca; `get_near` devolve o resultado do
+    pHash mais próximo dentro do raio. A precisão é medida por amostragem:
+    parte dos acertos é conferida com a busca completa (`record_verification`).
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(max_bytes)
+        self.scopes = {}  # escopo -> {pHash: None} (códigos presentes no cache)
+        self.verified = 0
+        self.agreed = 0
+
+    def _store(self, key, value, size: int):
+        super()._store(key, value, size)
+        self.scopes.setdefault(key[0], {})[key[1]] = None
+
+    def _drop(self, key):
+        super()._drop(key)
+        codes = self.scopes[key[0]]
+        del codes[key[1]]
+        if not codes:
+            del self.scopes[key[0]]
+
+    def get_near(self, scope, code: int, max_radius: int):
+        """Retorna (valor, distância) do pHash mais próximo dentro do raio, ou None"""
+        with self.lock:
+            codes = self.scopes.get(scope)
+            if codes:
+                cached = np.fromiter(codes, dtype=np.uint64, count=len(codes))
+                distances = _popcount(cached ^ np.uint64(code))
+                best = int(np.argmin(distances))
+                if distances[best] <= max_radius:
+                    key = (scope, int(cached[best]))
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key][0], int(distances[best])
+            self.misses += 1
+            return None
+
+    def record_verification(self, agreed: bool):
+        with self.lock:
+            self.verified += 1
+            self.agreed += agreed
+
+    def clear(self):
+        with self.lock:
+            self.scopes.clear()
+        super().clear()
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self.lock:
+            stats.update({
+                "verified": self.verified,
+                "agreed": self.agreed,
+                "precision": round(self.agreed / self.verified, 4) if self.verified else None
+            })
+        return stats
+
+
+def _resolve_waiter(waiter: asyncio.Future):
+    """Resolve um Future de espera que ainda não foi cancelado (roda no event loop dele)"""
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class BoundedExecutor:
+    """Pool de threads com fila limitada para o trabalho pesado das requisições.
+
+    Decodificação, extração ORB e busca saem do event loop do FastAPI. Com
+    `max_workers` ocupados e `max_queue` tarefas esperando, `submit` recusa
+    (retorna None) em vez de acumular latência. Mede a profundidade da fila e
+    o tempo de espera até uma thread pegar a tarefa. Quem prefere esperar a vez
+    (busca em lote) aguarda `slot_available()`, acordado quando uma tarefa sai.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, wait_window: int = 1000):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search")
+        self.waiting = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=wait_window)  # Segundos na fila das últimas tarefas
+        self.slot_waiters = []  # (event loop, Future asyncio) esperando lugar na fila
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> Optional[concurrent.futures.Future]:
+        """Agenda `fn` no pool; retorna None se a fila estiver cheia"""
+        with self.lock:
+            if self.waiting + self.running >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                return None
+            self.waiting += 1
+            self.submitted += 1
+            executor = self.executor
+        enqueued_at = time.perf_counter()
+
+        def task():
+            with self.lock:
+                self.waiting -= 1
+                self.running += 1
+                self.wait_times.append(time.perf_counter() - enqueued_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+                self._wake_slot_waiters()
+
+        def release_cancelled(future: concurrent.futures.Future):
+            # Cancelada antes de rodar (cliente desistiu): `task` nunca executa e o lugar na fila volta aqui
+            if future.cancelled():
+                with self.lock:
+                    self.waiting -= 1
+                self._wake_slot_waiters()
+
+        future = executor.submit(task)
+        future.add_done_callback(release_cancelled)
+        return future
+
+    def slot_available(self) -> asyncio.Future:
+        """Future do event loop atual resolvido quando houver lugar para um `submit`"""
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with self.lock:
+            if self.waiting + self.running < self.max_workers + self.max_queue:
+                waiter.set_result(None)
+            else:
+                self.slot_waiters.append((loop, waiter))
+        return waiter
+
+    def _wake_slot_waiters(self):
+        """Acorda todos os que esperam lugar; quem perder a corrida do `submit` volta a esperar"""
+        with self.lock:
+            waiters, self.slot_waiters = self.slot_waiters, []
+        for loop, waiter in waiters:
+            # Esperas canceladas ou de loops já encerrados (cliente desconectou) ficam para trás
+            if not waiter.done() and not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve_waiter, waiter)
+
+    def resize(self, max_workers: int, max_queue: int):
+        """Troca o pool; tarefas já aceitas terminam no pool antigo"""
+        with self.lock:
+            self.max_queue = max_queue
+            if max_workers != self.max_workers:
+                self.executor.shutdown(wait=False)
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="search"
+                )
+                self.max_workers = max_workers
+        self._wake_slot_waiters()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            wait_ms = np.array(self.wait_times) * 1000
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self.waiting,
+                "running": self.running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_ms_p50": round(float(np.percentile(wait_ms, 50)), 3) if len(wait_ms) else 0.0,
+                "wait_ms_p95": round(float(np.percentile(wait_ms, 95)), 3) if len(wait_ms) else 0.0,
+                "wait_ms_max": round(float(wait_ms.max()), 3) if len(wait_ms) else 0.0
+            }
+
+
+class MicroBatcher:
+    """Agrupa consultas concorrentes em lotes por janela de tempo ou tamanho.
+
+    Cada requisição entrega seu item e espera o Future. Uma thread despachante
+    junta o que chegar em até `window_ms` após a primeira consulta (ou até
+    `max_size` consultas), chama `run_batch` uma vez para o lote e devolve a
+    cada requisição o seu resultado.
+    """
+
+    def __init__(self, run_batch, window_ms: float, max_size: int):
+        self.run_batch = run_batch
+        self.window_ms = window_ms
+        self.max_size = max_size
+        self.pending = []  # (item, future, instante de chegada)
+        self.condition = threading.Condition()
+        self.thread = None
+        self.batches = 0
+        self.queries = 0
+        self.size_histogram = {}  # tamanho do lote -> quantidade de lotes
+        self.queue_wait_total = 0.0  # Segundos entre a chegada e o despacho, somados
+
+    def submit(self, item) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._dispatch_loop, name="micro-batcher", daemon=True)
+                self.thread.start()
+            self.pending.append((item, future, time.perf_counter()))
+            self.condition.notify()
+        return future
+
+    def _dispatch_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = self.pending[0][2] + self.window_ms / 1000
+                while len(self.pending) < self.max_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:self.max_size]
+                del self.pending[:self.max_size]
+                
+                dispatched_at = time.perf_counter()
+                self.batches += 1
+                self.queries += len(batch)
+                self.size_histogram[len(batch)] = self.size_histogram.get(len(batch), 0) + 1
+                self.queue_wait_total += sum(dispatched_at - arrived_at for _, _, arrived_at in batch)
+
+            try:
+                results = self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+
+    def stats(self) -> Dict:
+        with self.condition:
+            return {
+                "window_ms": self.window_ms,
+                "max_size": self.max_size,
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": round(self.queries / self.batches, 3) if self.batches else 0.0,
+                "batch_size_histogram": dict(sorted(self.size_histogram.items())),
+                "mean_queue_wait_ms": round(self.queue_wait_total / self.queries * 1000, 3) if self.queries else 0.0,
+                "pending": len(self.pending)
+            }
+
+
+class JobRegistry:
+    """Tarefas longas (reconstruções) executadas em threads fora das requisições.
+
+    Cada tarefa recebe um id e passa por queued → running → succeeded/failed;
+    o resultado ou o erro fica disponível para consulta. Uma tarefa do mesmo
+    tipo ainda pendente é reaproveitada em vez de agendar outra igual. Guarda
+    só as `max_jobs` mais recentes.
+    """
+
+    def __init__(self, max_jobs: int = 100):
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()  # id -> estado da tarefa
+        self.lock = threading.Lock()
+
+    def submit(self, kind: str, fn) -> Dict:
+        with self.lock:
+            for job in self.jobs.values():
+                if job["kind"] == kind and job["status"] in ("queued", "running"):
+                    return dict(job)
+            job = {
+                "id": uuid.uuid4().hex,
+                "kind": kind,
+                "status": "queued",
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            self.jobs[job["id"]] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+            snapshot = dict(job)
+        threading.Thread(target=self._run, args=(job, fn), name=f"job-{kind}", daemon=True).start()
+        return snapshot
+
+    def _run(self, job: Dict, fn):
+        with self.lock:
+            job["status"], job["started_at"] = "running", time.time()
+        try:
+            result = fn()
+        except Exception as e:
+            logger.error(f"❌ Tarefa {job['kind']} ({job['id']}) falhou: {e}")
+            with self.lock:
+                job["status"], job["error"] = "failed", str(e)
+        else:
+            with self.lock:
+                job["status"], job["result"] = "succeeded", result
+        finally:
+            with self.lock:
+                job["finished_at"] = time.time()
+
+    def _view(self, job: Dict) -> Dict:
+        view = dict(job)
+        if job["started_at"] is not None:
+            view["elapsed_seconds"] = round((job["finished_at"] or time.time()) - job["started_at"], 3)
+        return view
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._view(job) if job is not None else None
+
+    def active(self, kind: str) -> Optional[Dict]:
+        """Tarefa do tipo `kind` ainda na fila ou em execução"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job["kind"] == kind and job["status"] in ("queued", "running"):
+                    return self._view(job)
+            return None
+
+    def list(self) -> List[Dict]:
+        with self.lock:
+            return [self._view(job) for job in reversed(self.jobs.values())]
+
+
 class ImageMatcher:
+    # Configurações que mudam o resultado de uma busca (entram na chave do cache de resultados)
+    SEARCH_CONFIG_FIELDS = (
+        'early_stop_threshold', 'min_threshold', 'use_parallel_search', 'batch_size', 'max_workers',
+        'use_annoy', 'annoy_search_k', 'annoy_neighbors', 'rerank_candidates', 'search_backend',
+        'exact_neighbors', 'bow_max_df_ratio', 'mih_neighbors', 'mih_max_radius',
+        'lsh_probe_radius', 'lsh_neighbors', 'graph_ef_search', 'graph_neighbors', 'graph_expand_width',
+        'use_signature_prefilter', 'signature_shortlist', 'use_phash_fast_path', 'phash_max_radius',
+        'phash_verify_threshold'
+    )
+
+    # Versão do pré-processamento/extração: incremente ao mudar `preprocess_image` (invalida o manifesto)
+    FEATURE_PIPELINE_VERSION = 1
+
+    # Extensões indexadas pela ingestão (e aceitas em POST /database/images)
+    DATABASE_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+
+    # Estado produzido pelas construções (trocado de uma vez ao promover uma nova geração)
+    INDEX_STATE_FIELDS = (
+        'database_features', 'database_metadata', 'annoy_index', 'annoy_id_to_image',
+        'annoy_id_to_descriptor_idx', 'annoy_image_paths', 'bow_index', 'signature_index',
+        'phash_codes', 'phash_index', '_phash_valid', 'mih_index', 'lsh_index', 'graph_index',
+        'delta_index', 'tombstones', 'ingest_errors'
+    )
+
+    # Arquivos gravados em cada geração de `index_generations/` (o delta online fica na raiz)
+    INDEX_FILE_FIELDS = (
+        'features_store_file', 'features_offsets_file', 'features_paths_file', 'metadata_cache_file',
+        'annoy_index_file', 'annoy_mapping_file', 'bow_index_file', 'mih_index_file', 'lsh_index_file',
+        'graph_index_file', 'signature_index_file', 'manifest_file'
+    )
+
+    # Estado do processo da API que não vai para os processos dos pools (locks, executores,
+    # caches e objetos nativos); ORB e Annoy são recriados no processo filho
+    WORKER_EXCLUDED_FIELDS = (
+        'index_generations', 'result_cache', 'query_cache', 'search_executor', 'micro_batcher',
+        'orb', 'annoy_index', 'superseded_by', 'phash_stats_lock', 'graph_stats_lock', '_query_executor',
+        '_query_executor_lock', '_process_pool', '_process_pool_lock', '_ingest_lock', '_rebuild_in_progress'
+    )
+
+    def __setattr__(self, name, value):
+        # Toda atribuição de índice (construção, carga do disco, promoção de geração) muda a
+        # versão do estado; o pool de processos compara essa versão para saber se está defasado
+        if name in self.INDEX_STATE_FIELDS:
+            object.__setattr__(self, '_index_version', next(_index_versions))
+        object.__setattr__(self, name, value)
+
     def __init__(self, database_path: str = "image_data"):
         self.database_path = database_path
-        self.features_cache_file = "features_cache.pkl"
+        self.features_cache_file = "features_cache.pkl"  # Formato legado (migrado automaticamente)
+        self.features_store_file = "features_store.npy"
+        self.features_offsets_file = "features_offsets.npy"
+        self.features_paths_file = "features_paths.json"
         self.metadata_cache_file = "metadata_cache.json"
         self.annoy_index_file = "annoy_index.ann"
-        self.annoy_mapping_file = "annoy_mapping.json"
+        self.annoy_mapping_file = "annoy_mapping.npz"
+        self.bow_index_file = "bow_index.npz"
+        self.mih_index_file = "mih_index.npz"
+        self.lsh_index_file = "lsh_index.npz"
+        self.graph_index_file = "graph_index.npz"
+        self.signature_index_file = "signature_index.npz"
+        self.manifest_file = "ingest_manifest.json"
+        self.delta_index_file = "delta_index.npz"
+        self.index_dir = ""  # Geração em disco dos arquivos acima ("" = raiz, formato sem gerações)
+        self.index_generations = IndexGenerations("index_generations", keep=3)
+        self._index_depth = 0  # Transações de gravação abertas (ver `_index_transaction`)
+        self._index_parent = None  # Geração de origem enquanto uma nova está aberta
+        
+        # 🎯 CONFIGURAÇÕES DE PERFORMANCE MELHORADAS
+        self.early_stop_threshold = 0.98  # 🔧 Reduzido para encontrar bons matches mais rápido
+        self.min_threshold = 0.2  # 🔧 Reduzido para capturar mais candidatos iniciais
+        self.hybrid_threshold = 0.3  # 🔧 NOVO: Threshold específico para busca híbrida
+        self.max_workers = 16  # Número de threads para busca paralela
+        self.use_parallel_search = True  # Habilita/desabilita busca paralela
+        self.batch_size = 100  # Tamanho do lote para processamento paralelo
+        
+        # 🚀 CONFIGURAÇÕES ANNOY BALANCEADAS (PRECISÃO vs MEMÓRIA)
+        self.use_annoy = True  # Habilita/desabilita busca com Annoy
+        self.annoy_n_trees = 50  # 🔧 BALANCEADO: Aumentado para melhor precisão (era 15)
+        self.annoy_search_k = 2000  # Nós inspecionados por consulta (search_k real do Annoy)
+        self.annoy_neighbors = 30  # Vizinhos retornados por descriptor de consulta
+        self.query_workers = min(8, os.cpu_count() or 1)  # Threads das fases 1 e 2 (Annoy e NumPy liberam o GIL)
+        self.rerank_candidates = 100  # Candidatos refinados com ORB na fase 2
+        
+        # 🧭 PRÉ-FILTRO GLOBAL (FASE 0): assinatura por imagem ordena/restringe a busca local
+        self.use_signature_prefilter = True  # Habilita a fase 0
+        self.signature_branching = 32  # Filhos por nó do vocabulário da assinatura
+        self.signature_depth = 2  # Níveis (32^2 = 1024 palavras = dimensão da assinatura)
+        self.signature_iterations = 10  # Iterações do k-majority por nó
+        self.signature_train_sample = 100000  # Descriptors amostrados para treinar o vocabulário
+        self.signature_shortlist = 2000  # Imagens mantidas antes da fase exata (o Annoy não restringe a própria busca)
+        
+        # 🖼️ ATALHO pHash: reenvios quase idênticos das fotos do catálogo
+        self.use_phash_fast_path = True  # Responde pelo pHash (com confirmação ORB) quando há imagem dentro do raio
+        self.phash_max_radius = 4  # Distância Hamming máxima (de 64 bits) para virar candidato do atalho
+        self.phash_verify_threshold = 0.3  # Similaridade ORB mínima para confirmar um candidato pHash
+        self.phash_substrings = 4  # Tabelas do multi-index hashing (4 x 16 bits)
+        
+        # 💾 CACHE DE RESULTADOS (uploads idênticos não refazem a busca)
+        self.use_result_cache = True  # Habilita o cache LRU de resultados
+        self.result_cache_mb = 64  # Orçamento do cache (tamanho estimado pelo JSON dos resultados)
+        self.result_cache = ResultCache(self.result_cache_mb * 1024 * 1024)
+        self.use_query_phash_cache = True  # 2º nível: reenvios recomprimidos/redimensionados (chave = pHash)
+        self.query_cache_max_radius = 4  # Distância Hamming máxima (de 64 bits) entre pHash de consultas
+        self.query_cache_mb = 32  # Orçamento do cache por pHash
+        self.query_cache_verify_rate = 0.05  # Fração dos acertos conferida com a busca completa (precisão)
+        self.query_cache = NearDuplicateCache(self.query_cache_mb * 1024 * 1024)
+        self._query_cache_rng = np.random.default_rng()
+        
+        # 🧵 EXECUTOR DAS REQUISIÇÕES (decodificação, ORB e busca fora do event loop)
+        self.search_workers = min(4, os.cpu_count() or 1)  # Buscas simultâneas
+        self.search_queue_size = 16  # Buscas esperando; além disso a API responde 503
+        self.search_executor = BoundedExecutor(self.search_workers, self.search_queue_size)
+        self.use_process_pool = False  # Fases 1 e 2 em processos (sem disputa pelo GIL no scoring em Python)
+        self.search_processes = os.cpu_count() or 1  # Processos do pool (índice compartilhado via mmap)
+        self.use_micro_batching = False  # Agrupa consultas concorrentes (uma fase 1 Annoy + um rerank por lote)
+        self.batch_window_ms = 3.0  # Espera máxima pela formação do lote após a primeira consulta
+        self.batch_max_size = 8  # Lote despachado na hora ao atingir este tamanho
+        self.micro_batcher = MicroBatcher(self.search_descriptors_batch, self.batch_window_ms, self.batch_max_size)
+        
+        # 🎯 BACKEND DE CANDIDATOS (FASE 1)
+        self.search_backend = 'annoy'  # 'annoy', 'exact' (força bruta), 'bow' (vocabulário visual), 'mih' (multi-index hashing), 'lsh' ou 'graph'
+        self.exact_neighbors = 30  # Vizinhos exatos por descriptor de consulta
+        self.exact_chunk_rows = 4096  # Linhas do banco por bloco na varredura exata
+        
+        # 📚 BAG-OF-VISUAL-WORDS (árvore de vocabulário k-majority + arquivo invertido tf-idf)
+        self.bow_branching = 16  # Filhos por nó da árvore
+        self.bow_depth = 3  # Níveis da árvore (16^3 = 4096 palavras visuais)
+        self.bow_iterations = 10  # Iterações do k-majority por nó
+        self.bow_train_sample = 200000  # Descriptors amostrados para treinar o vocabulário
+        self.bow_max_df_ratio = 0.3  # Palavras em mais que esta fração das imagens são ignoradas na consulta
+        
+        # #️⃣ MULTI-INDEX HASHING (k-NN exato em Hamming)
+        self.mih_substrings = 16  # Tabelas: 16 substrings de 16 bits (ou 32 de 8 bits)
+        self.mih_neighbors = 30  # Vizinhos exatos por descriptor de consulta
+        self.mih_max_radius = 31  # Raio máximo (31 = 2 níveis de sondagem com 16 tabelas; 47 = 3 níveis)
+        
+        # 🪣 LSH POR AMOSTRAGEM DE BITS (inserção/remoção incrementais)
+        self.lsh_tables = 8  # Tabelas hash independentes
+        self.lsh_bits = 16  # Bits sorteados por chave
+        self.lsh_probe_radius = 1  # Multi-probe: chaves a até N bits da chave da consulta
+        self.lsh_neighbors = 30  # Vizinhos por descriptor de consulta
+        self.lsh_compact_ratio = 0.3  # Compacta quando linhas órfãs passam desta fração
+        
+        # 🕸️ GRAFO NAVEGÁVEL (NSW, alternativa ao Annoy com inserção incremental)
+        self.graph_max_degree = 32  # Vizinhos por nó do grafo
+        self.graph_ef_construction = 64  # Tamanho do beam na inserção
+        self.graph_ef_search = 128  # Tamanho do beam na consulta (maior = mais recall, mais lento)
+        self.graph_expand_width = 8  # Nós expandidos por passo do beam search
+        self.graph_neighbors = 30  # Vizinhos por descriptor de consulta
+        self.graph_compact_ratio = 0.3  # Reconstrói quando nós órfãos passam desta fração
+        self.rerank_chunk_descriptors = 4096  # Colunas da matriz de distâncias por bloco no rerank em lote
+        self.descriptor_dim = 32  # Dimensão dos descriptors ORB (sempre 32)
+        self.annoy_metric = 'hamming'  # 'hamming' (256 bits reais) ou 'angular' (legado, 32 floats)
+        self.annoy_batch_size = 10000  # Tamanho do lote para construção incremental do índice
+        self.ingest_workers = os.cpu_count() or 1  # Processos da extração do banco (1 = serial)
+        self.ingest_chunk_size = 32  # Imagens por bloco enviado a cada processo
+        self.delta_compact_threshold = 500  # Imagens no delta + tombstones que disparam a compactação
+        
+        # 🔧 CONFIGURAÇÃO ORB BALANCEADA (PRECISÃO vs MEMÓRIA)
+        self.orb = cv2.ORB_create(
+            nfeatures=250,  # 🔧 BALANCEADO: Aumentado para melhor precisão (era 150)
+            scaleFactor=1.2,
+            nlevels=8,
+            edgeThreshold=31,
+            firstLevel=0,
+            WTA_K=2,
+            scoreType=cv2.ORB_HARRIS_SCORE,
+            patchSize=31,
+            fastThreshold=20
+        )
+        
+        # Cache de features das imagens do banco (dict durante a extração,
+        # DescriptorStore mapeado em memória depois de salvo/carregado)
+        self.database_features = {}
+        self.database_metadata = {}
+        
+        # 🚀 Annoy - Índice e mapeamentos
+        self.annoy_index = None
+        self.annoy_id_to_image = np.empty(0, dtype=np.int32)  # ID do Annoy -> índice da imagem
+        self.annoy_id_to_descriptor_idx = np.empty(0, dtype=np.int32)  # ID do Annoy -> índice do descriptor
+        self.annoy_image_paths = []  # Índice da imagem -> caminho (ordem usada na construção)
+        self.bow_index = None  # BowIndex (índices de imagem na ordem do store)
+        self.signature_index = None  # SignatureIndex (assinaturas na ordem do store)
+        self.phash_codes = np.empty(0, dtype=np.uint64)  # pHash de cada imagem (ordem do store)
+        self.phash_index = None  # MihIndex sobre os pHash de 64 bits
+        self._phash_valid = np.empty(0, dtype=bool)  # Imagens com pHash calculado
+        self.phash_stats = {"hits": 0, "misses": 0, "rejected": 0}
+        self.phash_stats_lock = threading.Lock()
+        self.mih_index = None  # MihIndex (linhas do store contíguo)
+        self.lsh_index = None  # LshIndex (cópia própria dos descriptors, atualizada incrementalmente)
+        self.graph_index = None  # GraphIndex (cópia própria dos descriptors, atualizada incrementalmente)
+        self.graph_stats = {"build_seconds": 0.0, "queries": 0, "query_seconds": 0.0, "expansions": 0, "descriptors": 0}
+        self.graph_stats_lock = threading.Lock()  # Buscas concorrentes atualizam as estatísticas
+        self._query_executor = None  # Pool persistente para consultas em lote
+        self._query_executor_workers = 0
+        self._query_executor_lock = threading.Lock()
+        self._process_pool = None  # Pool de processos de busca (modo use_process_pool)
+        self._process_pool_index_version = -1  # `_index_version` enviada aos processos do pool
+        self._process_pool_size = 0
+        self._process_pool_lock = threading.Lock()
+        self.ingest_errors = []  # Falhas da última extração: arquivo, erro e processo que a registrou
+        self.delta_index = DeltaIndex.create(self.descriptor_dim)  # Imagens adicionadas online (busca exata)
+        self.tombstones = frozenset()  # Imagens do store removidas/substituídas online (filtradas nas buscas)
+        self._ingest_lock = threading.RLock()  # Serializa adições, remoções e reconstruções (todas as gerações)
+        self._rebuild_in_progress = threading.Event()  # Ligado enquanto `rebuild_generation` monta uma geração
+        self.superseded_by = None  # Geração que substituiu esta (ver `promote_generation`)
+        
+        # Carrega ou cria o banco de features
+        self.load_or_create_database()
+    
+    def search_config_key(self) -> tuple:
+        """Valores atuais das configurações que afetam o resultado da busca"""
+        return tuple(getattr(self, name) for name in self.SEARCH_CONFIG_FIELDS)
+    
+    def clear_result_caches(self):
+        """Invalida os dois níveis do cache de resultados (bytes idênticos e pHash da consulta)"""
+        self.result_cache.clear()
+        self.query_cache.clear()
+    
+    def get_memory_usage(self) -> Dict:
+        """Retorna informações sobre uso de memória"""
+        process = psutil.Process()
+        memory_info = process.memory_info()
+        memory_percent = process.memory_percent()
+        
+        return {
+            'rss_gb': memory_info.rss / (1024**3),  # Resident Set Size in GB
+            'vms_gb': memory_info.vms / (1024**3),  # Virtual Memory Size in GB
+            'percent': memory_percent,
+            'available_gb': psutil.virtual_memory().available / (1024**3)
+        }
+    
+    def log_memory_usage(self, context: str = ""):
+        """Log do uso atual de memória"""
+        try:
+            mem = self.get_memory_usage()
+            logger.info(f"💾 Memória{' ' + context if context else ''}: "
+                       f"RSS={mem['rss_gb']:.2f}GB, "
+                       f"VMS={mem['vms_gb']:.2f}GB, "
+                       f"Uso={mem['percent']:.1f}%, "
+                       f"Disponível={mem['available_gb']:.2f}GB")
+        except Exception as e:
+            logger.warning(f"Erro ao obter info de memória: {e}")
+    
+    def cleanup_memory(self):
+        """Força limpeza de memória"""
+        gc.collect()
+        logger.info("🧹 Limpeza de memória executada")
+    
+    def preprocess_image(self, image: np.ndarray) -> np.ndarray:
+        """Pré-processamento da imagem para melhorar a detecção de features"""
+        # Converte para escala de cinza se necessário
+        if len(image.shape) == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = image.copy()
+        
+        # Equalização de histograma adaptativa para melhorar contraste
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        enhanced = clahe.apply(gray)
+        
+        # Redimensiona para tamanho padrão se muito grande
+        height, width = enhanced.shape
+        if max(height, width) > 1000:
+            scale = 1000 / max(height, width)
+            new_width = int(width * scale)
+            new_height = int(height * scale)
+            enhanced = cv2.resize(enhanced, (new_width, new_height))
+        
+        return enhanced
+    
+    def extract_features(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Extrai features usando ORB"""
+        processed_image = self.preprocess_image(image)
+        keypoints, descriptors = self.orb.detectAndCompute(processed_image, None)
+        
+        if descriptors is None:
+            return np.array([]), np.array([])
+        
+        return keypoints, descriptors
+    
+    def load_image(self, image_path: str) -> np.ndarray:
+        """Carrega imagem do disco"""
+        image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"Não foi possível carregar a imagem: {image_path}")
+        return image
+    
+    def _use_index_dir(self, index_dir: str):
+        """Aponta os arquivos de índice (`INDEX_FILE_FIELDS`) para o diretório de uma geração"""
+        self.index_dir = index_dir
+        for field in self.INDEX_FILE_FIELDS:
+            setattr(self, field, os.path.join(index_dir, os.path.basename(getattr(self, field))))
+
+    def index_params(self) -> Dict:
+        """Parâmetros e tamanho do índice gravados no manifesto de cada geração"""
+        return {
+            'feature_params': self.feature_params(),
+            'annoy_params': {
+                'n_trees': self.annoy_n_trees,
+                'metric': self.annoy_metric,
+                'dim': self._annoy_dim()
+            },
+            'total_images': len(self.database_features),
+            'total_descriptors': sum(len(self.database_features[path]) for path in self.database_features)
+        }
+
+    @contextlib.contextmanager
+    def _index_transaction(self):
+        """Agrupa as gravações de arquivos de índice numa única geração em disco.
+
+        Na saída da transação mais externa a geração aberta (se alguma gravação
+        aconteceu) é fechada e ativada; com exceção, é descartada e os arquivos
+        voltam a apontar para a geração anterior.
+        """
+        self._index_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._index_depth -= 1
+            if self._index_depth == 0 and self._index_parent is not None:
+                self.index_generations.discard(self.index_dir)
+                self._use_index_dir(self._index_parent)
+                self._index_parent = None
+            raise
+        self._index_depth -= 1
+        if self._index_depth == 0 and self._index_parent is not None:
+            parent, self._index_parent = self._index_parent, None
+            self.index_generations.commit(self.index_dir, self.index_params())
+            if not parent:
+                # Arquivos soltos na raiz (formato anterior) migraram para a primeira geração
+                for field in self.INDEX_FILE_FIELDS:
+                    legacy_file = os.path.basename(getattr(self, field))
+                    if os.path.exists(legacy_file):
+                        os.remove(legacy_file)
+
+    @contextlib.contextmanager
+    def _index_write(self):
+        """Gravação de arquivos de índice: abre uma geração nova (links da atual) se a transação ainda não tem uma"""
+        with self._index_transaction():
+            if self._index_parent is None:
+                self._index_parent = self.index_dir
+                file_names = [os.path.basename(getattr(self, field)) for field in self.INDEX_FILE_FIELDS]
+                self._use_index_dir(self.index_generations.begin(self.index_dir, file_names))
+            yield
+
+    def save_cache(self):
+        """Salva cache de features (store contíguo) e metadata"""
+        with self._index_write():
+            DescriptorStore.write(
+                self.database_features,
+                self.features_store_file,
+                self.features_offsets_file,
+                self.features_paths_file,
+                self.descriptor_dim
+            )
+            
+            with open(self.metadata_cache_file + '.tmp', 'w') as f:
+                json.dump(self.database_metadata, f, indent=2)
+            os.replace(self.metadata_cache_file + '.tmp', self.metadata_cache_file)
+            
+            # Reabre via memmap: libera os arrays por imagem e passa a servir views
+            self.database_features = DescriptorStore.load(
+                self.features_store_file, self.features_offsets_file, self.features_paths_file
+            )
+            
+            logger.info(f"Cache salvo com {len(self.database_features)} imagens")
+            
+            # Salva índice Annoy se habilitado
+            if self.use_annoy and self.annoy_index is not None:
+                self.save_annoy_index()
+    
+    def save_annoy_index(self):
+        """Salva índice Annoy e mapeamentos"""
+        try:
+            # Salva o índice num temporário e troca: o save do Annoy trunca o arquivo,
+            # e uma geração anterior ainda em uso mantém o .ann antigo mapeado
+            with self._index_write():
+                self.annoy_index.save(self.annoy_index_file + '.tmp')
+                os.replace(self.annoy_index_file + '.tmp', self.annoy_index_file)
+                
+                # Salva os mapeamentos como arrays inteiros compactos
+                with open(self.annoy_mapping_file + '.tmp', 'wb') as f:
+                    np.savez(
+                        f,
+                        id_to_image=self.annoy_id_to_image,
+                        id_to_descriptor_idx=self.annoy_id_to_descriptor_idx,
+                        n_images=len(self.annoy_image_paths),
+                        n_trees=self.annoy_n_trees,
+                        descriptor_dim=self.descriptor_dim,
+                        metric=np.array(self.annoy_metric)
+                    )
+                os.replace(self.annoy_mapping_file + '.tmp', self.annoy_mapping_file)
+            
+            logger.info(f"🚀 Índice Annoy salvo com {len(self.annoy_id_to_image)} descritores")
+            
+        except Exception as e:
+            logger.error(f"Erro ao salvar índice Annoy: {e}")
+    
+    def load_annoy_index(self) -> bool:
+        """Carrega índice Annoy e mapeamentos"""
+        try:
+            if (os.path.exists(self.annoy_index_file) and
+                os.path.exists(self.annoy_mapping_file)):
+                
+                # Carrega mapeamentos
+                with np.load(self.annoy_mapping_file) as annoy_mapping:
+                    id_to_image = annoy_mapping['id_to_image']
+                    id_to_descriptor_idx = annoy_mapping['id_to_descriptor_idx']
+                    n_images = int(annoy_mapping['n_images'])
+                    metric = str(annoy_mapping['metric']) if 'metric' in annoy_mapping.files else 'angular'
+                
+                if metric != self.annoy_metric:
+                    logger.warning(f"Índice Annoy salvo com métrica '{metric}', configurada '{self.annoy_metric}'")
+                    return False
+                
+                # Os índices de imagem referem-se à ordem do store de descritores
+                image_paths = list(self.database_features.keys())
+                if n_images != len(image_paths):
+                    logger.warning(f"Mapeamento Annoy com {n_images} imagens, banco tem {len(image_paths)}")
+                    return False
+                
+                # Cria e carrega índice
+                annoy_index = AnnoyIndex(self._annoy_dim(), self.annoy_metric)
+                annoy_index.load(self.annoy_index_file)
+                
+                if annoy_index.get_n_items() != len(id_to_image):
+                    logger.warning("Índice Annoy e mapeamento com tamanhos diferentes")
+                    return False
+                
+                self.annoy_index = annoy_index
+                self.annoy_id_to_image = id_to_image
+                self.annoy_id_to_descriptor_idx = id_to_descriptor_idx
+                self.annoy_image_paths = image_paths
+                
+                logger.info(f"🚀 Índice Annoy carregado com {len(self.annoy_id_to_image)} descritores")
+                return True
+                
+        except Exception as e:
+            logger.warning(f"Erro ao carregar índice Annoy: {e}")
+        
+        return False
+    
+    def _annoy_dim(self) -> int:
+        """Dimensão do índice: 256 bits no modo hamming, 32 floats no angular"""
+        if self.annoy_metric == 'hamming':
+            return self.descriptor_dim * 8
+        return self.descriptor_dim
+    
+    def _annoy_bytes_per_descriptor(self) -> int:
+        """Bytes por item no índice (hamming empacota os bits em uint64)"""
+        if self.annoy_metric == 'hamming':
+            return self.descriptor_dim
+        return self.descriptor_dim * 4
+    
+    def _to_annoy_vectors(self, descriptors: np.ndarray) -> np.ndarray:
+        """Converte descriptors ORB (uint8) para o formato de entrada do Annoy"""
+        if self.annoy_metric == 'hamming':
+            return np.unpackbits(descriptors, axis=1)
+        return descriptors.astype(np.float32)
+    
+    def _annoy_distance_to_similarity(self, distances: np.ndarray) -> np.ndarray:
+        """Converte distâncias do Annoy em similaridade 0-1"""
+        distances = np.asarray(distances, dtype=np.float32)
+        if self.annoy_metric == 'hamming':
+            # Fração de bits iguais entre os descriptors
+            return 1.0 - distances / self._annoy_dim()
+        return np.maximum(0.0, 1.0 - distances / 2)
+    
+    def build_annoy_index(self):
+        """Constrói índice Annoy de forma incremental com monitoramento de memória"""
+        if not self.use_annoy:
+            return
+            
+        logger.info("🚀 Construindo índice Annoy OTIMIZADO...")
+        self.log_memory_usage("(inicial)")
+        
+        # Estima número total de descritores
+        total_descriptors = sum(len(descriptors) for descriptors in self.database_features.values())
+        total_images = len(self.database_features)
+        
+        logger.info(f"📊 Estimativa: {total_descriptors:,} descritores de {total_images:,} imagens")
+        # Verifica se há memória suficiente
+        current_mem = self.get_memory_usage()
+        estimated_gb = (total_descriptors * self._annoy_bytes_per_descriptor()) / (1024**3)
+        logger.info(f"💾 Memória estimada do índice ({self.annoy_metric}): ~{estimated_gb:.2f} GB")
+        
+        if estimated_gb > current_mem['available_gb'] * 0.8:  # 80% da memória disponível
+            logger.warning(f"⚠️  ATENÇÃO: Memória estimada ({estimated_gb:.2f}GB) próxima do limite disponível ({current_mem['available_gb']:.2f}GB)")
+            logger.info("💡 Considere reduzir ainda mais o número de features ou processar em lotes menores")
+        
+        # Cria novo índice
+        self.annoy_index = AnnoyIndex(self._annoy_dim(), self.annoy_metric)
+        self.annoy_image_paths = list(self.database_features.keys())
+        
+        # Mapeamentos inteiros: IDs do Annoy seguem a ordem contígua do store
+        counts = np.array([len(self.database_features[path]) for path in self.annoy_image_paths], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(counts) else counts
+        self.annoy_id_to_image = np.repeat(np.arange(total_images, dtype=np.int32), counts)
+        self.annoy_id_to_descriptor_idx = (
+            np.arange(total_descriptors, dtype=np.int64) - np.repeat(starts, counts)
+        ).astype(np.int32)
+        
+        annoy_id = 0
+        processed_descriptors = 0
+        logger.info("🚀 Adicionando descritores ao índice (processamento incremental)...")
+        
+        # Processa em lotes para monitoramento
+        for image_idx, (image_path, descriptors) in enumerate(self.database_features.items()):
+            # Converte descriptors para o formato do índice (bits ou float32)
+            annoy_vectors = self._to_annoy_vectors(descriptors)
+            
+            # Adiciona todos os descriptors desta imagem
+            for annoy_vector in annoy_vectors:
+                self.annoy_index.add_item(annoy_id, annoy_vector)
+                annoy_id += 1
+                processed_descriptors += 1
+            
+            # Log do progresso e memória a cada lote de imagens
+            if (image_idx + 1) % 1000 == 0 or (image_idx + 1) == total_images:
+                progress_pct = ((image_idx + 1) / total_images) * 100
+                logger.info(f"📈 Progresso: {image_idx + 1:,}/{total_images:,} imagens ({progress_pct:.1f}%) - {processed_descriptors:,} descritores")
+                self.log_memory_usage(f"(após {image_idx + 1:,} imagens)")
+                
+                # Força limpeza de memória a cada 5000 imagens
+                if (image_idx + 1) % 5000 == 0:
+                    self.cleanup_memory()
+
+        # Log memória antes da construção das árvores
+        logger.info(f"🔨 Construindo {self.annoy_n_trees} árvores para {annoy_id:,} descritores...")
+        logger.info("⏳ Este processo pode demorar alguns minutos e usar bastante memória...")
+        self.log_memory_usage("(antes da construção)")
+        
+        build_start = time.time()
+        self.annoy_index.build(self.annoy_n_trees)
+        build_time = time.time() - build_start
+        
+        # Log final
+        self.log_memory_usage("(após construção)")
+        self.cleanup_memory()
+        
+        logger.info(f"✅ Índice Annoy construído com sucesso!")
+        logger.info(f"📊 Total: {annoy_id:,} descritores de {total_images:,} imagens")
+        logger.info(f"⏱️  Tempo de construção: {build_time:.2f} segundos")
+        logger.info(f"🌳 Árvores construídas: {self.annoy_n_trees}")
+        logger.info(f"🔧 Otimizações aplicadas: ORB features reduzidas para {self.orb.getMaxFeatures()}")
+        self.clear_result_caches()
+
+    def build_bow_index(self):
+        """Treina o vocabulário visual e monta o arquivo invertido tf-idf"""
+        store = self._descriptor_store()
+        if store.total_descriptors == 0:
+            logger.warning("Nenhum descritor no banco para construir o vocabulário visual")
+            return
+
+        n_words = self.bow_branching ** self.bow_depth
+        logger.info(f"📚 Construindo vocabulário visual ({n_words:,} palavras, amostra de "
+                    f"{min(self.bow_train_sample, store.total_descriptors):,} descritores)...")
+        build_start = time.time()
+        self.bow_index = BowIndex.build(
+            store, self.bow_branching, self.bow_depth, self.bow_iterations, self.bow_train_sample
+        )
+        logger.info(f"✅ Arquivo invertido com {len(self.bow_index.postings_image):,} entradas "
+                    f"construído em {time.time() - build_start:.2f}s")
+        self.clear_result_caches()
+
+    def save_bow_index(self):
+        """Salva vocabulário e arquivo invertido"""
+        try:
+            with self._index_write():
+                self.bow_index.save(self.bow_index_file)
+            logger.info(f"📚 Índice BoVW salvo em {self.bow_index_file}")
+        except Exception as e:
+            logger.error(f"Erro ao salvar índice BoVW: {e}")
+
+    def load_bow_index(self) -> bool:
+        """Carrega o índice BoVW se ele corresponde ao store atual"""
+        try:
+            if os.path.exists(self.bow_index_file):
+                bow_index = BowIndex.load(self.bow_index_file)
+                store = self._descriptor_store()
+
+                if (bow_index.n_images != len(store) or
+                        bow_index.n_descriptors != store.total_descriptors):
+                    logger.warning(f"Índice BoVW com {bow_index.n_images} imagens, banco tem {len(store)}")
+                    return False
+
+                self.bow_index = bow_index
+                logger.info(f"📚 Índice BoVW carregado ({bow_index.n_words:,} palavras)")
+                return True
+        except Exception as e:
+            logger.warning(f"Erro ao carregar índice BoVW: {e}")
+
+        return False
+
+    def prepare_bow_index(self):
+        """Garante o índice BoVW em memória (carrega do disco ou constrói e salva)"""
+        if self.bow_index is None and not self.load_bow_index():
+            logger.info("Índice BoVW não encontrado, será construído...")
+            self.build_bow_index()
+            if self.bow_index is not None:
+                self.save_bow_index()
+
+    def build_phash_index(self):
+        """Monta o multi-index hashing dos pHash guardados nos metadados (calcula os que faltam)"""
+        image_paths = list(self.database_features.keys())
+        missing = [path for path in image_paths if 'phash' not in self.database_metadata.get(path, {})]
+        
+        # Caches antigos não têm pHash: calcula a partir das imagens do banco num dict novo
+        # (o dict atual é compartilhado com as gerações anteriores via copy.copy)
+        if missing:
+            metadata = dict(self.database_metadata)
+            for path in missing:
+                try:
+                    image = self.load_image(os.path.join(self.database_path, path))
+                    metadata[path] = {**metadata.get(path, {}), 'phash': format(int(perceptual_hash(image)), '016x')}
+                except Exception as e:
+                    logger.warning(f"⚠️  pHash não calculado para {path}: {e}")
+            logger.info(f"🖼️ pHash calculado para {len(missing)} imagens de um cache antigo")
+            with self._index_write():
+                with open(self.metadata_cache_file + '.tmp', 'w') as f:
+                    json.dump(metadata, f, indent=2)
+                os.replace(self.metadata_cache_file + '.tmp', self.metadata_cache_file)
+            self.database_metadata = metadata
+        
+        # Imagens cujo pHash não pôde ser calculado ficam fora do atalho
+        codes = [self.database_metadata.get(path, {}).get('phash') for path in image_paths]
+        self.phash_codes = np.array(
+            [int(code, 16) if code else 0 for code in codes], dtype=np.uint64
+        ).reshape(-1, 1)
+        self.phash_index = MihIndex.from_codes(self.phash_codes, self.phash_substrings, len(image_paths))
+        self._phash_valid = np.array([code is not None for code in codes], dtype=bool)
+        logger.info(f"🖼️ Índice pHash com {len(image_paths)} imagens")
+        self.clear_result_caches()
+
+    def _phash_candidates(self, query_image: np.ndarray, top_k: int,
+                          query_phash: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Índices (ordem do store) e distâncias das imagens a até `phash_max_radius` bits do pHash da consulta"""
+        if query_phash is None:
+            query_phash = perceptual_hash(query_image)
+        query_code = np.array([[query_phash]], dtype=np.uint64)
+        _, image_idxs, distances = self.phash_index.knn(self.phash_codes, query_code, top_k, self.phash_max_radius)
+        
+        # Imagens sem pHash e removidas/substituídas online (tombstones) ficam de fora
+        image_paths = self.database_features.image_paths
+        tombstones = self.tombstones
+        valid = self._phash_valid[image_idxs]
+        if tombstones:
+            valid &= np.array([image_paths[idx] not in tombstones for idx in image_idxs.tolist()], dtype=bool)
+        return image_idxs[valid], distances[valid]
+    
+    def phash_lookup(self, query_image: np.ndarray, top_k: int, query_phash: int = None) -> List[Dict]:
+        """Candidatos do atalho pHash (ainda sem verificação ORB), com score 1 - distância/64"""
+        image_idxs, distances = self._phash_candidates(query_image, top_k, query_phash)
+        image_paths = self.database_features.image_paths
+        return [
+            {
+                'image_path': image_paths[idx],
+                'similarity_score': 1.0 - distance / 64.0,
+                'metadata': self.database_metadata.get(image_paths[idx], {}),
+                'match_details': {'phash_distance': distance},
+                'search_method': 'phash'
+            }
+            for idx, distance in zip(image_idxs.tolist(), distances.tolist())
+        ]
+    
+    def _verify_phash_candidates(self, query_descriptors: np.ndarray, top_k: int,
+                                 image_idxs: np.ndarray, distances: np.ndarray) -> List[Dict]:
+        """Confirma os candidatos pHash com o refinamento ORB (votos exatos só nessas imagens).
+        
+        O pHash olha só a luminância em baixa resolução: variações de cor ou
+        detalhe da mesma foto colidem. Só respondem pelo atalho os candidatos
+        com similaridade ORB a partir de `phash_verify_threshold`; sem nenhum
+        confirmado retorna [] e a busca completa segue.
+        """
+        phase1_start = time.time()
+        store = self._descriptor_store()
+        order = np.argsort(image_idxs)
+        _, descriptor_ids, knn_distances = self.exact_knn(query_descriptors, store=store,
+                                                          image_idxs=image_idxs[order])
+        results = self._rerank_descriptor_votes(
+            query_descriptors, top_k, 'phash', store, descriptor_ids, knn_distances, phase1_start
+        )
+        
+        phash_distances = dict(zip([store.image_paths[idx] for idx in image_idxs.tolist()], distances.tolist()))
+        verified = [result for result in results
+                    if result['match_details']['orb_similarity'] >= self.phash_verify_threshold]
+        for result in verified:
+            result['match_details']['phash_distance'] = phash_distances[result['image_path']]
+            result['search_method'] = 'phash'
+        return verified
+    
+    def build_signature_index(self):
+        """Calcula a assinatura global de todas as imagens (vocabulário treinado no store)"""
+        store = self._descriptor_store()
+        if store.total_descriptors == 0:
+            logger.warning("Nenhum descritor no banco para calcular assinaturas globais")
+            return
+
+        logger.info(f"🧭 Calculando assinaturas globais ({self.signature_branching ** self.signature_depth:,} "
+                    f"palavras) de {len(store):,} imagens...")
+        build_start = time.time()
+        self.signature_index = SignatureIndex.build(
+            store, self.signature_branching, self.signature_depth,
+            self.signature_iterations, self.signature_train_sample
+        )
+        logger.info(f"✅ Assinaturas calculadas em {time.time() - build_start:.2f}s")
+        self.clear_result_caches()
+
+    def save_signature_index(self):
+        """Salva vocabulário e matriz de assinaturas"""
+        try:
+            with self._index_write():
+                self.signature_index.save(self.signature_index_file)
+            logger.info(f"🧭 Assinaturas salvas em {self.signature_index_file}")
+        except Exception as e:
+            logger.error(f"Erro ao salvar assinaturas: {e}")
+
+    def load_signature_index(self) -> bool:
+        """Carrega as assinaturas se elas correspondem ao store atual"""
+        try:
+            if os.path.exists(self.signature_index_file):
+                signature_index = SignatureIndex.load(self.signature_index_file)
+                store = self._descriptor_store()
+
+                if (signature_index.n_images != len(store) or
+                        signature_index.vocabulary.n_descriptors != store.total_descriptors):
+                    logger.warning(f"Assinaturas de {signature_index.n_images} imagens, banco tem {len(store)}")
+                    return False
+
+                self.signature_index = signature_index
+                logger.info(f"🧭 Assinaturas carregadas ({signature_index.n_images} imagens)")
+                return True
+        except Exception as e:
+            logger.warning(f"Erro ao carregar assinaturas: {e}")
+
+        return False
+
+    def prepare_signature_index(self):
+        """Garante as assinaturas em memória (carrega do disco ou calcula e salva)"""
+        if self.signature_index is None and not self.load_signature_index():
+            logger.info("Assinaturas globais não encontradas, serão calculadas...")
+            self.build_signature_index()
+            if self.signature_index is not None:
+                self.save_signature_index()
+
+    def build_mih_index(self):
+        """Monta as tabelas do multi-index hashing sobre o store contíguo"""
+        store = self._descriptor_store()
+        logger.info(f"#️⃣ Construindo MIH ({self.mih_substrings} tabelas) para {store.total_descriptors:,} descritores...")
+        build_start = time.time()
+        self.mih_index = MihIndex.build(store, self.mih_substrings)
+        logger.info(f"✅ MIH construído em {time.time() - build_start:.2f}s")
+        self.clear_result_caches()
+
+    def save_mih_index(self):
+        """Salva as tabelas do MIH"""
+        try:
+            with self._index_write():
+                self.mih_index.save(self.mih_index_file)
+            logger.info(f"#️⃣ Índice MIH salvo em {self.mih_index_file}")
+        except Exception as e:
+            logger.error(f"Erro ao salvar índice MIH: {e}")
+
+    def load_mih_index(self) -> bool:
+        """Carrega o índice MIH se ele corresponde ao store e à configuração atuais"""
+        try:
+            if os.path.exists(self.mih_index_file):
+                mih_index = MihIndex.load(self.mih_index_file)
+                store = self._descriptor_store()
+
+                if mih_index.n_substrings != self.mih_substrings:
+                    logger.warning(f"Índice MIH com {mih_index.n_substrings} tabelas, configurado {self.mih_substrings}")
+                    return False
+                if (mih_index.n_images != len(store) or
+                        mih_index.n_descriptors != store.total_descriptors):
+                    logger.warning(f"Índice MIH com {mih_index.n_images} imagens, banco tem {len(store)}")
+                    return False
+
+                self.mih_index = mih_index
+                logger.info(f"#️⃣ Índice MIH carregado ({mih_index.n_descriptors:,} descritores)")
+                return True
+        except Exception as e:
+            logger.warning(f"Erro ao carregar índice MIH: {e}")
+
+        return False
+
+    def prepare_mih_index(self):
+        """Garante o índice MIH em memória (carrega do disco ou constrói e salva)"""
+        if self.mih_index is None and not self.load_mih_index():
+            logger.info("Índice MIH não encontrado, será construído...")
+            self.build_mih_index()
+            self.save_mih_index()
+
+    def build_lsh_index(self):
+        """Cria o índice LSH do zero com todas as imagens do banco"""
+        logger.info(f"🪣 Construindo LSH ({self.lsh_tables} tabelas x {self.lsh_bits} bits)...")
+        build_start = time.time()
+        # Monta numa variável local: buscas concorrentes nunca veem um índice pela metade
+        lsh_index = LshIndex.create(self.lsh_tables, self.lsh_bits, self.descriptor_dim)
+        lsh_index.insert(self.database_features)
+        self.lsh_index = lsh_index
+        logger.info(f"✅ LSH construído com {self.lsh_index.n_live_rows:,} descritores em {time.time() - build_start:.2f}s")
+        self.clear_result_caches()
+
+    def save_lsh_index(self):
+        """Salva o índice LSH (tabelas + descriptors)"""
+        try:
+            with self._index_write():
+                self.lsh_index.save(self.lsh_index_file)
+            logger.info(f"🪣 Índice LSH salvo em {self.lsh_index_file}")
+        except Exception as e:
+            logger.error(f"Erro ao salvar índice LSH: {e}")
+
+    def load_lsh_index(self) -> bool:
+        """Carrega o índice LSH salvo (a sincronização com o banco é feita depois)"""
+        try:
+            if os.path.exists(self.lsh_index_file):
+                lsh_index = LshIndex.load(self.lsh_index_file)
+
+                if lsh_index.n_tables != self.lsh_tables or lsh_index.n_bits != self.lsh_bits:
+                    logger.warning(f"Índice LSH com {lsh_index.n_tables}x{lsh_index.n_bits}, "
+                                   f"configurado {self.lsh_tables}x{self.lsh_bits}")
+                    return False
+
+                self.lsh_index = lsh_index
+                logger.info(f"🪣 Índice LSH carregado ({len(lsh_index.path_to_image)} imagens)")
+                return True
+        except Exception as e:
+            logger.warning(f"Erro ao carregar índice LSH: {e}")
+
+        return False
+
+    def sync_lsh_index(self):
+        """Atualiza o LSH incrementalmente com as imagens novas, alteradas e removidas do banco"""
+        sync_start = time.time()
+        n_inserted, n_deleted = self.lsh_index.sync(self.database_features)
+
+        if self.lsh_index.n_dead_rows > self.lsh_compact_ratio * len(self.lsh_index.descriptors):
+            logger.info(f"🧹 Compactando LSH ({self.lsh_index.n_dead_rows:,} linhas órfãs)")
+            self.lsh_index = self.lsh_index.compact()
+
+        if n_inserted or n_deleted:
+            logger.info(f"🪣 LSH sincronizado: +{n_inserted} / -{n_deleted} imagens em {time.time() - sync_start:.2f}s")
+            self.save_lsh_index()
+            self.clear_result_caches()
+
+    def prepare_lsh_index(self):
+        """Garante o índice LSH em memória e sincronizado com o banco"""
+        if self.lsh_index is None and not self.load_lsh_index():
+            logger.info("Índice LSH não encontrado, será construído...")
+            self.build_lsh_index()
+            self.save_lsh_index()
+        self.sync_lsh_index()
+
+    def build_graph_index(self):
+        """Cria o grafo do zero com todas as imagens do banco"""
+        logger.info(f"🕸️ Construindo grafo (grau={self.graph_max_degree}, ef={self.graph_ef_construction})...")
+        build_start = time.time()
+        graph_index = GraphIndex.create(self.graph_max_degree, self.descriptor_dim)
+        graph_index.insert(self.database_features, self.graph_ef_construction, self.graph_expand_width)
+        self.graph_index = graph_index
+        with self.graph_stats_lock:
+            self.graph_stats["build_seconds"] = time.time() - build_start
+        logger.info(f"✅ Grafo construído com {len(self.graph_index.descriptors):,} nós em {self.graph_stats['build_seconds']:.2f}s")
+        self.clear_result_caches()
+
+    def save_graph_index(self):
+        """Salva o grafo (arestas + descriptors)"""
+        try:
+            with self._index_write():
+                self.graph_index.save(self.graph_index_file)
+            logger.info(f"🕸️ Grafo salvo em {self.graph_index_file}")
+        except Exception as e:
+            logger.error(f"Erro ao salvar grafo: {e}")
+
+    def load_graph_index(self) -> bool:
+        """Carrega o grafo salvo (a sincronização com o banco é feita depois)"""
+        try:
+            if os.path.exists(self.graph_index_file):
+                graph_index = GraphIndex.load(self.graph_index_file)
+
+                if graph_index.max_degree != self.graph_max_degree:
+                    logger.warning(f"Grafo com grau {graph_index.max_degree}, configurado {self.graph_max_degree}")
+                    return False
+
+                self.graph_index = graph_index
+                logger.info(f"🕸️ Grafo carregado ({len(graph_index.path_to_image)} imagens)")
+                return True
+        except Exception as e:
+            logger.warning(f"Erro ao carregar grafo: {e}")
+
+        return False
+
+    def sync_graph_index(self):
+        """Insere no grafo as imagens novas e alteradas e remove as apagadas do banco"""
+        sync_start = time.time()
+        n_inserted, n_deleted = self.graph_index.sync(
+            self.database_features, ef_construction=self.graph_ef_construction, expand_width=self.graph_expand_width
+        )
+
+        if self.graph_index.n_dead_rows > self.graph_compact_ratio * len(self.graph_index.descriptors):
+            logger.info(f"🧹 Compactando grafo ({self.graph_index.n_dead_rows:,} nós órfãos)")
+            self.graph_index = self.graph_index.compact(
+                ef_construction=self.graph_ef_construction, expand_width=self.graph_expand_width
+            )
+
+        if n_inserted or n_deleted:
+            logger.info(f"🕸️ Grafo sincronizado: +{n_inserted} / -{n_deleted} imagens em {time.time() - sync_start:.2f}s")
+            self.save_graph_index()
+            self.clear_result_caches()
+
+    def prepare_graph_index(self):
+        """Garante o grafo em memória e sincronizado com o banco"""
+        if self.graph_index is None and not self.load_graph_index():
+            logger.info("Grafo não encontrado, será construído...")
+            self.build_graph_index()
+            self.save_graph_index()
+        self.sync_graph_index()
+
+    def _store_files_exist(self) -> bool:
+        return all(os.path.exists(path) for path in (
+            self.features_store_file, self.features_offsets_file, self.features_paths_file
+        ))
+    
+    def _migrate_legacy_cache(self):
+        """Converte o features_cache.pkl antigo para o store contíguo"""
+        logger.info(f"📦 Migrando {self.features_cache_file} para store contíguo...")
+        with open(self.features_cache_file, 'rb') as f:
+            legacy_features = pickle.load(f)
+        
+        DescriptorStore.write(
+            legacy_features,
+            self.features_store_file,
+            self.features_offsets_file,
+            self.features_paths_file,
+            self.descriptor_dim
+        )
+        del legacy_features
+        self.cleanup_memory()
+    
+    def load_cache(self, index_dir: str = None) -> bool:
+        """Carrega cache de features (memmap) e metadata.
+        
+        Sem `index_dir`, usa a geração apontada por CURRENT (ou a mais nova
+        íntegra); sem gerações válidas, os arquivos soltos da raiz.
+        """
+        try:
+            if index_dir is None:
+                index_dir = self.index_generations.select() or ""
+            self._use_index_dir(index_dir)
+            if not os.path.exists(self.metadata_cache_file):
+                return False
+            
+            if not self._store_files_exist():
+                if not os.path.exists(self.features_cache_file):
+                    return False
+                self._migrate_legacy_cache()
+            
+            self.database_features = DescriptorStore.load(
+                self.features_store_file, self.features_offsets_file, self.features_paths_file
+            )
+            
+            with open(self.metadata_cache_file, 'r') as f:
+                self.database_metadata = json.load(f)
+            
+            logger.info(f"Cache carregado com {len(self.database_features)} imagens "
+                        f"({self.database_features.total_descriptors:,} descritores via memmap)")
+
+            # Índices que faltarem são construídos numa única geração nova
+            with self._index_transaction():
+                # Tenta carregar índice Annoy
+                if self.use_annoy:
+                    if not self.load_annoy_index():
+                        logger.info("Índice Annoy não encontrado, será construído...")
+                        self.build_annoy_index()
+                        self.save_annoy_index()
+
+                if self.use_phash_fast_path:
+                    self.build_phash_index()
+
+                if self.use_signature_prefilter:
+                    self.prepare_signature_index()
+
+                if self.search_backend == 'bow':
+                    self.prepare_bow_index()
+                elif self.search_backend == 'mih':
+                    self.prepare_mih_index()
+                elif self.search_backend == 'lsh':
+                    self.prepare_lsh_index()
+                elif self.search_backend == 'graph':
+                    self.prepare_graph_index()
+
+            self.load_delta_index()
+
+            return True
+        except Exception as e:
+            logger.warning(f"Erro ao carregar cache: {e}")
         
-        # 🎯 CONFIGURAÇÕES DE PERFORMANCE MELHORADAS
-        self.early_stop_threshold = 0.98  # 🔧 Reduzido para encontrar bons matches mais rápido
-        self.min_threshold = 0.2  # 🔧 Reduzido para capturar mais candidatos iniciais
-        self.hybrid_threshold = 0.3  # 🔧 NOVO: Threshold específico para busca híbrida
-        self.max_workers = 16  # Número de threads para busca paralela
-        self.use_parallel_search = True  # Habilita/desabilita busca paralela
-        self.batch_size = 100  # Tamanho do lote para processamento paralelo
+        return False
+    
+    def process_database_images(self):
+        """Processa todas as imagens do banco e extrai features com otimizações de memória"""
+        if not os.path.exists(self.database_path):
+            raise ValueError(f"Diretório do banco não encontrado: {self.database_path}")
         
-        # 🚀 CONFIGURAÇÕES ANNOY BALANCEADAS (PRECISÃO vs MEMÓRIA)
-        self.use_annoy = True  # Habilita/desabilita busca com Annoy
-        self.annoy_n_trees = 50  # 🔧 BALANCEADO: Aumentado para melhor precisão (era 15)
-        self.annoy_search_k = 200  # 🔧 BALANCEADO: Aumentado para melhor recall (era 50)
-        self.descriptor_dim = 32  # Dimensão dos descriptors ORB (sempre 32)
-        self.annoy_batch_size = 10000  # Tamanho do lote para construção incremental do índice
+        # Recomeça do zero: o store carregado é somente leitura
+        self.database_features = {}
+        self.database_metadata = {}
+        rebuild_bow, rebuild_mih = self._reset_derived_indexes()
         
-        # 🔧 CONFIGURAÇÃO ORB BALANCEADA (PRECISÃO vs MEMÓRIA)
+        processed_count = 0
+        skipped_count = 0
+        total_features = 0
+        manifest_files = {}
+        
+        # Conta total de arquivos primeiro
+        all_image_files = self._list_database_files()
+        
+        total_files = len(all_image_files)
+        logger.info(f"🖼️  Encontrados {total_files:,} arquivos de imagem para processar")
+        logger.info(f"🔧 Configuração ORB: {self.orb.getMaxFeatures()} features máximas por imagem")
+        
+        # Processa imagens (blocos em paralelo quando há mais de um processo, consumidos em ordem)
+        self.ingest_errors = []
+        extracted = self._iter_extracted_images(all_image_files)
+        for idx, (file_path, descriptors, metadata, error, worker_pid, fingerprint) in enumerate(extracted):
+            if error is not None:
+                skipped_count += 1
+                self.ingest_errors.append({"file": file_path, "error": error, "worker_pid": worker_pid})
+                logger.error(f"❌ Erro ao processar {os.path.basename(file_path)}: {error}")
+                continue
+            
+            relative_path = os.path.relpath(file_path, self.database_path)
+            manifest_files[relative_path] = {**fingerprint, 'indexed': metadata is not None}
+            
+            if metadata is not None:
+                self.database_features[relative_path] = descriptors
+                self.database_metadata[relative_path] = metadata
+                
+                processed_count += 1
+                total_features += len(descriptors)
+                
+                # Log progresso a cada 100 imagens
+                if processed_count % 100 == 0 or processed_count == 1:
+                    progress_pct = ((idx + 1) / total_files) * 100
+                    avg_features = total_features / processed_count
+                    logger.info(f"📈 Progresso: {processed_count:,}/{total_files:,} ({progress_pct:.1f}%) - Média: {avg_features:.0f} features/img")
+            else:
+                skipped_count += 1
+                if skipped_count <= 10:  # Log apenas as primeiras 10 falhas
+                    logger.warning(f"⚠️  Imagem sem features: {os.path.basename(file_path)}")
+        
+        # Estatísticas finais
+        avg_features_per_image = total_features / processed_count if processed_count > 0 else 0
+        estimated_memory_gb = (total_features * self._annoy_bytes_per_descriptor()) / (1024**3)
+        
+        logger.info(f"✅ PROCESSAMENTO CONCLUÍDO:")
+        logger.info(f"   📊 Imagens processadas: {processed_count:,}")
+        logger.info(f"   ⚠️  Imagens ignoradas: {skipped_count:,} ({len(self.ingest_errors):,} com erro)")
+        logger.info(f"   🔍 Total de features: {total_features:,}")
+        logger.info(f"   📈 Média de features/imagem: {avg_features_per_image:.1f}")
+        logger.info(f"   💾 Memória estimada do índice: ~{estimated_memory_gb:.2f} GB")
+        
+        # Store, índices e manifesto entram numa única geração em disco
+        with self._index_transaction():
+            self._rebuild_after_ingest(rebuild_bow, rebuild_mih)
+            self.save_manifest(manifest_files)
+    
+    def _reset_derived_indexes(self) -> Tuple[bool, bool]:
+        """Descarta os índices derivados do store antes de uma ingestão (retorna se BoVW/MIH devem voltar)"""
+        rebuild_bow = self.search_backend == 'bow' or self.bow_index is not None
+        rebuild_mih = self.search_backend == 'mih' or self.mih_index is not None
+        self.bow_index = None
+        self.mih_index = None
+        self.signature_index = None
+        self.phash_index = None
+        return rebuild_bow, rebuild_mih
+    
+    def _rebuild_after_ingest(self, rebuild_bow: bool, rebuild_mih: bool):
+        """Salva o store novo e reconstrói/sincroniza os índices sobre ele"""
+        processed_count = len(self.database_features)
+        
+        # Constrói índice Annoy se habilitado
+        if self.use_annoy and processed_count > 0:
+            self.build_annoy_index()
+        
+        self.save_cache()
+        
+        if self.use_phash_fast_path:
+            self.build_phash_index()
+        
+        # Assinaturas globais da fase 0
+        if self.use_signature_prefilter and processed_count > 0:
+            self.build_signature_index()
+            self.save_signature_index()
+        
+        # Vocabulário visual treinado sobre o novo store
+        if rebuild_bow and processed_count > 0:
+            self.build_bow_index()
+            self.save_bow_index()
+        if rebuild_mih:
+            self.build_mih_index()
+            self.save_mih_index()
+        
+        # O LSH não é reconstruído: recebe só as imagens que mudaram
+        if self.search_backend == 'lsh' or self.lsh_index is not None:
+            self.prepare_lsh_index()
+        if self.search_backend == 'graph' or self.graph_index is not None:
+            self.prepare_graph_index()
+        
+        # O store novo já contém as adições/remoções online
+        self._reset_delta()
+        
+        # Resultados anteriores referem-se ao banco antigo
+        self.clear_result_caches()
+    
+    def _extract_image_entries(self, file_paths: List[str]) -> List[Tuple]:
+        """Carrega e extrai um bloco de imagens: (caminho, descriptors, metadados, erro, pid, impressão digital)"""
+        entries = []
+        for file_path in file_paths:
+            try:
+                fingerprint = file_fingerprint(file_path)
+                descriptors, metadata = self._describe_image(self.load_image(file_path), file_path)
+                entries.append((file_path, descriptors, metadata, None, os.getpid(), fingerprint))
+            except Exception as e:
+                entries.append((file_path, None, None, str(e), os.getpid(), None))
+        return entries
+    
+    def _describe_image(self, image: np.ndarray, file_path: str) -> Tuple[np.ndarray, Optional[Dict]]:
+        """Descriptors ORB e metadados de uma imagem do banco (metadados None se não houver features)"""
+        keypoints, descriptors = self.extract_features(image)
+        metadata = None
+        if descriptors is not None and len(descriptors) > 0:
+            metadata = {
+                'filename': os.path.basename(file_path),
+                'path': file_path,
+                'features_count': len(descriptors),
+                'image_shape': image.shape,
+                'phash': format(int(perceptual_hash(image)), '016x')
+            }
+        return descriptors, metadata
+    
+    def _iter_extracted_images(self, file_paths: List[str]) -> Iterator[Tuple]:
+        """Extrai as imagens na ordem de `file_paths`, em blocos distribuídos num pool de processos.
+        
+        Os processos vêm do forkserver e recebem só a configuração (ORB recriado
+        com os mesmos parâmetros). No máximo dois blocos por processo ficam em
+        andamento e os resultados são consumidos na ordem de envio, então o
+        dict final sai igual ao da extração serial.
+        """
+        chunk_size = max(1, self.ingest_chunk_size)
+        chunks = [file_paths[i:i + chunk_size] for i in range(0, len(file_paths), chunk_size)]
+        n_workers = min(self.ingest_workers, len(chunks))
+        
+        if n_workers <= 1:
+            for chunk in chunks:
+                yield from self._extract_image_entries(chunk)
+            return
+        
+        logger.info(f"🧩 Extração paralela: {len(chunks):,} blocos de até {chunk_size} imagens em {n_workers} processos")
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=_worker_context,
+            initializer=_init_worker_process,
+            initargs=(self.worker_state(with_indexes=False),)
+        ) as pool:
+            pending = deque()
+            next_chunk = 0
+            while pending or next_chunk < len(chunks):
+                while next_chunk < len(chunks) and len(pending) < 2 * n_workers:
+                    pending.append(pool.submit(_extract_chunk_in_process, chunks[next_chunk]))
+                    next_chunk += 1
+                yield from pending.popleft().result()
+    
+    def _list_database_files(self) -> List[str]:
+        """Arquivos de imagem do banco, na ordem do os.walk (ordem do store)"""
+        all_image_files = []
+        for root, dirs, files in os.walk(self.database_path):
+            for file in files:
+                file_ext = os.path.splitext(file)[1].lower()
+                if file_ext in self.DATABASE_IMAGE_EXTENSIONS:
+                    all_image_files.append(os.path.join(root, file))
+        return all_image_files
+    
+    def feature_params(self) -> Dict:
+        """Parâmetros que determinam os descriptors (ORB, pré-processamento e versão do OpenCV)"""
+        return {
+            'pipeline_version': self.FEATURE_PIPELINE_VERSION,
+            'opencv': cv2.__version__,
+            'nfeatures': self.orb.getMaxFeatures(),
+            'scale_factor': self.orb.getScaleFactor(),
+            'nlevels': self.orb.getNLevels(),
+            'edge_threshold': self.orb.getEdgeThreshold(),
+            'first_level': self.orb.getFirstLevel(),
+            'wta_k': self.orb.getWTA_K(),
+            'score_type': int(self.orb.getScoreType()),
+            'patch_size': self.orb.getPatchSize(),
+            'fast_threshold': self.orb.getFastThreshold()
+        }
+    
+    def save_manifest(self, files: Dict[str, Dict]):
+        """Grava o manifesto da ingestão: tamanho, mtime e SHA-256 por arquivo + parâmetros de extração"""
+        manifest = {'feature_params': self.feature_params(), 'files': files}
+        with self._index_write():
+            with open(self.manifest_file + '.tmp', 'w') as f:
+                json.dump(manifest, f)
+            os.replace(self.manifest_file + '.tmp', self.manifest_file)
+        logger.info(f"🗂️ Manifesto salvo com {len(files):,} arquivos")
+    
+    def load_manifest(self) -> Optional[Dict]:
+        if not os.path.exists(self.manifest_file):
+            return None
+        try:
+            with open(self.manifest_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️  Manifesto ilegível, será recriado: {e}")
+            return None
+    
+    def sync_database_images(self) -> Dict:
+        """Ingestão incremental guiada pelo manifesto.
+        
+        Só arquivos novos ou alterados passam pela extração; apagados saem do
+        store. Tamanho + mtime iguais ao manifesto dispensam a leitura; nos demais,
+        o SHA-256 decide: conteúdo já conhecido (renomeado, movido ou só tocado)
+        reaproveita os descriptors. Sem manifesto/store ou com parâmetros de
+        extração diferentes, faz a reconstrução completa. O resultado é o mesmo
+        de `process_database_images` sobre a mesma árvore.
+        """
+        start_time = time.time()
+        manifest = self.load_manifest()
+        if (manifest is None or manifest.get('feature_params') != self.feature_params()
+                or not isinstance(self.database_features, DescriptorStore)):
+            logger.info("🗂️ Manifesto ausente ou parâmetros de extração alterados: reconstrução completa")
+            self.process_database_images()
+            return {
+                "mode": "full",
+                "total_images": len(self.database_features),
+                "errors": len(self.ingest_errors),
+                "elapsed_seconds": round(time.time() - start_time, 3)
+            }
+        
+        old_files = manifest['files']
+        store = self.database_features
+        
+        # Conteúdo já extraído, por SHA-256 (para renomeações e movimentações); imagens
+        # substituídas online já têm os metadados da versão nova e não servem de origem
+        path_by_hash = {}
+        for path, entry in old_files.items():
+            if entry['indexed'] and path in store and path not in self.tombstones:
+                path_by_hash.setdefault(entry['sha256'], path)
+        
+        # Plano na ordem do os.walk: (caminho relativo, arquivo, origem reaproveitada, impressão digital)
+        plan = []
+        to_extract = []
+        counts = {"unchanged": 0, "renamed": 0, "extracted": 0}
+        for file_path in self._list_database_files():
+            relative_path = os.path.relpath(file_path, self.database_path)
+            old = old_files.get(relative_path)
+            stat = os.stat(file_path)
+            if old is not None and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+                fingerprint = {key: old[key] for key in ('size', 'mtime_ns', 'sha256')}
+            else:
+                fingerprint = file_fingerprint(file_path)
+            
+            source = path_by_hash.get(fingerprint['sha256'])
+            if (old is not None and old['sha256'] == fingerprint['sha256']
+                    and (not old['indexed'] or relative_path in store)):
+                # Conteúdo igual ao do manifesto (imagens sem features continuam fora do store)
+                source = relative_path if old['indexed'] else None
+                counts["unchanged"] += 1
+            elif source is not None:
+                counts["renamed"] += 1
+            else:
+                to_extract.append(file_path)
+                counts["extracted"] += 1
+            plan.append((relative_path, file_path, source, fingerprint))
+        
+        current_paths = {relative_path for relative_path, _, _, _ in plan}
+        counts["deleted"] = sum(1 for path in old_files if path not in current_paths)
+        
+        # Extração (em paralelo) apenas do que é novo ou mudou
+        self.ingest_errors = []
+        extracted = {}
+        if to_extract:
+            logger.info(f"🗂️ Extraindo {len(to_extract):,} arquivos novos ou alterados")
+            for file_path, descriptors, metadata, error, worker_pid, fingerprint in self._iter_extracted_images(to_extract):
+                if error is not None:
+                    self.ingest_errors.append({"file": file_path, "error": error, "worker_pid": worker_pid})
+                    logger.error(f"❌ Erro ao processar {os.path.basename(file_path)}: {error}")
+                    continue
+                extracted[file_path] = (descriptors, metadata, fingerprint)
+        failed = {error["file"] for error in self.ingest_errors}
+        
+        features, metadata_by_path, manifest_files = {}, {}, {}
+        for relative_path, file_path, source, fingerprint in plan:
+            if file_path in extracted:
+                descriptors, metadata, fingerprint = extracted[file_path]
+            elif file_path in failed:
+                continue  # Fica fora do manifesto: tenta de novo na próxima sincronização
+            elif source is not None:
+                descriptors = store[source]
+                metadata = dict(self.database_metadata.get(source, {}))
+                metadata.update({'filename': os.path.basename(file_path), 'path': file_path})
+            else:
+                descriptors, metadata = None, None
+            
+            manifest_files[relative_path] = {**fingerprint, 'indexed': metadata is not None}
+            if metadata is not None:
+                features[relative_path] = descriptors
+                metadata_by_path[relative_path] = metadata
+        
+        changed = list(features.keys()) != list(store.keys()) or bool(extracted)
+        with self._index_transaction():
+            if changed:
+                logger.info(f"🗂️ Sincronização: {counts['extracted']} extraídos, {counts['renamed']} reaproveitados "
+                            f"por hash, {counts['deleted']} removidos, {counts['unchanged']} inalterados")
+                self.database_features = features
+                self.database_metadata = metadata_by_path
+                rebuild_bow, rebuild_mih = self._reset_derived_indexes()
+                self._rebuild_after_ingest(rebuild_bow, rebuild_mih)
+            elif metadata_by_path != self.database_metadata:
+                with self._index_write():
+                    with open(self.metadata_cache_file + '.tmp', 'w') as f:
+                        json.dump(metadata_by_path, f, indent=2)
+                    os.replace(self.metadata_cache_file + '.tmp', self.metadata_cache_file)
+                self.database_metadata = metadata_by_path
+                self._reset_delta()
+            else:
+                logger.info(f"🗂️ Banco já sincronizado ({len(features):,} imagens)")
+                self._reset_delta()
+            # Sem mudanças no manifesto não há o que gravar (nem geração nova)
+            if manifest_files != old_files:
+                self.save_manifest(manifest_files)
+        
+        return {
+            "mode": "incremental",
+            "changed": changed,
+            "total_images": len(self.database_features),
+            **counts,
+            "errors": len(self.ingest_errors),
+            "elapsed_seconds": round(time.time() - start_time, 3)
+        }
+    
+    def _database_relative_path(self, image_path: str) -> str:
+        """Caminho relativo ao banco (chave do store); recusa caminhos fora dele e extensões não indexadas"""
+        relative_path = os.path.normpath(image_path.strip())
+        if (os.path.isabs(relative_path) or relative_path == '.'
+                or relative_path.split(os.sep)[0] == '..'):
+            raise ValueError(f"Caminho fora do banco: {image_path}")
+        if os.path.splitext(relative_path)[1].lower() not in self.DATABASE_IMAGE_EXTENSIONS:
+            raise ValueError(f"Extensão não suportada (use {', '.join(self.DATABASE_IMAGE_EXTENSIONS)})")
+        return relative_path
+
+    def delta_pending(self) -> int:
+        """Imagens do delta + tombstones ainda não fundidos no store"""
+        return len(self.delta_index.path_to_image) + len(self.tombstones)
+
+    def image_descriptors(self, image_path: str, delta: DeltaIndex = None) -> Optional[np.ndarray]:
+        """Descriptors de uma imagem do banco; a versão do delta tem precedência sobre a do store"""
+        delta = delta if delta is not None else self.delta_index
+        if image_path in delta.path_to_image:
+            return delta.descriptors_of(image_path)
+        return self.database_features.get(image_path)
+
+    def save_delta_index(self):
+        """Salva delta, tombstones e metadados do delta (recarregados na inicialização)"""
+        try:
+            if not self.delta_pending():
+                if os.path.exists(self.delta_index_file):
+                    os.remove(self.delta_index_file)
+                return
+            delta_metadata = {path: self.database_metadata[path] for path in self.delta_index.path_to_image}
+            self.delta_index.save(self.delta_index_file, self.tombstones, delta_metadata)
+        except Exception as e:
+            logger.error(f"Erro ao salvar delta: {e}")
+
+    def load_delta_index(self):
+        """Recarrega o delta salvo sobre o store atual.
+
+        Entradas que o store já contém sem tombstone vêm de uma compactação
+        interrompida depois de gravar o store e são descartadas.
+        """
+        if not os.path.exists(self.delta_index_file):
+            return
+        try:
+            delta, tombstones, delta_metadata = DeltaIndex.load(self.delta_index_file)
+        except Exception as e:
+            logger.warning(f"Erro ao carregar delta: {e}")
+            return
+
+        store = self.database_features
+        delta.delete([path for path in delta.path_to_image if path in store and path not in tombstones])
+        tombstones = frozenset(path for path in tombstones if path in store)
+        for path in tombstones:
+            self.database_metadata.pop(path, None)
+        for path in delta.path_to_image:
+            self.database_metadata[path] = delta_metadata[path]
+
+        self.delta_index, self.tombstones = delta, tombstones
+        logger.info(f"➕ Delta carregado: {len(delta.path_to_image)} imagens novas, {len(tombstones)} tombstones")
+
+    def _reset_delta(self):
+        """Descarta delta e tombstones (o store acabou de ser reconstruído a partir do disco)"""
+        self.delta_index = DeltaIndex.create(self.descriptor_dim)
+        self.tombstones = frozenset()
+        if os.path.exists(self.delta_index_file):
+            os.remove(self.delta_index_file)
+
+    @contextlib.contextmanager
+    def _online_update(self):
+        """Trava a ingestão para uma adição/remoção online e entrega a geração em uso.
+        
+        Adições/remoções concorrentes esperam o lock umas das outras. Só uma
+        reconstrução em andamento faz levantar RuntimeError, em vez de prender a
+        requisição até a troca de geração.
+        """
+        if self._rebuild_in_progress.is_set():
+            raise RuntimeError("Reconstrução em andamento, tente novamente quando a tarefa terminar")
+        with self._ingest_lock:
+            yield self.latest_generation()
+
+    def add_database_image(self, image_path: str, contents: bytes) -> Dict:
+        """Adiciona (ou substitui) uma imagem sem reconstruir os índices.
+
+        O arquivo é gravado no banco e os descriptors entram no delta, buscado
+        por força bruta junto com o Annoy; a versão anterior de uma imagem do
+        store vira tombstone. Com `delta_compact_threshold` pendências, a API
+        agenda a compactação (`compact_delta`) como tarefa em segundo plano.
+        """
+        relative_path = self._database_relative_path(image_path)
+        image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Não foi possível decodificar a imagem")
+        file_path = os.path.join(self.database_path, relative_path)
+        descriptors, metadata = self._describe_image(image, file_path)
+        if metadata is None:
+            raise ValueError("Nenhuma feature ORB encontrada na imagem")
+
+        with self._online_update() as current:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path + '.tmp', 'wb') as f:
+                f.write(contents)
+            os.replace(file_path + '.tmp', file_path)
+
+            replaced = relative_path in current.delta_index.path_to_image or (
+                relative_path in current.database_features and relative_path not in current.tombstones
+            )
+            delta = current.delta_index.copy()
+            delta.insert({relative_path: descriptors})
+            current.database_metadata[relative_path] = metadata
+            current.delta_index = delta
+            if relative_path in current.database_features:
+                current.tombstones = current.tombstones | {relative_path}
+            current.save_delta_index()
+            current.clear_result_caches()
+            pending = current.delta_pending()
+
+        logger.info(f"➕ {'Substituída' if replaced else 'Adicionada'} online: {relative_path} "
+                    f"({len(descriptors)} descritores, {pending} pendências no delta)")
+        return {
+            "image_path": relative_path,
+            "features_count": len(descriptors),
+            "replaced": replaced,
+            "delta_pending": pending
+        }
+
+    def remove_database_image(self, image_path: str) -> Dict:
+        """Remove uma imagem sem reconstruir os índices: apaga o arquivo, tira a imagem do
+        delta e marca a versão do store como tombstone (filtrada nas buscas até a compactação)"""
+        relative_path = self._database_relative_path(image_path)
+        with self._online_update() as current:
+            in_delta = relative_path in current.delta_index.path_to_image
+            in_store = relative_path in current.database_features and relative_path not in current.tombstones
+            if not (in_delta or in_store):
+                raise KeyError(relative_path)
+
+            if in_delta:
+                delta = current.delta_index.copy()
+                delta.delete([relative_path])
+                current.delta_index = delta
+            if relative_path in current.database_features:
+                current.tombstones = current.tombstones | {relative_path}
+            current.database_metadata.pop(relative_path, None)
+
+            file_path = os.path.join(current.database_path, relative_path)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            current.save_delta_index()
+            current.clear_result_caches()
+            pending = current.delta_pending()
+
+        logger.info(f"➖ Removida online: {relative_path} ({pending} pendências no delta)")
+        return {"image_path": relative_path, "delta_pending": pending}
+
+    def compact_delta(self) -> Optional[Dict]:
+        """Funde delta e tombstones no store com uma sincronização incremental (Annoy reconstruído).
+        
+        Roda numa nova geração (ver `rebuild_generation`); None se não há pendências.
+        """
+        if not self.delta_pending():
+            return None
+        logger.info(f"🧹 Compactando delta ({len(self.delta_index.path_to_image)} imagens, "
+                    f"{len(self.tombstones)} tombstones)")
+        return self.sync_database_images()
+
+    def latest_generation(self) -> "ImageMatcher":
+        """Geração em uso: segue as trocas feitas depois que esta foi substituída"""
+        current = self
+        while current.superseded_by is not None:
+            current = current.superseded_by
+        return current
+
+    def new_generation(self) -> "ImageMatcher":
+        """Cópia do matcher onde uma reconstrução monta os índices sem tocar na geração em uso.
+        
+        Configuração, caches, executores e locks são compartilhados; as construções
+        reatribuem os atributos de índice só na cópia. LSH e grafo são sincronizados
+        no lugar, então a cópia recebe os seus próprios.
+        """
+        generation = copy.copy(self)
+        generation.superseded_by = None
+        for name in ('lsh_index', 'graph_index'):
+            if getattr(self, name) is not None:
+                setattr(generation, name, copy.deepcopy(getattr(self, name)))
+        return generation
+
+    def promote_generation(self, generation: "ImageMatcher") -> "ImageMatcher":
+        """Matcher com a configuração atual e os índices de `generation`.
+        
+        A configuração vem desta geração (ajustes feitos durante a construção
+        valem); buscas em andamento terminam nela, e adições/remoções que ainda
+        cheguem aqui são encaminhadas à nova.
+        """
+        promoted = copy.copy(self)
+        for name in self.INDEX_STATE_FIELDS:
+            setattr(promoted, name, getattr(generation, name))
+        promoted._use_index_dir(generation.index_dir)
+        promoted.micro_batcher.run_batch = promoted.search_descriptors_batch
+        self.superseded_by = promoted
+        promoted.clear_result_caches()
+        return promoted
+
+    def rebuild_generation(self, build) -> Tuple["ImageMatcher", object]:
+        """Executa `build(geração)` numa nova geração e a promove; devolve (matcher novo, resultado).
+        
+        Serializado com as adições/remoções online pelo lock de ingestão. Os
+        arquivos gravados pela construção formam uma única geração em disco.
+        """
+        with self._ingest_lock:
+            self._rebuild_in_progress.set()
+            try:
+                current = self.latest_generation()
+                build_start = time.time()
+                generation = current.new_generation()
+                with generation._index_transaction():
+                    result = build(generation)
+                promoted = current.promote_generation(generation)
+            finally:
+                self._rebuild_in_progress.clear()
+        logger.info(f"🔁 Nova geração dos índices ativada em {time.time() - build_start:.2f}s "
+                    f"({len(promoted.database_features):,} imagens)")
+        return promoted, result
+
+    def activate_index_generation(self, index_dir: str) -> Dict:
+        """Carrega os arquivos de outra geração em disco e aponta CURRENT para ela.
+        
+        Roda numa nova geração do matcher (ver `rollback_index_generation`):
+        os índices derivados são descartados e recarregados da geração escolhida.
+        """
+        self._reset_derived_indexes()
+        self.annoy_index = None
+        self.lsh_index = None
+        self.graph_index = None
+        if not self.load_cache(index_dir):
+            raise ValueError(f"Não foi possível carregar a geração {os.path.basename(index_dir)}")
+        if self._index_parent is None:
+            self.index_generations.set_current(index_dir)
+        return {
+            "generation": os.path.basename(self.index_dir),
+            "total_images": len(self.database_features)
+        }
+
+    def rollback_index_generation(self) -> Tuple["ImageMatcher", Dict]:
+        """Volta para a geração íntegra anterior à ativa; devolve (matcher novo, resumo).
+        
+        Como as adições/remoções online, não espera: com uma reconstrução em
+        andamento levanta RuntimeError. Sem geração anterior, ValueError.
+        """
+        with self._online_update() as current:
+            previous = current.index_generations.previous(current.index_dir)
+            if previous is None:
+                raise ValueError("Nenhuma geração anterior íntegra para restaurar")
+            rolled_back_from = os.path.basename(current.index_dir)
+            promoted, summary = current.rebuild_generation(
+                lambda generation: generation.activate_index_generation(previous)
+            )
+        logger.info(f"⏪ Rollback: {rolled_back_from} → {summary['generation']}")
+        return promoted, {"rolled_back_from": rolled_back_from, **summary}
+
+    def load_or_create_database(self):
+        """Carrega cache existente ou processa imagens do banco"""
+        if not self.load_cache():
+            logger.info("Cache não encontrado. Processando imagens do banco...")
+            self.process_database_images()
+    
+    def calculate_similarity(self, descriptors1: np.ndarray, descriptors2: np.ndarray) -> float:
+        """Calcula similaridade melhorada entre dois conjuntos de descriptors"""
+        if descriptors1 is None or descriptors2 is None or len(descriptors1) == 0 or len(descriptors2) == 0:
+            return 0.0
+        
+        try:
+            # Matches com cross-check e filtros de qualidade progressivos
+            # (excelentes < 25, bons < 40, decentes < 60) direto dos arrays
+            n_excellent, n_good, n_decent, good_distance_sum = (
+                int(stat[0]) for stat in match_stats_by_segment(
+                    pack_descriptors(descriptors1), pack_descriptors(descriptors2), [len(descriptors2)]
+                )
+            )
+            
+            total_features = min(len(descriptors1), len(descriptors2))
+            return self._score_from_match_stats(
+                n_excellent, n_good, n_decent, good_distance_sum, total_features
+            )
+            
+        except Exception as e:
+            logger.error(f"Erro no cálculo de similaridade: {e}")
+            return 0.0
+    
+    def calculate_similarities(self, query_descriptors: np.ndarray,
+                               candidate_descriptors: List[np.ndarray]) -> np.ndarray:
+        """Calcula o score de `calculate_similarity` para vários candidatos em lote.
+        
+        Os descriptors dos candidatos são empilhados em blocos de imagens inteiras
+        (até `rerank_chunk_descriptors` colunas) e cada bloco calcula as distâncias
+        consulta x candidatos de uma vez, reduzindo cross-check e contagens por
+        imagem com operações de segmento. Os blocos rodam no pool de consultas.
+        """
+        return self.calculate_similarities_batch([(query_descriptors, candidate_descriptors)])[0]
+    
+    def calculate_similarities_batch(self, requests: List[Tuple[np.ndarray, List[np.ndarray]]]) -> List[np.ndarray]:
+        """`calculate_similarities` para várias consultas com uma única passada no pool.
+        
+        Os blocos de todas as consultas vão juntos para o pool de consultas (uma
+        barreira por lote em vez de uma por consulta, usado pelo micro-batching).
+        """
+        all_scores = []
+        tasks = []
+        chunk_limit = min(self.rerank_chunk_descriptors, 0xFFFF)
+        
+        for query_descriptors, candidate_descriptors in requests:
+            scores = np.zeros(len(candidate_descriptors), dtype=np.float64)
+            all_scores.append(scores)
+            if query_descriptors is None or len(query_descriptors) == 0:
+                continue
+            
+            packed_query = pack_descriptors(query_descriptors)
+            lengths = [len(d) if d is not None else 0 for d in candidate_descriptors]
+            
+            # Agrupa candidatos em blocos de imagens inteiras
+            current, current_size = [], 0
+            for position, length in enumerate(lengths):
+                if length == 0:
+                    continue
+                if current and current_size + length > chunk_limit:
+                    tasks.append((scores, packed_query, candidate_descriptors, lengths, current))
+                    current, current_size = [], 0
+                current.append(position)
+                current_size += length
+            if current:
+                tasks.append((scores, packed_query, candidate_descriptors, lengths, current))
+        
+        def score_chunk(scores: np.ndarray, packed_query: np.ndarray, candidate_descriptors: List[np.ndarray],
+                        lengths: List[int], positions: List[int]):
+            packed_chunk = np.concatenate([pack_descriptors(candidate_descriptors[p]) for p in positions])
+            stats = match_stats_by_segment(packed_query, packed_chunk, [lengths[p] for p in positions])
+            for position, image_stats in zip(positions, zip(*stats)):
+                n_excellent, n_good, n_decent, good_distance_sum = (int(v) for v in image_stats)
+                scores[position] = self._score_from_match_stats(
+                    n_excellent, n_good, n_decent, good_distance_sum,
+                    min(lengths[position], len(packed_query))
+                )
+        
+        if len(tasks) > 1 and self.query_workers > 1:
+            executor = self._get_query_executor()
+            for future in [executor.submit(score_chunk, *task) for task in tasks]:
+                future.result()
+        else:
+            for task in tasks:
+                score_chunk(*task)
+        
+        return all_scores
+    
+    def _score_from_match_stats(self, n_excellent: int, n_good: int, n_decent: int,
+                                good_distance_sum: int, total_features: int) -> float:
+        """Score final a partir das contagens de matches por faixa de distância"""
+        # Calcula métricas de qualidade
+        excellent_ratio = n_excellent / total_features
+        good_ratio = n_good / total_features
+        decent_ratio = n_decent / total_features
+        
+        # Score ponderado por qualidade das matches
+        quality_score = (
+            excellent_ratio * 1.0 +    # Peso total para matches excelentes
+            good_ratio * 0.7 +         # Peso alto para matches bons
+            decent_ratio * 0.4         # Peso moderado para matches decentes
+        ) / 3.0
+        
+        # Score baseado na distribuição de distâncias
+        if n_good > 0:
+            avg_distance = good_distance_sum / n_good
+            distance_score = max(0, (80 - avg_distance) / 80)  # Normaliza para 0-1
+        else:
+            distance_score = 0.0
+        
+        # Score de cobertura (quantas features foram matcheadas)
+        coverage_score = n_decent / total_features
+        
+        # Combinação final ponderada
+        final_score = (
+            quality_score * 0.5 +      # 50% qualidade das matches
+            distance_score * 0.3 +     # 30% qualidade das distâncias
+            coverage_score * 0.2       # 20% cobertura de features
+        )
+        
+        # Bonus para imagens com muitas matches excelentes
+        if excellent_ratio > 0.1:  # Mais de 10% de matches excelentes
+            excellent_bonus = min(excellent_ratio * 0.2, 0.1)  # Até 10% de bonus
+            final_score += excellent_bonus
+        
+        return min(final_score, 1.0)
+    
+    def search_similar_images(self, query_image: np.ndarray, top_k: int = 5,
+                              query_phash: int = None) -> List[Dict]:
+        """Busca imagens similares no banco com otimizações de performance
+        
+        `query_phash` evita recalcular o pHash quando quem chama já o tem (cache por pHash).
+        """
+        start_time = time.time()
+        
+        # 🖼️ Atalho: foto do catálogo reenviada é confirmada com ORB só contra os candidatos pHash
+        phash_idxs = None
+        if self.use_phash_fast_path and self.phash_index is not None:
+            phash_idxs, phash_distances = self._phash_candidates(query_image, top_k, query_phash)
+        
+        query_keypoints, query_descriptors = self.extract_features(query_image)
+        
+        if query_descriptors is None or len(query_descriptors) == 0:
+            return []
+        
+        phash_results = []
+        if phash_idxs is not None:
+            if len(phash_idxs) > 0:
+                phash_results = self._verify_phash_candidates(query_descriptors, top_k, phash_idxs, phash_distances)
+            with self.phash_stats_lock:
+                if phash_results:
+                    self.phash_stats["hits"] += 1
+                elif len(phash_idxs) > 0:
+                    self.phash_stats["rejected"] += 1
+                else:
+                    self.phash_stats["misses"] += 1
+            if phash_results:
+                logger.info(f"🖼️ ATALHO pHash! '{phash_results[0]['image_path']}' a "
+                            f"{phash_results[0]['match_details']['phash_distance']} bits, confirmado com ORB "
+                            f"({phash_results[0]['match_details']['orb_similarity']:.3f}) em {(time.time() - start_time) * 1000:.2f} ms")
+            elif len(phash_idxs) > 0:
+                logger.info(f"🖼️ Candidatos pHash não confirmados pelo ORB, seguindo com a busca completa")
+        
+        # Confirmados suficientes respondem direto; senão a busca completa preenche o top_k
+        if len(phash_results) >= top_k:
+            return phash_results[:top_k]
+        
+        logger.info(f"🔍 Iniciando busca em {len(self.database_features)} imagens")
+        
+        if self.use_process_pool:
+            # 🧩 Fases 1 e 2 em um processo do pool (índice e store compartilhados via mmap/fork)
+            logger.info(f"🧩 Usando pool de processos ({self.search_processes} processos)")
+            config = {name: getattr(self, name) for name in self.SEARCH_CONFIG_FIELDS}
+            results = self._get_process_pool().submit(
+                _search_in_process, config, query_descriptors, top_k
+            ).result()
+        elif self.use_micro_batching:
+            # 📦 Fases 1 e 2 junto com as consultas que chegarem na mesma janela
+            results = self.micro_batcher.submit((query_descriptors, top_k)).result()
+        else:
+            results = self.search_descriptors(query_descriptors, top_k)
+        
+        if phash_results:
+            confirmed = {result['image_path'] for result in phash_results}
+            results = (phash_results + [r for r in results if r['image_path'] not in confirmed])[:top_k]
+        
+        elapsed_time = time.time() - start_time
+        logger.info(f"✅ Busca concluída em {elapsed_time:.2f}s - {len(results)} resultados encontrados")
+        
+        return results
+    
+    def search_descriptors(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
+        """Fases 1 e 2 a partir dos descriptors ORB da consulta (backend escolhido pela configuração)"""
+        # 🚀 Escolhe método de busca
+        if self.search_backend == 'exact':
+            logger.info(f"🎯 Usando busca exata (vizinhos={self.exact_neighbors}, workers={self.query_workers})")
+            results = self._search_exact(query_descriptors, top_k)
+        elif self.search_backend == 'bow' and self.bow_index is not None:
+            logger.info(f"📚 Usando busca BoVW ({self.bow_index.n_words:,} palavras visuais)")
+            results = self._search_bow(query_descriptors, top_k)
+        elif self.search_backend == 'mih' and self.mih_index is not None:
+            logger.info(f"#️⃣ Usando busca MIH (vizinhos={self.mih_neighbors}, raio={self.mih_max_radius})")
+            results = self._search_mih(query_descriptors, top_k)
+        elif self.search_backend == 'lsh' and self.lsh_index is not None:
+            logger.info(f"🪣 Usando busca LSH ({self.lsh_tables} tabelas, probe={self.lsh_probe_radius})")
+            results = self._search_lsh(query_descriptors, top_k)
+        elif self.search_backend == 'graph' and self.graph_index is not None:
+            logger.info(f"🕸️ Usando busca em grafo (ef={self.graph_ef_search}, vizinhos={self.graph_neighbors})")
+            results = self._search_graph(query_descriptors, top_k)
+        elif self.use_annoy and self.annoy_index is not None:
+            logger.info(f"🚀 Usando busca Annoy (search_k={self.annoy_search_k}, vizinhos={self.annoy_neighbors})")
+            results = self._search_with_annoy(query_descriptors, top_k)
+        elif self.use_parallel_search:
+            logger.info(f"⚡ Usando busca paralela (workers={self.max_workers})")
+            results = self._search_parallel(query_descriptors, top_k)
+        else:
+            logger.info("🔄 Usando busca sequencial")
+            results = self._search_sequential(query_descriptors, top_k)
+        
+        return results
+    
+    def _get_process_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        """Pool de processos de busca, recriado quando o índice muda ou o número de processos muda.
+        
+        Os processos vêm do forkserver (processo limpo, sem as threads e locks
+        do OpenCV/BLAS da API) e reabrem o store (memmap) e o índice Annoy (mmap
+        do .ann) pelo caminho, então as páginas continuam compartilhadas entre
+        todos. Os demais índices em memória seguem serializados. Cada índice
+        atribuído (construção, carga do disco, adição/remoção online) muda
+        `_index_version`, o que faz o próximo pedido abrir um pool novo.
+        """
+        with self._process_pool_lock:
+            if (self._process_pool is None or self._process_pool_index_version != self._index_version
+                    or self._process_pool_size != self.search_processes):
+                if self._process_pool is not None:
+                    self._process_pool.shutdown(wait=False)
+                self._process_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.search_processes,
+                    mp_context=_worker_context,
+                    initializer=_init_worker_process,
+                    initargs=(self.worker_state(),)
+                )
+                self._process_pool_index_version = self._index_version
+                self._process_pool_size = self.search_processes
+                logger.info(f"🧩 Pool de processos criado ({self.search_processes} processos, "
+                            f"versão do índice {self._index_version})")
+            return self._process_pool
+    
+    def worker_state(self, with_indexes: bool = True) -> Dict:
+        """Estado serializável do matcher para os processos dos pools (ver `restore_worker_state`).
+        
+        O store mapeado do disco vai como caminho; o índice Annoy vai como o
+        caminho do .ann em uso. Sem `with_indexes` só a configuração segue
+        (extração de features).
+        """
+        excluded = set(self.WORKER_EXCLUDED_FIELDS)
+        if not with_indexes:
+            excluded.update(self.INDEX_STATE_FIELDS)
+        state = {name: value for name, value in vars(self).items() if name not in excluded}
+        state['orb_params'] = self.feature_params()
+        if with_indexes and self.annoy_index is not None:
+            state['annoy_file'] = os.path.abspath(self.annoy_index_file)
+        return state
+    
+    def restore_worker_state(self, state: Dict):
+        """Monta no processo filho o matcher de `worker_state` (só busca/extração, sem pools próprios)"""
+        state = dict(state)
+        orb_params = state.pop('orb_params')
+        annoy_file = state.pop('annoy_file', None)
+        vars(self).update(state)
         self.orb = cv2.ORB_create(
-            nfeatures=250,  # 🔧 BALANCEADO: Aumentado para melhor precisão (era 150)
-            scaleFactor=1.2,
-            nlevels=8,
-            edgeThreshold=31,
-            firstLevel=0,
-            WTA_K=2,
-            scoreType=cv2.ORB_HARRIS_SCORE,
-            patchSize=31,
-            fastThreshold=20
+            nfeatures=orb_params['nfeatures'],
+            scaleFactor=orb_params['scale_factor'],
+            nlevels=orb_params['nlevels'],
+            edgeThreshold=orb_params['edge_threshold'],
+            firstLevel=orb_params['first_level'],
+            WTA_K=orb_params['wta_k'],
+            scoreType=orb_params['score_type'],
+            patchSize=orb_params['patch_size'],
+            fastThreshold=orb_params['fast_threshold']
         )
+        self.annoy_index = None
+        if annoy_file is not None:
+            annoy_index = AnnoyIndex(self._annoy_dim(), self.annoy_metric)
+            annoy_index.load(annoy_file)
+            if annoy_index.get_n_items() == len(self.annoy_id_to_image):
+                self.annoy_index = annoy_index
+            else:
+                logger.warning(f"⚠️  {annoy_file} não corresponde ao índice Annoy da API; processo sem Annoy")
+        self.superseded_by = None
+        self.phash_stats_lock = threading.Lock()
+        self.graph_stats_lock = threading.Lock()
+        self._query_executor = None
+        self._query_executor_lock = threading.Lock()
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self._ingest_lock = threading.RLock()
+        self._rebuild_in_progress = threading.Event()
+        self.query_workers = 1  # O paralelismo vem dos processos
+        self.use_process_pool = False
+    
+    def _get_query_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Retorna o pool de threads persistente (recriado se o número de workers mudar)"""
+        with self._query_executor_lock:
+            if self._query_executor is None or self._query_executor_workers != self.query_workers:
+                if self._query_executor is not None:
+                    self._query_executor.shutdown(wait=False)
+                self._query_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.query_workers,
+                    thread_name_prefix="query"
+                )
+                self._query_executor_workers = self.query_workers
+            return self._query_executor
+    
+    def _annoy_lookup_chunk(self, annoy_index, query_vectors: np.ndarray, n_neighbors: int,
+                            search_k: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Consulta um bloco de descriptors no Annoy (executado em thread do pool)"""
+        chunk_ids = []
+        chunk_distances = []
+        for query_vector in query_vectors:
+            similar_ids, distances = annoy_index.get_nns_by_vector(
+                query_vector,
+                n_neighbors,
+                search_k=search_k,
+                include_distances=True
+            )
+            chunk_ids.append(np.asarray(similar_ids, dtype=np.int64))
+            chunk_distances.append(np.asarray(distances, dtype=np.float32))
+        return chunk_ids, chunk_distances
+    
+    def annoy_batch_lookup(self, query_descriptors: np.ndarray, n_neighbors: int = None,
+                           search_k: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Busca os vizinhos de todos os descriptors de consulta no Annoy em lote.
         
-        # Matcher para comparação de features
-        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        As consultas são divididas em blocos e distribuídas no pool persistente de
+        threads. Retorna arrays planos (índice do descriptor de consulta, ID do
+        Annoy, distância).
+        """
+        n_neighbors = n_neighbors or self.annoy_neighbors
+        search_k = search_k or self.annoy_search_k
+        annoy_index = self.annoy_index
+        query_vectors = self._to_annoy_vectors(query_descriptors)
         
-        # Cache de features das imagens do banco
-        self.database_features = {}
-        self.database_metadata = {}
+        n_chunks = max(1, min(self.query_workers, len(query_vectors)))
+        chunks = np.array_split(query_vectors, n_chunks)
         
-        # 🚀 Annoy - Índice e mapeamentos
-        self.annoy_index = None
-        self.annoy_id_to_image = {}  # Mapeia ID do Annoy para caminho da imagem
-        self.annoy_id_to_descriptor_idx = {}  # Mapeia ID do Annoy para índice do descriptor
+        if n_chunks == 1:
+            chunk_results = [self._annoy_lookup_chunk(annoy_index, chunks[0], n_neighbors, search_k)]
+        else:
+            executor = self._get_query_executor()
+            futures = [
+                executor.submit(self._annoy_lookup_chunk, annoy_index, chunk, n_neighbors, search_k)
+                for chunk in chunks
+            ]
+            chunk_results = [future.result() for future in futures]
         
-        # Carrega ou cria o banco de features
-        self.load_or_create_database()
+        all_ids = [ids for chunk_ids, _ in chunk_results for ids in chunk_ids]
+        all_distances = [dist for _, chunk_distances in chunk_results for dist in chunk_distances]
+        
+        if not all_ids:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float32)
+        
+        counts = [len(ids) for ids in all_ids]
+        query_idx = np.repeat(np.arange(len(all_ids), dtype=np.int64), counts)
+        return query_idx, np.concatenate(all_ids), np.concatenate(all_distances)
     
-    def get_memory_usage(self) -> Dict:
-        """Retorna informações sobre uso de memória"""
-        process = psutil.Process()
-        memory_info = process.memory_info()
-        memory_percent = process.memory_percent()
+    def _aggregate_votes(self, image_idxs: np.ndarray,
+                         similarities: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Agrega os votos (imagem, similaridade) da fase 1 por imagem.
         
-        return {
-            'rss_gb': memory_info.rss / (1024**3),  # Resident Set Size in GB
-            'vms_gb': memory_info.vms / (1024**3),  # Virtual Memory Size in GB
-            'percent': memory_percent,
-            'available_gb': psutil.virtual_memory().available / (1024**3)
-        }
+        Retorna os índices das imagens candidatas e, alinhados a eles, o número
+        de votos, a similaridade média e a melhor similaridade de cada uma.
+        """
+        candidate_idxs, inverse = np.unique(image_idxs, return_inverse=True)
+        vote_counts = np.bincount(inverse, minlength=len(candidate_idxs))
+        vote_sums = np.bincount(inverse, weights=similarities, minlength=len(candidate_idxs))
+        vote_means = vote_sums / np.maximum(vote_counts, 1)
+        
+        vote_best = np.zeros(len(candidate_idxs), dtype=np.float64)
+        np.maximum.at(vote_best, inverse, similarities)
+        
+        return candidate_idxs, vote_counts, vote_means, vote_best
     
-    def log_memory_usage(self, context: str = ""):
-        """Log do uso atual de memória"""
-        try:
-            mem = self.get_memory_usage()
-            logger.info(f"💾 Memória{' ' + context if context else ''}: "
-                       f"RSS={mem['rss_gb']:.2f}GB, "
-                       f"VMS={mem['vms_gb']:.2f}GB, "
-                       f"Uso={mem['percent']:.1f}%, "
-                       f"Disponível={mem['available_gb']:.2f}GB")
-        except Exception as e:
-            logger.warning(f"Erro ao obter info de memória: {e}")
+    def _top_candidate_positions(self, scores: np.ndarray, limit: int) -> np.ndarray:
+        """Posições dos `limit` maiores scores, em ordem decrescente"""
+        if len(scores) > limit:
+            positions = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            positions = np.arange(len(scores))
+        return positions[np.argsort(-scores[positions], kind='stable')]
     
-    def cleanup_memory(self):
-        """Força limpeza de memória"""
-        gc.collect()
-        logger.info("🧹 Limpeza de memória executada")
+    def signature_ranking(self, query_descriptors: np.ndarray, limit: int = None) -> Optional[np.ndarray]:
+        """Fase 0: imagens (ordem do store) ordenadas pela assinatura global; None se desabilitada"""
+        if not self.use_signature_prefilter or self.signature_index is None:
+            return None
+        if self.signature_index.n_images != len(self.database_features):
+            return None
+        
+        phase0_start = time.time()
+        ranking = self.signature_index.ranking(pack_descriptors(query_descriptors), limit)
+        logger.info(f"🧭 Fase 0: {len(ranking)} imagens ordenadas por assinatura em {time.time() - phase0_start:.3f}s")
+        return ranking
     
-    def preprocess_image(self, image: np.ndarray) -> np.ndarray:
-        """Pré-processamento da imagem para melhorar a detecção de features"""
-        # Converte para escala de cinza se necessário
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = image.copy()
+    def _signature_shortlist(self, query_descriptors: np.ndarray) -> Optional[np.ndarray]:
+        """Shortlist da fase 0 (índices ordenados do store) quando o banco é maior que ela"""
+        if len(self.database_features) <= self.signature_shortlist:
+            return None
+        ranking = self.signature_ranking(query_descriptors, self.signature_shortlist)
+        return None if ranking is None else np.sort(ranking)
+    
+    def _search_with_annoy(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
+        """Busca híbrida Annoy + ORB para melhor precisão"""
+        if self.annoy_index is None:
+            logger.warning("Índice Annoy não disponível, usando busca sequencial")
+            return self._search_sequential(query_descriptors, top_k)
         
-        # Equalização de histograma adaptativa para melhorar contraste
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
+        logger.info(f"🔍 Busca híbrida: {len(query_descriptors)} descritores de consulta")
         
-        # Redimensiona para tamanho padrão se muito grande
-        height, width = enhanced.shape
-        if max(height, width) > 1000:
-            scale = 1000 / max(height, width)
-            new_width = int(width * scale)
-            new_height = int(height * scale)
-            enhanced = cv2.resize(enhanced, (new_width, new_height))
+        # FASE 1: Busca Annoy para encontrar candidatos rapidamente
+        # Busca em lote: annoy_neighbors vizinhos por descriptor, annoy_search_k nós inspecionados.
+        # Sem shortlist da fase 0: o Annoy percorre as árvores inteiras de qualquer forma, e
+        # descartar votos fora dela só perderia matches que a assinatura grosseira não viu
+        delta = self.delta_index
+        phase1_start = time.time()
+        _, similar_ids, distances = self.annoy_batch_lookup(query_descriptors)
+        candidate_idxs, vote_counts, vote_means, vote_best = self._annoy_votes(
+            similar_ids, distances, query_descriptors, delta
+        )
         
-        return enhanced
-    
-    def extract_features(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        """Extrai features usando ORB"""
-        processed_image = self.preprocess_image(image)
-        keypoints, descriptors = self.orb.detectAndCompute(processed_image, None)
+        logger.info(f"🎯 Fase 1: {len(candidate_idxs)} candidatos via Annoy em {time.time() - phase1_start:.3f}s")
         
-        if descriptors is None:
-            return np.array([]), np.array([])
+        # FASE 2: Refinamento ORB em lote dos top candidatos (por melhor voto)
+        return self._rerank_candidates(
+            query_descriptors, top_k, 'annoy', self._annoy_candidate_paths(delta),
+            candidate_idxs, vote_counts, vote_means, vote_best,
+            n_indexed=len(self.annoy_image_paths), delta=delta
+        )
+    
+    def _annoy_votes(self, similar_ids: np.ndarray, distances: np.ndarray, query_descriptors: np.ndarray,
+                     delta: DeltaIndex) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Lookup vetorizado ID do Annoy -> imagem e agregação dos votos por imagem.
         
-        return keypoints, descriptors
+        Imagens do delta votam pelos vizinhos exatos de cada descriptor de consulta,
+        com índices a partir de len(annoy_image_paths) (ver `_annoy_candidate_paths`).
+        """
+        image_idxs = self.annoy_id_to_image[similar_ids]
+        similarities = self._annoy_distance_to_similarity(distances)
+        if delta.path_to_image:
+            _, delta_images, delta_distances = self.delta_knn(query_descriptors, delta)
+            image_idxs = np.concatenate((image_idxs, len(self.annoy_image_paths) + delta_images))
+            similarities = np.concatenate((
+                similarities, 1.0 - delta_distances.astype(np.float32) / (self.descriptor_dim * 8)
+            ))
+        return self._aggregate_votes(image_idxs, similarities)
     
-    def load_image(self, image_path: str) -> np.ndarray:
-        """Carrega imagem do disco"""
-        image = cv2.imread(image_path)
-        if image is None:
-            raise ValueError(f"Não foi possível carregar a imagem: {image_path}")
-        return image
+    def _annoy_candidate_paths(self, delta: DeltaIndex) -> List[str]:
+        """Caminhos indexados pelos candidatos do Annoy: imagens do índice seguidas das do delta"""
+        if not delta.path_to_image:
+            return self.annoy_image_paths
+        return self.annoy_image_paths + delta.image_paths
     
-    def save_cache(self):
-        """Salva cache de features e metadata"""
-        with open(self.features_cache_file, 'wb') as f:
-            pickle.dump(self.database_features, f)
+    def delta_knn(self, query_descriptors: np.ndarray, delta: DeltaIndex,
+                  k: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """k vizinhos exatos de cada descriptor de consulta entre as imagens vivas do delta.
+        
+        Retorna arrays planos (índice da consulta, imagem do delta, distância).
+        """
+        live_rows = delta.live_rows
+        k = min(k or self.annoy_neighbors, len(live_rows))
+        packed_query = pack_descriptors(query_descriptors)
+        if k == 0 or len(packed_query) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.uint16)
+        
+        keys = self._exact_scan_range(
+            packed_query, pack_descriptors(delta.descriptors[live_rows]), 0, len(live_rows), k
+        )
+        rows = live_rows[(keys & ((1 << 40) - 1)).ravel()]
+        query_idx = np.repeat(np.arange(len(packed_query), dtype=np.int64), keys.shape[1])
+        return query_idx, delta.row_image[rows], (keys >> 40).astype(np.uint16).ravel()
+    
+    def search_descriptors_batch(self, batch: List[Tuple[np.ndarray, int]]) -> List[List[Dict]]:
+        """Várias consultas (descriptors, top_k) de uma vez, para o micro-batching.
         
-        with open(self.metadata_cache_file, 'w') as f:
-            json.dump(self.database_metadata, f, indent=2)
+        Com o backend Annoy, os descriptors de todas as consultas passam por uma
+        única consulta em lote ao Annoy e os blocos de refinamento de todas vão
+        juntos para o pool. Os resultados são idênticos aos de `search_descriptors`;
+        os demais backends rodam consulta a consulta.
+        """
+        if len(batch) == 1 or self.search_backend != 'annoy' or not self.use_annoy or self.annoy_index is None:
+            return [self.search_descriptors(query_descriptors, top_k) for query_descriptors, top_k in batch]
         
-        logger.info(f"Cache salvo com {len(self.database_features)} imagens")
+        logger.info(f"📦 Lote de {len(batch)} consultas: fase 1 Annoy única + refinamento em lote")
+        delta = self.delta_index
+        image_paths = self._annoy_candidate_paths(delta)
         
-        # Salva índice Annoy se habilitado
-        if self.use_annoy and self.annoy_index is not None:
-            self.save_annoy_index()
+        # FASE 1: uma consulta Annoy para os descriptors de todo o lote, votos separados por consulta
+        phase1_start = time.time()
+        sizes = [len(query_descriptors) for query_descriptors, _ in batch]
+        query_idx, similar_ids, distances = self.annoy_batch_lookup(
+            np.concatenate([query_descriptors for query_descriptors, _ in batch])
+        )
+        bounds = np.searchsorted(query_idx, np.cumsum([0] + sizes))
+        votes = [
+            self._annoy_votes(similar_ids[start:end], distances[start:end], query_descriptors, delta)
+            for start, end, (query_descriptors, _) in zip(bounds[:-1], bounds[1:], batch)
+        ]
+        logger.info(f"🎯 Fase 1 do lote: {sum(sizes)} descritores via Annoy em {time.time() - phase1_start:.3f}s")
+        
+        # FASE 2: refinamento ORB de todas as consultas numa única passada no pool
+        phase2_start = time.time()
+        shortlisted = [
+            self._rerank_shortlist(image_paths, candidate_idxs, vote_best, len(self.annoy_image_paths))
+            for candidate_idxs, _, _, vote_best in votes
+        ]
+        orb_similarities = self.calculate_similarities_batch([
+            (query_descriptors, [self.image_descriptors(path, delta) for path in top_paths])
+            for (query_descriptors, _), (_, top_paths) in zip(batch, shortlisted)
+        ])
+        logger.info(f"🔬 Fase 2 do lote concluída em {time.time() - phase2_start:.3f}s")
+        
+        return [
+            self._hybrid_results(top_k, 'annoy', top_paths, top_positions, similarities, vote_counts, vote_means)
+            for (_, top_k), (top_positions, top_paths), similarities, (_, vote_counts, vote_means, _)
+            in zip(batch, shortlisted, orb_similarities, votes)
+        ]
     
-    def save_annoy_index(self):
-        """Salva índice Annoy e mapeamentos"""
-        try:
-            # Salva o índice
-            self.annoy_index.save(self.annoy_index_file)
-            
-            # Salva os mapeamentos
-            annoy_mapping = {
-                'id_to_image': self.annoy_id_to_image,
-                'id_to_descriptor_idx': self.annoy_id_to_descriptor_idx,
-                'n_trees': self.annoy_n_trees,
-                'descriptor_dim': self.descriptor_dim
-            }
-            
-            with open(self.annoy_mapping_file, 'w') as f:
-                json.dump(annoy_mapping, f, indent=2)
-            
-            logger.info(f"🚀 Índice Annoy salvo com {len(self.annoy_id_to_image)} descritores")
-            
-        except Exception as e:
-            logger.error(f"Erro ao salvar índice Annoy: {e}")
+    def _rerank_candidates(self, query_descriptors: np.ndarray, top_k: int, backend: str,
+                           image_paths: List[str], candidate_idxs: np.ndarray, vote_counts: np.ndarray,
+                           vote_means: np.ndarray, vote_best: np.ndarray, n_indexed: int = None,
+                           delta: DeltaIndex = None) -> List[Dict]:
+        """Fase 2 comum aos backends de candidatos: refinamento ORB em lote + score híbrido"""
+        top_positions, top_paths = self._rerank_shortlist(image_paths, candidate_idxs, vote_best, n_indexed)
+        
+        logger.info(f"🔬 Fase 2: Refinando {len(top_positions)} candidatos com ORB (lote)")
+        
+        phase2_start = time.time()
+        orb_similarities = self.calculate_similarities(
+            query_descriptors, [self.image_descriptors(path, delta) for path in top_paths]
+        )
+        logger.info(f"🔬 Fase 2 concluída em {time.time() - phase2_start:.3f}s")
+        
+        return self._hybrid_results(top_k, backend, top_paths, top_positions, orb_similarities,
+                                    vote_counts, vote_means)
     
-    def load_annoy_index(self) -> bool:
-        """Carrega índice Annoy e mapeamentos"""
-        try:
-            if (os.path.exists(self.annoy_index_file) and
-                os.path.exists(self.annoy_mapping_file)):
-                
-                # Carrega mapeamentos
-                with open(self.annoy_mapping_file, 'r') as f:
-                    annoy_mapping = json.load(f)
-                
-                self.annoy_id_to_image = annoy_mapping['id_to_image']
-                self.annoy_id_to_descriptor_idx = annoy_mapping['id_to_descriptor_idx']
-                
-                # Cria e carrega índice
-                self.annoy_index = AnnoyIndex(self.descriptor_dim, 'angular')
-                self.annoy_index.load(self.annoy_index_file)
-                
-                logger.info(f"🚀 Índice Annoy carregado com {len(self.annoy_id_to_image)} descritores")
-                return True
-                
-        except Exception as e:
-            logger.warning(f"Erro ao carregar índice Annoy: {e}")
+    def _rerank_shortlist(self, image_paths: List[str], candidate_idxs: np.ndarray, vote_best: np.ndarray,
+                          n_indexed: int = None) -> Tuple[np.ndarray, List[str]]:
+        """Posições (nos arrays de votos) e caminhos dos candidatos refinados na fase 2.
         
-        return False
+        Imagens removidas online (tombstones) ficam de fora; candidatos a partir de
+        `n_indexed` vêm do delta e valem mesmo com o caminho em tombstone (substituídas).
+        """
+        tombstones = self.tombstones
+        if tombstones:
+            n_indexed = len(image_paths) if n_indexed is None else n_indexed
+            alive = np.array([
+                idx >= n_indexed or image_paths[idx] not in tombstones for idx in candidate_idxs.tolist()
+            ], dtype=bool)
+            vote_best = np.where(alive, vote_best, -np.inf)
+        top_positions = self._top_candidate_positions(vote_best, self.rerank_candidates)
+        if tombstones:
+            top_positions = top_positions[alive[top_positions]]
+        return top_positions, [image_paths[idx] for idx in candidate_idxs[top_positions].tolist()]
     
-    def build_annoy_index(self):
-        """Constrói índice Annoy de forma incremental com monitoramento de memória"""
-        if not self.use_annoy:
-            return
-            
-        logger.info("🚀 Construindo índice Annoy OTIMIZADO...")
-        self.log_memory_usage("(inicial)")
+    def _hybrid_results(self, top_k: int, backend: str, top_paths: List[str], top_positions: np.ndarray,
+                        orb_similarities: np.ndarray, vote_counts: np.ndarray,
+                        vote_means: np.ndarray) -> List[Dict]:
+        """Score híbrido, early stopping e montagem dos top_k resultados da fase 2"""
+        # Score híbrido: ORB (70%) + fase 1 (30%)
+        vote_avgs = vote_means[top_positions]
+        hybrid_scores = orb_similarities * 0.7 + vote_avgs * 0.3
         
-        # Estima número total de descritores
-        total_descriptors = sum(len(descriptors) for descriptors in self.database_features.values())
-        total_images = len(self.database_features)
+        def build_result(i: int) -> Dict:
+            return {
+                'image_path': top_paths[i],
+                'similarity_score': float(hybrid_scores[i]),
+                'metadata': self.database_metadata.get(top_paths[i], {}),
+                'match_details': {
+                    'orb_similarity': float(orb_similarities[i]),
+                    f'{backend}_similarity': float(vote_avgs[i]),
+                    'hybrid_score': float(hybrid_scores[i]),
+                    f'{backend}_matches': int(vote_counts[top_positions[i]])
+                },
+                'search_method': f'hybrid_{backend}_orb'
+            }
         
-        logger.info(f"📊 Estimativa: {total_descriptors:,} descritores de {total_images:,} imagens")
-        logger.info(f"💾 Memória estimada do índice: ~{(total_descriptors * self.descriptor_dim * 4) / (1024**3):.2f} GB")
+        accepted = np.flatnonzero(hybrid_scores >= self.min_threshold)
         
-        # Verifica se há memória suficiente
-        current_mem = self.get_memory_usage()
-        estimated_gb = (total_descriptors * self.descriptor_dim * 4) / (1024**3)
+        # Early stopping com score híbrido (primeiro na ordem dos candidatos)
+        early_stops = accepted[hybrid_scores[accepted] >= self.early_stop_threshold]
+        if len(early_stops) > 0:
+            i = int(early_stops[0])
+            logger.info(f"🚀 EARLY STOP HÍBRIDO! Score {hybrid_scores[i]:.3f} (ORB: {orb_similarities[i]:.3f}) em '{top_paths[i]}'")
+            return [build_result(i)]
         
-        if estimated_gb > current_mem['available_gb'] * 0.8:  # 80% da memória disponível
-            logger.warning(f"⚠️  ATENÇÃO: Memória estimada ({estimated_gb:.2f}GB) próxima do limite disponível ({current_mem['available_gb']:.2f}GB)")
-            logger.info("💡 Considere reduzir ainda mais o número de features ou processar em lotes menores")
+        # Ordena por score híbrido e monta apenas os top_k resultados
+        ranked = accepted[np.argsort(-hybrid_scores[accepted], kind='stable')][:top_k]
+        logger.info(f"✅ Busca híbrida: {len(accepted)} resultados com ORB+{backend}")
         
-        # Cria novo índice
-        self.annoy_index = AnnoyIndex(self.descriptor_dim, 'angular')
-        self.annoy_id_to_image = {}
-        self.annoy_id_to_descriptor_idx = {}
+        return [build_result(int(i)) for i in ranked]
+    
+    def _descriptor_store(self) -> DescriptorStore:
+        """Store contíguo atual (empacota o dict em memória se a extração ainda não foi salva)"""
+        if isinstance(self.database_features, DescriptorStore):
+            return self.database_features
+        return DescriptorStore.from_dict(dict(self.database_features), self.descriptor_dim)
+    
+    def _exact_scan_range(self, packed_query: np.ndarray, packed_db: np.ndarray,
+                          row_start: int, row_end: int, k: int) -> np.ndarray:
+        """Varre um intervalo de linhas do banco em blocos mantendo os k mais próximos por consulta.
         
-        annoy_id = 0
-        processed_descriptors = 0
-        logger.info("🚀 Adicionando descritores ao índice (processamento incremental)...")
+        Retorna chaves int64 (distância << 40 | linha): ordenar as chaves ordena por
+        distância e desempata pela menor linha, deixando o top-k determinístico.
+        """
+        chunk_rows = min(self.exact_chunk_rows, 0xFFFF)
+        best_keys = np.empty((len(packed_query), 0), dtype=np.int64)
         
-        # Processa em lotes para monitoramento
-        for image_idx, (image_path, descriptors) in enumerate(self.database_features.items()):
-            # Adiciona todos os descriptors desta imagem
-            for desc_idx, descriptor in enumerate(descriptors):
-                # Converte descriptor para float32 (requerido pelo Annoy)
-                desc_float = descriptor.astype(np.float32)
-                
-                # Adiciona ao índice
-                self.annoy_index.add_item(annoy_id, desc_float)
-                
-                # Salva mapeamentos
-                self.annoy_id_to_image[str(annoy_id)] = image_path
-                self.annoy_id_to_descriptor_idx[str(annoy_id)] = desc_idx
-                
-                annoy_id += 1
-                processed_descriptors += 1
+        for chunk_start in range(row_start, row_end, chunk_rows):
+            chunk_end = min(chunk_start + chunk_rows, row_end)
+            distances = hamming_distance_matrix(packed_query, packed_db[chunk_start:chunk_end])
             
-            # Log do progresso e memória a cada lote de imagens
-            if (image_idx + 1) % 1000 == 0 or (image_idx + 1) == total_images:
-                progress_pct = ((image_idx + 1) / total_images) * 100
-                logger.info(f"📈 Progresso: {image_idx + 1:,}/{total_images:,} imagens ({progress_pct:.1f}%) - {processed_descriptors:,} descritores")
-                self.log_memory_usage(f"(após {image_idx + 1:,} imagens)")
-                
-                # Força limpeza de memória a cada 5000 imagens
-                if (image_idx + 1) % 5000 == 0:
-                    self.cleanup_memory()
-
-        # Log memória antes da construção das árvores
-        logger.info(f"🔨 Construindo {self.annoy_n_trees} árvores para {annoy_id:,} descritores...")
-        logger.info("⏳ Este processo pode demorar alguns minutos e usar bastante memória...")
-        self.log_memory_usage("(antes da construção)")
+            # Chaves únicas do bloco (distância << 16 | coluna) para o top-k local
+            local_keys = distances.astype(np.uint32)
+            local_keys <<= 16
+            local_keys |= np.arange(chunk_end - chunk_start, dtype=np.uint32)
+            chunk_k = min(k, chunk_end - chunk_start)
+            if chunk_k < local_keys.shape[1]:
+                local_keys = np.partition(local_keys, chunk_k - 1, axis=1)[:, :chunk_k]
+            
+            chunk_keys = ((local_keys >> 16).astype(np.int64) << 40) | ((local_keys & 0xFFFF).astype(np.int64) + chunk_start)
+            
+            # Funde com o top-k acumulado
+            best_keys = np.concatenate((best_keys, chunk_keys), axis=1)
+            if best_keys.shape[1] > k:
+                best_keys = np.partition(best_keys, k - 1, axis=1)[:, :k]
         
-        build_start = time.time()
-        self.annoy_index.build(self.annoy_n_trees)
-        build_time = time.time() - build_start
+        return best_keys
+    
+    def exact_knn(self, query_descriptors: np.ndarray, k: int = None,
+                  store: DescriptorStore = None,
+                  image_idxs: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """k vizinhos exatos (Hamming) de cada descriptor de consulta por força bruta.
         
-        # Log final
-        self.log_memory_usage("(após construção)")
-        self.cleanup_memory()
+        Varre a matriz contígua de descriptors em blocos de `exact_chunk_rows`
+        linhas, com intervalos de linhas distribuídos no pool de consultas.
+        Retorna arrays planos (índice da consulta, linha do descriptor no store,
+        distância), ordenados por distância dentro de cada consulta. Serve de
+        ground truth para medir o recall dos índices aproximados. Com
+        `image_idxs` (ordenados) só os descriptors dessas imagens são varridos.
+        """
+        k = k or self.exact_neighbors
+        store = store if store is not None else self._descriptor_store()
+        packed_db = pack_descriptors(store.descriptors)
+        rows = None
+        if image_idxs is not None:
+            counts = store.offsets[image_idxs + 1] - store.offsets[image_idxs]
+            rows = np.repeat(store.offsets[image_idxs] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            packed_db = packed_db[rows]
+        packed_query = pack_descriptors(query_descriptors)
+        n_rows = len(packed_db)
+        k = min(k, n_rows)
         
-        logger.info(f"✅ Índice Annoy construído com sucesso!")
-        logger.info(f"📊 Total: {annoy_id:,} descritores de {total_images:,} imagens")
-        logger.info(f"⏱️  Tempo de construção: {build_time:.2f} segundos")
-        logger.info(f"🌳 Árvores construídas: {self.annoy_n_trees}")
-        logger.info(f"🔧 Otimizações aplicadas: ORB features reduzidas para {self.orb.getMaxFeatures()}")
-    
-    def load_cache(self) -> bool:
-        """Carrega cache de features e metadata"""
-        try:
-            if os.path.exists(self.features_cache_file) and os.path.exists(self.metadata_cache_file):
-                with open(self.features_cache_file, 'rb') as f:
-                    self.database_features = pickle.load(f)
-                
-                with open(self.metadata_cache_file, 'r') as f:
-                    self.database_metadata = json.load(f)
-                
-                logger.info(f"Cache carregado com {len(self.database_features)} imagens")
-                
-                # Tenta carregar índice Annoy
-                if self.use_annoy:
-                    if not self.load_annoy_index():
-                        logger.info("Índice Annoy não encontrado, será construído...")
-                        self.build_annoy_index()
-                
-                return True
-        except Exception as e:
-            logger.warning(f"Erro ao carregar cache: {e}")
+        if k == 0 or len(packed_query) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.uint16)
         
-        return False
-    
-    def process_database_images(self):
-        """Processa todas as imagens do banco e extrai features com otimizações de memória"""
-        if not os.path.exists(self.database_path):
-            raise ValueError(f"Diretório do banco não encontrado: {self.database_path}")
+        n_ranges = max(1, min(self.query_workers, n_rows // self.exact_chunk_rows))
+        bounds = np.linspace(0, n_rows, n_ranges + 1).astype(np.int64)
         
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'}
-        processed_count = 0
-        skipped_count = 0
-        total_features = 0
+        if n_ranges == 1:
+            partials = [self._exact_scan_range(packed_query, packed_db, 0, n_rows, k)]
+        else:
+            executor = self._get_query_executor()
+            futures = [
+                executor.submit(self._exact_scan_range, packed_query, packed_db, int(start), int(end), k)
+                for start, end in zip(bounds[:-1], bounds[1:])
+            ]
+            partials = [future.result() for future in futures]
         
-        # Conta total de arquivos primeiro
-        all_image_files = []
-        for root, dirs, files in os.walk(self.database_path):
-            for file in files:
-                file_ext = os.path.splitext(file)[1].lower()
-                if file_ext in image_extensions:
-                    all_image_files.append(os.path.join(root, file))
+        # Top-k final ordenado por (distância, linha)
+        keys = np.sort(np.concatenate(partials, axis=1), axis=1)[:, :k]
+        ids = (keys & ((1 << 40) - 1)).ravel()
+        distances = (keys >> 40).astype(np.uint16).ravel()
+        if rows is not None:
+            ids = rows[ids]
         
-        total_files = len(all_image_files)
-        logger.info(f"🖼️  Encontrados {total_files:,} arquivos de imagem para processar")
-        logger.info(f"🔧 Configuração ORB: {self.orb.getMaxFeatures()} features máximas por imagem")
+        query_idx = np.repeat(np.arange(len(packed_query), dtype=np.int64), k)
+        return query_idx, ids, distances
+    
+    def _search_exact(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
+        """Busca híbrida com candidatos exatos (força bruta) + refinamento ORB"""
+        logger.info(f"🔍 Busca exata: {len(query_descriptors)} descritores de consulta")
         
-        # Processa imagens
-        for idx, file_path in enumerate(all_image_files):
-            try:
-                image = self.load_image(file_path)
-                keypoints, descriptors = self.extract_features(image)
-                
-                if descriptors is not None and len(descriptors) > 0:
-                    relative_path = os.path.relpath(file_path, self.database_path)
-                    
-                    self.database_features[relative_path] = descriptors
-                    self.database_metadata[relative_path] = {
-                        'filename': os.path.basename(file_path),
-                        'path': file_path,
-                        'features_count': len(descriptors),
-                        'image_shape': image.shape
-                    }
-                    
-                    processed_count += 1
-                    total_features += len(descriptors)
-                    
-                    # Log progresso a cada 100 imagens
-                    if processed_count % 100 == 0 or processed_count == 1:
-                        progress_pct = ((idx + 1) / total_files) * 100
-                        avg_features = total_features / processed_count
-                        logger.info(f"📈 Progresso: {processed_count:,}/{total_files:,} ({progress_pct:.1f}%) - Média: {avg_features:.0f} features/img")
-                else:
-                    skipped_count += 1
-                    if skipped_count <= 10:  # Log apenas as primeiras 10 falhas
-                        logger.warning(f"⚠️  Imagem sem features: {os.path.basename(file_path)}")
-                
-                # Libera memória da imagem processada
-                del image
-                if descriptors is not None:
-                    del descriptors, keypoints
-                        
-            except Exception as e:
-                skipped_count += 1
-                logger.error(f"❌ Erro ao processar {os.path.basename(file_path)}: {e}")
+        # FASE 1: k vizinhos exatos de cada descriptor votam em suas imagens
+        shortlist = self._signature_shortlist(query_descriptors)
+        phase1_start = time.time()
+        store = self._descriptor_store()
+        _, descriptor_ids, distances = self.exact_knn(query_descriptors, store=store, image_idxs=shortlist)
         
-        # Estatísticas finais
-        avg_features_per_image = total_features / processed_count if processed_count > 0 else 0
-        estimated_memory_gb = (total_features * self.descriptor_dim * 4) / (1024**3)
+        return self._rerank_descriptor_votes(
+            query_descriptors, top_k, 'exact', store, descriptor_ids, distances, phase1_start
+        )
+    
+    def _rerank_descriptor_votes(self, query_descriptors: np.ndarray, top_k: int, backend: str,
+                                 store: DescriptorStore, descriptor_ids: np.ndarray,
+                                 distances: np.ndarray, phase1_start: float) -> List[Dict]:
+        """Converte vizinhos (linhas do store, distância Hamming) em votos por imagem e refina com ORB"""
+        image_idxs = np.searchsorted(store.offsets, descriptor_ids, side='right') - 1
+        similarities = 1.0 - distances.astype(np.float32) / (self.descriptor_dim * 8)
+        candidate_idxs, vote_counts, vote_means, vote_best = self._aggregate_votes(image_idxs, similarities)
         
-        logger.info(f"✅ PROCESSAMENTO CONCLUÍDO:")
-        logger.info(f"   📊 Imagens processadas: {processed_count:,}")
-        logger.info(f"   ⚠️  Imagens ignoradas: {skipped_count:,}")
-        logger.info(f"   🔍 Total de features: {total_features:,}")
-        logger.info(f"   📈 Média de features/imagem: {avg_features_per_image:.1f}")
-        logger.info(f"   💾 Memória estimada do índice: ~{estimated_memory_gb:.2f} GB")
+        logger.info(f"🎯 Fase 1: {len(candidate_idxs)} candidatos via {backend} em {time.time() - phase1_start:.3f}s")
+        
+        # FASE 2: Refinamento ORB em lote dos top candidatos
+        return self._rerank_candidates(
+            query_descriptors, top_k, backend, store.image_paths,
+            candidate_idxs, vote_counts, vote_means, vote_best
+        )
+    
+    def mih_knn(self, query_descriptors: np.ndarray, k: int = None, max_radius: int = None,
+                store: DescriptorStore = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """k vizinhos exatos (até `max_radius`) de cada descriptor de consulta via MIH.
         
-        # Constrói índice Annoy se habilitado
-        if self.use_annoy and processed_count > 0:
-            self.build_annoy_index()
+        Os descriptors de consulta são divididos em blocos no pool de consultas.
+        Retorna arrays planos (índice da consulta, linha do store, distância) no
+        mesmo formato e ordem de `exact_knn`.
+        """
+        k = k or self.mih_neighbors
+        max_radius = self.mih_max_radius if max_radius is None else max_radius
+        store = store if store is not None else self._descriptor_store()
+        mih_index = self.mih_index
+        packed_db = pack_descriptors(store.descriptors)
+        packed_query = pack_descriptors(query_descriptors)
         
-        self.save_cache()
+        n_chunks = max(1, min(self.query_workers, len(packed_query)))
+        bounds = np.linspace(0, len(packed_query), n_chunks + 1).astype(np.int64)
+        
+        if n_chunks == 1:
+            partials = [mih_index.knn(packed_db, packed_query, k, max_radius)]
+        else:
+            executor = self._get_query_executor()
+            futures = [
+                executor.submit(mih_index.knn, packed_db, packed_query[start:end], k, max_radius)
+                for start, end in zip(bounds[:-1], bounds[1:])
+            ]
+            partials = [future.result() for future in futures]
+        
+        query_idx = np.concatenate([q + start for (q, _, _), start in zip(partials, bounds[:-1])])
+        ids = np.concatenate([ids for _, ids, _ in partials])
+        distances = np.concatenate([dist for _, _, dist in partials])
+        return query_idx, ids, distances
     
-    def load_or_create_database(self):
-        """Carrega cache existente ou processa imagens do banco"""
-        if not self.load_cache():
-            logger.info("Cache não encontrado. Processando imagens do banco...")
-            self.process_database_images()
+    def _search_mih(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
+        """Busca híbrida com vizinhos exatos do multi-index hashing + refinamento ORB"""
+        logger.info(f"🔍 Busca MIH: {len(query_descriptors)} descritores de consulta")
+        
+        # FASE 1: vizinhos exatos dentro do raio votam em suas imagens
+        phase1_start = time.time()
+        store = self._descriptor_store()
+        _, descriptor_ids, distances = self.mih_knn(query_descriptors, store=store)
+        
+        return self._rerank_descriptor_votes(
+            query_descriptors, top_k, 'mih', store, descriptor_ids, distances, phase1_start
+        )
     
-    def calculate_similarity(self, descriptors1: np.ndarray, descriptors2: np.ndarray) -> float:
-        """Calcula similaridade melhorada entre dois conjuntos de descriptors"""
-        if descriptors1 is None or descriptors2 is None or len(descriptors1) == 0 or len(descriptors2) == 0:
-            return 0.0
+    def _search_bow(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
+        """Busca híbrida com candidatos do arquivo invertido tf-idf + refinamento ORB"""
+        logger.info(f"🔍 Busca BoVW: {len(query_descriptors)} descritores de consulta")
         
-        try:
-            matches = self.matcher.match(descriptors1, descriptors2)
-            
-            if len(matches) == 0:
-                return 0.0
-            
-            # Ordena matches por distância (melhores primeiro)
-            matches = sorted(matches, key=lambda x: x.distance)
-            
-            # Filtros de qualidade progressivos
-            excellent_matches = [m for m in matches if m.distance < 25]  # Matches excelentes
-            good_matches = [m for m in matches if m.distance < 40]       # Matches bons
-            decent_matches = [m for m in matches if m.distance < 60]     # Matches decentes
-            
-            # Calcula métricas de qualidade
-            total_features = min(len(descriptors1), len(descriptors2))
-            excellent_ratio = len(excellent_matches) / total_features
-            good_ratio = len(good_matches) / total_features
-            decent_ratio = len(decent_matches) / total_features
-            
-            # Score ponderado por qualidade das matches
-            quality_score = (
-                excellent_ratio * 1.0 +    # Peso total para matches excelentes
-                good_ratio * 0.7 +         # Peso alto para matches bons
-                decent_ratio * 0.4         # Peso moderado para matches decentes
-            ) / 3.0
-            
-            # Score baseado na distribuição de distâncias
-            if len(good_matches) > 0:
-                avg_distance = sum(m.distance for m in good_matches) / len(good_matches)
-                distance_score = max(0, (80 - avg_distance) / 80)  # Normaliza para 0-1
-            else:
-                distance_score = 0.0
-            
-            # Score de cobertura (quantas features foram matcheadas)
-            coverage_score = len(decent_matches) / total_features
-            
-            # Combinação final ponderada
-            final_score = (
-                quality_score * 0.5 +      # 50% qualidade das matches
-                distance_score * 0.3 +     # 30% qualidade das distâncias
-                coverage_score * 0.2       # 20% cobertura de features
+        # FASE 1: produto escalar esparso consulta x imagens pelas listas invertidas
+        phase1_start = time.time()
+        candidate_idxs, bow_scores, shared_words = self.bow_index.query(
+            pack_descriptors(query_descriptors), self.bow_max_df_ratio
+        )
+        
+        logger.info(f"🎯 Fase 1: {len(candidate_idxs)} candidatos via BoVW em {time.time() - phase1_start:.3f}s")
+        
+        # O cosseno tf-idf só ordena a shortlist; para o score híbrido usar a mesma escala
+        # dos outros backends, os vizinhos exatos restritos à shortlist votam como em `_search_exact`
+        store = self._descriptor_store()
+        top_positions, _ = self._rerank_shortlist(store.image_paths, candidate_idxs, bow_scores)
+        vote_means = np.zeros(len(candidate_idxs), dtype=np.float64)
+        if len(top_positions) > 0:
+            _, descriptor_ids, distances = self.exact_knn(
+                query_descriptors, store=store, image_idxs=np.sort(candidate_idxs[top_positions])
             )
-            
-            # Bonus para imagens com muitas matches excelentes
-            if excellent_ratio > 0.1:  # Mais de 10% de matches excelentes
-                excellent_bonus = min(excellent_ratio * 0.2, 0.1)  # Até 10% de bonus
-                final_score += excellent_bonus
-            
-            return min(final_score, 1.0)
-            
-        except Exception as e:
-            logger.error(f"Erro no cálculo de similaridade: {e}")
-            return 0.0
+            image_idxs = np.searchsorted(store.offsets, descriptor_ids, side='right') - 1
+            similarities = 1.0 - distances.astype(np.float32) / (self.descriptor_dim * 8)
+            voted_idxs, _, voted_means, _ = self._aggregate_votes(image_idxs, similarities)
+            vote_means[np.searchsorted(candidate_idxs, voted_idxs)] = voted_means
+        
+        # FASE 2: Refinamento ORB em lote dos top candidatos (por score tf-idf)
+        return self._rerank_candidates(
+            query_descriptors, top_k, 'bow', store.image_paths,
+            candidate_idxs, shared_words, vote_means, bow_scores
+        )
     
-    def search_similar_images(self, query_image: np.ndarray, top_k: int = 5) -> List[Dict]:
-        """Busca imagens similares no banco com otimizações de performance"""
-        start_time = time.time()
-        query_keypoints, query_descriptors = self.extract_features(query_image)
+    def lsh_knn(self, query_descriptors: np.ndarray, k: int = None,
+                probe_radius: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """k vizinhos aproximados de cada descriptor de consulta via LSH multi-probe.
         
-        if query_descriptors is None or len(query_descriptors) == 0:
-            return []
+        Retorna arrays planos (índice da consulta, linha do índice LSH, distância).
+        """
+        k = k or self.lsh_neighbors
+        probe_radius = self.lsh_probe_radius if probe_radius is None else probe_radius
+        lsh_index = self.lsh_index
+        query_descriptors = np.ascontiguousarray(query_descriptors, dtype=np.uint8)
+        packed_query = pack_descriptors(query_descriptors)
         
-        logger.info(f"🔍 Iniciando busca em {len(self.database_features)} imagens")
+        n_chunks = max(1, min(self.query_workers, len(packed_query)))
+        bounds = np.linspace(0, len(packed_query), n_chunks + 1).astype(np.int64)
         
-        # 🚀 Escolhe método de busca
-        if self.use_annoy and self.annoy_index is not None:
-            logger.info(f"🚀 Usando busca Annoy (search_k={self.annoy_search_k})")
-            results = self._search_with_annoy(query_descriptors, top_k)
-        elif self.use_parallel_search:
-            logger.info(f"⚡ Usando busca paralela (workers={self.max_workers})")
-            results = self._search_parallel(query_descriptors, top_k)
+        if n_chunks == 1:
+            partials = [lsh_index.knn(packed_query, query_descriptors, k, probe_radius)]
         else:
-            logger.info("🔄 Usando busca sequencial")
-            results = self._search_sequential(query_descriptors, top_k)
+            executor = self._get_query_executor()
+            futures = [
+                executor.submit(lsh_index.knn, packed_query[start:end], query_descriptors[start:end], k, probe_radius)
+                for start, end in zip(bounds[:-1], bounds[1:])
+            ]
+            partials = [future.result() for future in futures]
         
-        elapsed_time = time.time() - start_time
-        logger.info(f"✅ Busca concluída em {elapsed_time:.2f}s - {len(results)} resultados encontrados")
+        query_idx = np.concatenate([q + start for (q, _, _), start in zip(partials, bounds[:-1])])
+        ids = np.concatenate([ids for _, ids, _ in partials])
+        distances = np.concatenate([dist for _, _, dist in partials])
+        return query_idx, ids, distances
+    
+    def _search_lsh(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
+        """Busca híbrida com candidatos do LSH multi-probe + refinamento ORB"""
+        logger.info(f"🔍 Busca LSH: {len(query_descriptors)} descritores de consulta")
         
-        return results
+        # FASE 1: vizinhos das tabelas LSH votam em suas imagens
+        phase1_start = time.time()
+        lsh_index = self.lsh_index
+        _, rows, distances = self.lsh_knn(query_descriptors)
+        
+        image_idxs = lsh_index.row_image[rows]
+        similarities = 1.0 - distances.astype(np.float32) / (self.descriptor_dim * 8)
+        candidate_idxs, vote_counts, vote_means, vote_best = self._aggregate_votes(image_idxs, similarities)
+        
+        logger.info(f"🎯 Fase 1: {len(candidate_idxs)} candidatos via lsh em {time.time() - phase1_start:.3f}s")
+        
+        # FASE 2: Refinamento ORB em lote dos top candidatos
+        return self._rerank_candidates(
+            query_descriptors, top_k, 'lsh', lsh_index.image_paths,
+            candidate_idxs, vote_counts, vote_means, vote_best
+        )
     
-    def _search_with_annoy(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
-        """Busca híbrida Annoy + ORB para melhor precisão"""
-        if self.annoy_index is None:
-            logger.warning("Índice Annoy não disponível, usando busca sequencial")
-            return self._search_sequential(query_descriptors, top_k)
+    def graph_knn(self, query_descriptors: np.ndarray, k: int = None,
+                  ef: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """k vizinhos aproximados de cada descriptor de consulta via beam search no grafo.
         
-        logger.info(f"🔍 Busca híbrida: {len(query_descriptors)} descritores de consulta")
+        Retorna arrays planos (índice da consulta, linha do grafo, distância).
+        """
+        k = k or self.graph_neighbors
+        ef = ef or self.graph_ef_search
+        graph_index = self.graph_index
+        packed_query = pack_descriptors(query_descriptors)
+        query_start = time.time()
         
-        # FASE 1: Busca Annoy para encontrar candidatos rapidamente
-        candidate_images = set()
-        image_scores = {}
+        n_chunks = max(1, min(self.query_workers, len(packed_query)))
+        bounds = np.linspace(0, len(packed_query), n_chunks + 1).astype(np.int64)
         
-        # Aumenta temporariamente o search_k para melhor recall
-        search_k_expanded = min(self.annoy_search_k * 3, 300)
+        if n_chunks == 1:
+            partials = [graph_index.knn(packed_query, k, ef, self.graph_expand_width)]
+        else:
+            executor = self._get_query_executor()
+            futures = [
+                executor.submit(graph_index.knn, packed_query[start:end], k, ef, self.graph_expand_width)
+                for start, end in zip(bounds[:-1], bounds[1:])
+            ]
+            partials = [future.result() for future in futures]
         
-        for query_desc in query_descriptors:
-            query_float = query_desc.astype(np.float32)
-            
-            # Busca mais candidatos no Annoy
-            similar_ids, distances = self.annoy_index.get_nns_by_vector(
-                query_float,
-                search_k_expanded,
-                include_distances=True
-            )
-            
-            # Coleta candidatos únicos
-            for annoy_id, distance in zip(similar_ids, distances):
-                image_path = self.annoy_id_to_image.get(str(annoy_id))
-                if image_path is None:
-                    continue
-                
-                candidate_images.add(image_path)
-                
-                # Score Annoy melhorado
-                similarity = max(0, 1 - distance / 2)
-                
-                if image_path not in image_scores:
-                    image_scores[image_path] = {
-                        'annoy_scores': [],
-                        'annoy_best': 0.0
-                    }
-                
-                image_scores[image_path]['annoy_scores'].append(similarity)
-                image_scores[image_path]['annoy_best'] = max(
-                    image_scores[image_path]['annoy_best'], similarity
-                )
+        query_seconds = time.time() - query_start
+        expansions = sum(expansions for *_, expansions in partials)
+        with self.graph_stats_lock:
+            self.graph_stats["queries"] += 1
+            self.graph_stats["query_seconds"] += query_seconds
+            self.graph_stats["expansions"] += expansions
+            self.graph_stats["descriptors"] += len(packed_query)
         
-        logger.info(f"🎯 Fase 1: {len(candidate_images)} candidatos via Annoy")
+        query_idx = np.concatenate([q + start for (q, *_), start in zip(partials, bounds[:-1])])
+        rows = np.concatenate([rows for _, rows, _, _ in partials])
+        distances = np.concatenate([dist for _, _, dist, _ in partials])
+        return query_idx, rows, distances
+    
+    def _search_graph(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
+        """Busca híbrida com candidatos do grafo navegável + refinamento ORB"""
+        logger.info(f"🔍 Busca em grafo: {len(query_descriptors)} descritores de consulta")
         
-        # FASE 2: Refinamento com ORB tradicional nos top candidatos
-        top_candidates = sorted(
-            candidate_images,
-            key=lambda img: image_scores[img]['annoy_best'],
-            reverse=True
-        )[:min(100, len(candidate_images))]  # Refina top 100
+        # FASE 1: vizinhos encontrados no grafo votam em suas imagens
+        phase1_start = time.time()
+        graph_index = self.graph_index
+        _, rows, distances = self.graph_knn(query_descriptors)
         
-        logger.info(f"🔬 Fase 2: Refinando {len(top_candidates)} candidatos com ORB")
+        image_idxs = graph_index.row_image[rows]
+        similarities = 1.0 - distances.astype(np.float32) / (self.descriptor_dim * 8)
+        candidate_idxs, vote_counts, vote_means, vote_best = self._aggregate_votes(image_idxs, similarities)
         
-        refined_results = []
-        for image_path in top_candidates:
-            # Calcula similaridade ORB tradicional (mais precisa)
-            db_descriptors = self.database_features.get(image_path)
-            if db_descriptors is None:
-                continue
-            
-            orb_similarity = self.calculate_similarity(query_descriptors, db_descriptors)
-            
-            # Score híbrido: ORB (70%) + Annoy (30%)
-            annoy_avg = sum(image_scores[image_path]['annoy_scores']) / len(image_scores[image_path]['annoy_scores'])
-            hybrid_score = orb_similarity * 0.7 + annoy_avg * 0.3
-            
-            if hybrid_score >= self.min_threshold:
-                result = {
-                    'image_path': image_path,
-                    'similarity_score': hybrid_score,
-                    'metadata': self.database_metadata.get(image_path, {}),
-                    'match_details': {
-                        'orb_similarity': orb_similarity,
-                        'annoy_similarity': annoy_avg,
-                        'hybrid_score': hybrid_score,
-                        'annoy_matches': len(image_scores[image_path]['annoy_scores'])
-                    },
-                    'search_method': 'hybrid_annoy_orb'
-                }
-                refined_results.append(result)
-                
-                # Early stopping com score híbrido
-                if hybrid_score >= self.early_stop_threshold:
-                    logger.info(f"🚀 EARLY STOP HÍBRIDO! Score {hybrid_score:.3f} (ORB: {orb_similarity:.3f}) em '{image_path}'")
-                    return [result]
+        logger.info(f"🎯 Fase 1: {len(candidate_idxs)} candidatos via graph em {time.time() - phase1_start:.3f}s")
         
-        # Ordena por score híbrido
-        refined_results.sort(key=lambda x: x['similarity_score'], reverse=True)
-        logger.info(f"✅ Busca híbrida: {len(refined_results)} resultados com ORB+Annoy")
+        # FASE 2: Refinamento ORB em lote dos top candidatos
+        return self._rerank_candidates(
+            query_descriptors, top_k, 'graph', graph_index.image_paths,
+            candidate_idxs, vote_counts, vote_means, vote_best
+        )
+    
+    def _scan_items(self, query_descriptors: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+        """Pares (caminho, descriptors) na ordem da fase 0: as imagens mais parecidas primeiro
+        fazem o early stopping disparar cedo. Sem assinaturas, segue a ordem do banco.
+        Tombstones ficam de fora e as imagens do delta entram no fim."""
+        ranking = self.signature_ranking(query_descriptors)
+        if ranking is None:
+            items = list(self.database_features.items())
+        else:
+            image_paths = self.database_features.image_paths
+            items = [(image_paths[idx], self.database_features.descriptors_at(idx)) for idx in ranking.tolist()]
         
-        return refined_results[:top_k]
+        delta, tombstones = self.delta_index, self.tombstones
+        if tombstones:
+            items = [(path, descriptors) for path, descriptors in items if path not in tombstones]
+        items.extend((path, delta.descriptors_of(path)) for path in delta.path_to_image)
+        return items
     
     def _search_sequential(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
         """Busca sequencial com early stopping otimizado"""
@@ -579,7 +4320,7 @@ class ImageMatcher:
         images_processed = 0
         early_stopped = False
         
-        for image_path, db_descriptors in self.database_features.items():
+        for image_path, db_descriptors in self._scan_items(query_descriptors):
             similarity = self.calculate_similarity(query_descriptors, db_descriptors)
             images_processed += 1
             
@@ -639,7 +4380,7 @@ class ImageMatcher:
     
     def _search_parallel(self, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
         """Busca paralela com early stopping"""
-        database_items = list(self.database_features.items())
+        database_items = self._scan_items(query_descriptors)
         
         # Divide em lotes para processamento paralelo
         batches = [
@@ -687,7 +4428,73 @@ class ImageMatcher:
         return all_results[:top_k]
 
 # Instância global do matcher
-matcher = ImageMatcher()
+# 🧩 Processos de busca e de extração: nascem do forkserver (sem as threads da API) e recebem
+# o estado do matcher pelo initializer
+WORKER_PROCESS_PREFIX = "pin-worker"
+
+class _WorkerProcess(multiprocessing.context.ForkServerProcess):
+    """Processo dos pools; o nome marcado chega ao filho antes de ele importar este módulo"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = f"{WORKER_PROCESS_PREFIX}-{self.name}"
+
+class _WorkerContext(multiprocessing.context.ForkServerContext):
+    Process = _WorkerProcess
+
+_worker_context = _WorkerContext()
+# O forkserver pré-carrega só as bibliotecas pesadas; este módulo é importado em cada filho
+_worker_context.set_forkserver_preload(['numpy', 'cv2', 'annoy'])
+
+_process_matcher = None
+
+def _init_worker_process(state: Dict):
+    """Monta o matcher do processo filho a partir de `ImageMatcher.worker_state`"""
+    global _process_matcher
+    cv2.setNumThreads(1)  # O paralelismo vem dos processos
+    _process_matcher = ImageMatcher.__new__(ImageMatcher)
+    _process_matcher.restore_worker_state(state)
+
+def _search_in_process(config: Dict, query_descriptors: np.ndarray, top_k: int) -> List[Dict]:
+    """Fases 1 e 2 no processo filho com a configuração atual do processo da API"""
+    for name, value in config.items():
+        setattr(_process_matcher, name, value)
+    return _process_matcher.search_descriptors(query_descriptors, top_k)
+
+def _extract_chunk_in_process(file_paths: List[str]) -> List[Tuple]:
+    """Extração de um bloco de imagens do banco no processo filho"""
+    return _process_matcher._extract_image_entries(file_paths)
+
+# Os processos dos pools importam o módulo só pelas classes e funções: não carregam o banco
+if multiprocessing.current_process().name.startswith(WORKER_PROCESS_PREFIX):
+    matcher = None
+else:
+    matcher = ImageMatcher()
+jobs = JobRegistry()
+
+def run_rebuild_job(build) -> object:
+    """Constrói uma nova geração dos índices e troca o matcher global ao terminar.
+    
+    Requisições em andamento terminam na geração antiga (guardam a referência
+    ao matcher); as seguintes leem a global e já usam a nova.
+    """
+    global matcher
+    with matcher._ingest_lock:
+        matcher, result = matcher.rebuild_generation(build)
+        matcher.clear_result_caches()  # Resultados gravados pela geração antiga durante a construção
+    return result
+
+def run_index_rollback() -> Dict:
+    """Rollback da geração dos índices; a troca do matcher global acontece ainda sob o lock de ingestão"""
+    global matcher
+    with matcher._online_update():
+        matcher, summary = matcher.rollback_index_generation()
+    return summary
+
+def start_rebuild_job(kind: str, build) -> Dict:
+    """Agenda uma reconstrução em segundo plano; devolve o id e a URL de acompanhamento"""
+    job = jobs.submit(kind, functools.partial(run_rebuild_job, build))
+    return {"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"}
 
 @app.get("/")
 async def root():
@@ -708,16 +4515,30 @@ async def root():
             "status": annoy_status,
             "n_trees": matcher.annoy_n_trees,
             "search_k": matcher.annoy_search_k,
+            "neighbors": matcher.annoy_neighbors,
+            "metric": matcher.annoy_metric,
             "total_descriptors": len(matcher.annoy_id_to_image) if annoy_loaded else 0
         },
         "endpoints": {
             "/search": "POST - Busca imagens similares (Annoy/early stopping)",
             "/searchtest": "POST - Retorna apenas a imagem com maior similaridade",
+            "/search/batch": "POST - Busca várias imagens (arquivos, zip ou tar) com resposta NDJSON",
             "/database/info": "GET - Informações do banco",
-            "/database/rebuild": "POST - Reconstrói cache do banco",
+            "/database/rebuild": "POST - Reconstrói cache do banco (tarefa em segundo plano)",
+            "/database/sync": "POST - Sincronização incremental pelo manifesto (só arquivos novos/alterados)",
+            "/database/images": "POST - Adiciona/substitui uma imagem sem reconstrução (delta)",
+            "/database/images/{path}": "DELETE - Remove uma imagem sem reconstrução (tombstone)",
             "/performance/config": "GET - Visualiza configurações de performance",
             "/performance/config": "POST - Atualiza configurações de performance",
-            "/annoy/rebuild": "POST - Reconstrói índice Annoy"
+            "/annoy/rebuild": "POST - Reconstrói índice Annoy",
+            "/bow/rebuild": "POST - Reconstrói vocabulário visual (BoVW)",
+            "/mih/rebuild": "POST - Reconstrói tabelas do multi-index hashing (MIH)",
+            "/lsh/rebuild": "POST - Reconstrói o índice LSH do zero",
+            "/graph/rebuild": "POST - Reconstrói o grafo navegável do zero",
+            "/index/generations": "GET - Gerações dos índices em disco (manifesto com checksums)",
+            "/index/rollback": "POST - Volta para a geração anterior dos índices",
+            "/jobs": "GET - Tarefas em segundo plano recentes",
+            "/jobs/{job_id}": "GET - Estado e resultado de uma tarefa (reconstruções respondem 202 com o id)"
         }
     }
 
@@ -732,47 +4553,183 @@ async def database_info():
     return {
         "total_images": len(matcher.database_features),
         "total_features": total_features,
+        "delta_images": len(matcher.delta_index.path_to_image),
+        "tombstones": len(matcher.tombstones),
+        "index_generation": os.path.basename(matcher.index_dir) or None,
         "database_path": matcher.database_path,
         "images": list(matcher.database_metadata.keys())
     }
 
-@app.post("/database/rebuild")
+@app.post("/database/rebuild", status_code=202)
 async def rebuild_database():
-    """Reconstrói o cache do banco de imagens"""
-    try:
-        matcher.process_database_images()
+    """Agenda a reconstrução completa do banco numa nova geração (troca atômica ao terminar)"""
+    def build(generation: ImageMatcher) -> Dict:
+        generation.process_database_images()
         return {
-            "message": "Banco reconstruído com sucesso",
-            "total_images": len(matcher.database_features),
-            "annoy_rebuilt": matcher.use_annoy and matcher.annoy_index is not None
+            "total_images": len(generation.database_features),
+            "annoy_rebuilt": generation.use_annoy and generation.annoy_index is not None,
+            "error_count": len(generation.ingest_errors),
+            "errors": generation.ingest_errors[:100]
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao reconstruir banco: {str(e)}")
+    return {"message": "Reconstrução do banco agendada", **start_rebuild_job("database_rebuild", build)}
+
+@app.post("/database/sync", status_code=202)
+async def sync_database():
+    """Agenda a sincronização pelo manifesto (só arquivos novos/alterados) numa nova geração"""
+    def build(generation: ImageMatcher) -> Dict:
+        return {**generation.sync_database_images(), "ingest_errors": generation.ingest_errors[:100]}
+    return {"message": "Sincronização do banco agendada", **start_rebuild_job("database_sync", build)}
+
+def schedule_delta_compaction(result: Dict) -> Dict:
+    """Agenda a compactação do delta quando as pendências atingem `delta_compact_threshold`"""
+    if result["delta_pending"] >= matcher.delta_compact_threshold:
+        job = start_rebuild_job("delta_compaction", lambda generation: generation.compact_delta())
+        result["compaction_job"] = job["job_id"]
+    return result
+
+@app.post("/database/images")
+async def add_database_image(file: UploadFile = File(...), path: str = None):
+    """Adiciona (ou substitui) uma imagem no banco sem reconstrução (delta buscado junto com o Annoy)"""
+    contents = await file.read()
+    try:
+        result = await run_search_task(matcher.add_database_image, path or file.filename, contents)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "5"})
+    return {"message": "Imagem adicionada ao banco", **schedule_delta_compaction(result)}
 
-@app.post("/annoy/rebuild")
+@app.delete("/database/images/{path:path}")
+async def remove_database_image(path: str):
+    """Remove uma imagem do banco sem reconstrução (tombstone filtrado nas buscas até a compactação)"""
+    try:
+        result = await run_search_task(matcher.remove_database_image, path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Imagem não encontrada no banco: {path}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "5"})
+    return {"message": "Imagem removida do banco", **schedule_delta_compaction(result)}
+
+@app.post("/annoy/rebuild", status_code=202)
 async def rebuild_annoy_index():
-    """Reconstrói apenas o índice Annoy"""
+    """Agenda a reconstrução do índice Annoy numa nova geração"""
     if not matcher.use_annoy:
         raise HTTPException(status_code=400, detail="Annoy está desabilitado")
     
     if len(matcher.database_features) == 0:
         raise HTTPException(status_code=400, detail="Nenhuma feature no banco. Execute /database/rebuild primeiro")
     
-    try:
-        matcher.build_annoy_index()
-        matcher.save_annoy_index()
-        
+    def build(generation: ImageMatcher) -> Dict:
+        generation.build_annoy_index()
+        generation.save_annoy_index()
         return {
-            "message": "Índice Annoy reconstruído com sucesso",
-            "total_descriptors": len(matcher.annoy_id_to_image),
-            "n_trees": matcher.annoy_n_trees
+            "total_descriptors": len(generation.annoy_id_to_image),
+            "n_trees": generation.annoy_n_trees
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao reconstruir índice Annoy: {str(e)}")
+    return {"message": "Reconstrução do índice Annoy agendada", **start_rebuild_job("annoy_rebuild", build)}
+
+@app.post("/bow/rebuild", status_code=202)
+async def rebuild_bow_index():
+    """Agenda o retreino do vocabulário visual e do arquivo invertido numa nova geração"""
+    if len(matcher.database_features) == 0:
+        raise HTTPException(status_code=400, detail="Nenhuma feature no banco. Execute /database/rebuild primeiro")
+    
+    def build(generation: ImageMatcher) -> Dict:
+        generation.build_bow_index()
+        generation.save_bow_index()
+        return {
+            "n_words": generation.bow_index.n_words,
+            "total_postings": len(generation.bow_index.postings_image)
+        }
+    return {"message": "Reconstrução do índice BoVW agendada", **start_rebuild_job("bow_rebuild", build)}
+
+@app.post("/mih/rebuild", status_code=202)
+async def rebuild_mih_index():
+    """Agenda a reconstrução das tabelas do multi-index hashing numa nova geração"""
+    if len(matcher.database_features) == 0:
+        raise HTTPException(status_code=400, detail="Nenhuma feature no banco. Execute /database/rebuild primeiro")
+    
+    def build(generation: ImageMatcher) -> Dict:
+        generation.build_mih_index()
+        generation.save_mih_index()
+        return {
+            "n_substrings": generation.mih_index.n_substrings,
+            "total_descriptors": generation.mih_index.n_descriptors
+        }
+    return {"message": "Reconstrução do índice MIH agendada", **start_rebuild_job("mih_rebuild", build)}
+
+@app.post("/lsh/rebuild", status_code=202)
+async def rebuild_lsh_index():
+    """Agenda a reconstrução do LSH do zero (normalmente ele é apenas sincronizado)"""
+    if len(matcher.database_features) == 0:
+        raise HTTPException(status_code=400, detail="Nenhuma feature no banco. Execute /database/rebuild primeiro")
+    
+    def build(generation: ImageMatcher) -> Dict:
+        generation.build_lsh_index()
+        generation.save_lsh_index()
+        return {
+            "total_images": len(generation.lsh_index.path_to_image),
+            "total_descriptors": generation.lsh_index.n_live_rows
+        }
+    return {"message": "Reconstrução do índice LSH agendada", **start_rebuild_job("lsh_rebuild", build)}
+
+@app.post("/graph/rebuild", status_code=202)
+async def rebuild_graph_index():
+    """Agenda a reconstrução do grafo do zero (normalmente ele é apenas sincronizado)"""
+    if len(matcher.database_features) == 0:
+        raise HTTPException(status_code=400, detail="Nenhuma feature no banco. Execute /database/rebuild primeiro")
+    
+    def build(generation: ImageMatcher) -> Dict:
+        generation.build_graph_index()
+        generation.save_graph_index()
+        return {
+            "total_images": len(generation.graph_index.path_to_image),
+            "total_descriptors": len(generation.graph_index.descriptors),
+            "build_seconds": round(generation.graph_stats["build_seconds"], 2)
+        }
+    return {"message": "Reconstrução do grafo agendada", **start_rebuild_job("graph_rebuild", build)}
+
+@app.get("/index/generations")
+async def list_index_generations():
+    """Gerações dos índices em disco (a ativa marcada)"""
+    return {
+        "active": os.path.basename(matcher.index_dir) or None,
+        "generations": matcher.index_generations.list(matcher.index_dir)
+    }
+
+@app.post("/index/rollback")
+async def rollback_index_generation():
+    """Volta para a geração anterior dos índices (troca atômica, sem reconstrução)"""
+    try:
+        summary = await run_search_task(run_index_rollback)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "5"})
+    return {"message": "Geração anterior ativada", **summary}
+
+@app.get("/jobs")
+async def list_jobs():
+    """Tarefas em segundo plano mais recentes"""
+    return {"jobs": jobs.list()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Estado de uma tarefa em segundo plano (queued, running, succeeded ou failed) e seu resultado"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Tarefa não encontrada: {job_id}")
+    return job
 
 @app.get("/performance/config")
 async def get_performance_config():
     """Retorna configurações atuais de performance"""
+    with matcher.graph_stats_lock:
+        graph_stats = dict(matcher.graph_stats)
+    with matcher.phash_stats_lock:
+        phash_stats = dict(matcher.phash_stats)
     return {
         "early_stop_threshold": matcher.early_stop_threshold,
         "min_threshold": matcher.min_threshold,
@@ -780,10 +4737,107 @@ async def get_performance_config():
         "use_parallel_search": matcher.use_parallel_search,
         "batch_size": matcher.batch_size,
         "database_size": len(matcher.database_features),
+        "search_backend": matcher.search_backend,
+        "search_executor": matcher.search_executor.stats(),
+        "delta_index": {
+            "images": len(matcher.delta_index.path_to_image),
+            "live_descriptors": len(matcher.delta_index.live_rows),
+            "tombstones": len(matcher.tombstones),
+            "compact_threshold": matcher.delta_compact_threshold,
+            "compacting": jobs.active("delta_compaction") is not None
+        },
+        "index_generations": {
+            "root": matcher.index_generations.root,
+            "active": os.path.basename(matcher.index_dir) or None,
+            "keep": matcher.index_generations.keep,
+            "verify_checksums": matcher.index_generations.verify_checksums,
+            "available": matcher.index_generations.names()
+        },
+        "process_pool": {
+            "use_process_pool": matcher.use_process_pool,
+            "search_processes": matcher.search_processes,
+            "pool_started": matcher._process_pool is not None,
+            "pool_index_version": matcher._process_pool_index_version
+        },
+        "micro_batching": {
+            "use_micro_batching": matcher.use_micro_batching,
+            **matcher.micro_batcher.stats()
+        },
+        "result_cache": {
+            "use_result_cache": matcher.use_result_cache,
+            **matcher.result_cache.stats()
+        },
+        "query_phash_cache": {
+            "use_query_phash_cache": matcher.use_query_phash_cache,
+            "query_cache_max_radius": matcher.query_cache_max_radius,
+            "query_cache_verify_rate": matcher.query_cache_verify_rate,
+            **matcher.query_cache.stats()
+        },
+        "phash_config": {
+            "use_phash_fast_path": matcher.use_phash_fast_path,
+            "max_radius": matcher.phash_max_radius,
+            "verify_threshold": matcher.phash_verify_threshold,
+            "index_loaded": matcher.phash_index is not None,
+            "total_images": len(matcher.phash_codes),
+            **phash_stats
+        },
+        "signature_config": {
+            "use_signature_prefilter": matcher.use_signature_prefilter,
+            "n_words": matcher.signature_branching ** matcher.signature_depth,
+            "shortlist": matcher.signature_shortlist,
+            "index_loaded": matcher.signature_index is not None,
+            "total_images": matcher.signature_index.n_images if matcher.signature_index else 0
+        },
+        "exact_config": {
+            "neighbors": matcher.exact_neighbors,
+            "chunk_rows": matcher.exact_chunk_rows
+        },
+        "bow_config": {
+            "branching": matcher.bow_branching,
+            "depth": matcher.bow_depth,
+            "n_words": matcher.bow_branching ** matcher.bow_depth,
+            "max_df_ratio": matcher.bow_max_df_ratio,
+            "index_loaded": matcher.bow_index is not None,
+            "total_postings": len(matcher.bow_index.postings_image) if matcher.bow_index else 0
+        },
+        "mih_config": {
+            "n_substrings": matcher.mih_substrings,
+            "neighbors": matcher.mih_neighbors,
+            "max_radius": matcher.mih_max_radius,
+            "index_loaded": matcher.mih_index is not None
+        },
+        "lsh_config": {
+            "n_tables": matcher.lsh_tables,
+            "n_bits": matcher.lsh_bits,
+            "probe_radius": matcher.lsh_probe_radius,
+            "neighbors": matcher.lsh_neighbors,
+            "index_loaded": matcher.lsh_index is not None,
+            "total_images": len(matcher.lsh_index.path_to_image) if matcher.lsh_index else 0,
+            "live_descriptors": matcher.lsh_index.n_live_rows if matcher.lsh_index else 0,
+            "dead_descriptors": matcher.lsh_index.n_dead_rows if matcher.lsh_index else 0
+        },
+        "graph_config": {
+            "max_degree": matcher.graph_max_degree,
+            "ef_construction": matcher.graph_ef_construction,
+            "ef_search": matcher.graph_ef_search,
+            "expand_width": matcher.graph_expand_width,
+            "neighbors": matcher.graph_neighbors,
+            "index_loaded": matcher.graph_index is not None,
+            "total_images": len(matcher.graph_index.path_to_image) if matcher.graph_index else 0,
+            "total_nodes": len(matcher.graph_index.descriptors) if matcher.graph_index else 0,
+            "dead_nodes": matcher.graph_index.n_dead_rows if matcher.graph_index else 0,
+            "build_seconds": round(graph_stats["build_seconds"], 2),
+            "queries": graph_stats["queries"],
+            "avg_query_ms": round(graph_stats["query_seconds"] / max(graph_stats["queries"], 1) * 1000, 2),
+            "avg_expansions_per_descriptor": round(graph_stats["expansions"] / max(graph_stats["descriptors"], 1), 1)
+        },
         "annoy_config": {
             "use_annoy": matcher.use_annoy,
             "n_trees": matcher.annoy_n_trees,
             "search_k": matcher.annoy_search_k,
+            "neighbors": matcher.annoy_neighbors,
+            "query_workers": matcher.query_workers,
+            "metric": matcher.annoy_metric,
             "index_loaded": matcher.annoy_index is not None,
             "total_descriptors": len(matcher.annoy_id_to_image) if matcher.annoy_index else 0
         }
@@ -797,10 +4851,46 @@ async def update_performance_config(
     use_parallel_search: bool = None,
     batch_size: int = None,
     use_annoy: bool = None,
-    annoy_search_k: int = None
+    annoy_search_k: int = None,
+    annoy_neighbors: int = None,
+    query_workers: int = None,
+    search_workers: int = None,
+    search_queue_size: int = None,
+    use_process_pool: bool = None,
+    search_processes: int = None,
+    use_micro_batching: bool = None,
+    batch_window_ms: float = None,
+    batch_max_size: int = None,
+    delta_compact_threshold: int = None,
+    index_generations_keep: int = None,
+    search_backend: str = None,
+    use_result_cache: bool = None,
+    result_cache_mb: int = None,
+    use_query_phash_cache: bool = None,
+    query_cache_max_radius: int = None,
+    query_cache_mb: int = None,
+    query_cache_verify_rate: float = None,
+    use_phash_fast_path: bool = None,
+    phash_max_radius: int = None,
+    phash_verify_threshold: float = None,
+    use_signature_prefilter: bool = None,
+    signature_shortlist: int = None,
+    exact_neighbors: int = None,
+    bow_max_df_ratio: float = None,
+    mih_neighbors: int = None,
+    mih_max_radius: int = None,
+    lsh_probe_radius: int = None,
+    lsh_neighbors: int = None,
+    graph_ef_search: int = None,
+    graph_neighbors: int = None
 ):
-    """Atualiza configurações de performance em tempo real"""
+    """Atualiza configurações de performance em tempo real.
+    
+    Índices que faltam para a configuração pedida são preparados em tarefas em
+    segundo plano (`jobs` na resposta), nunca dentro da requisição.
+    """
     updated = {}
+    scheduled_jobs = {}
     
     if early_stop_threshold is not None:
         if 0.1 <= early_stop_threshold <= 1.0:
@@ -839,15 +4929,235 @@ async def update_performance_config(
         updated["use_annoy"] = use_annoy
     
     if annoy_search_k is not None:
-        if 10 <= annoy_search_k <= 1000:
+        if 10 <= annoy_search_k <= 100000:
             matcher.annoy_search_k = annoy_search_k
             updated["annoy_search_k"] = annoy_search_k
         else:
-            raise HTTPException(status_code=400, detail="annoy_search_k deve estar entre 10 e 1000")
+            raise HTTPException(status_code=400, detail="annoy_search_k deve estar entre 10 e 100000")
+    
+    if annoy_neighbors is not None:
+        if 1 <= annoy_neighbors <= 1000:
+            matcher.annoy_neighbors = annoy_neighbors
+            updated["annoy_neighbors"] = annoy_neighbors
+        else:
+            raise HTTPException(status_code=400, detail="annoy_neighbors deve estar entre 1 e 1000")
+    
+    if query_workers is not None:
+        if 1 <= query_workers <= 64:
+            matcher.query_workers = query_workers
+            updated["query_workers"] = query_workers
+        else:
+            raise HTTPException(status_code=400, detail="query_workers deve estar entre 1 e 64")
+    
+    if search_workers is not None:
+        if 1 <= search_workers <= 64:
+            matcher.search_workers = search_workers
+            updated["search_workers"] = search_workers
+        else:
+            raise HTTPException(status_code=400, detail="search_workers deve estar entre 1 e 64")
+    
+    if search_queue_size is not None:
+        if 0 <= search_queue_size <= 1024:
+            matcher.search_queue_size = search_queue_size
+            updated["search_queue_size"] = search_queue_size
+        else:
+            raise HTTPException(status_code=400, detail="search_queue_size deve estar entre 0 e 1024")
+    
+    if search_workers is not None or search_queue_size is not None:
+        matcher.search_executor.resize(matcher.search_workers, matcher.search_queue_size)
+    
+    if use_process_pool is not None:
+        matcher.use_process_pool = use_process_pool
+        updated["use_process_pool"] = use_process_pool
+    
+    if search_processes is not None:
+        if 1 <= search_processes <= 256:
+            matcher.search_processes = search_processes
+            updated["search_processes"] = search_processes
+        else:
+            raise HTTPException(status_code=400, detail="search_processes deve estar entre 1 e 256")
+    
+    if use_micro_batching is not None:
+        matcher.use_micro_batching = use_micro_batching
+        updated["use_micro_batching"] = use_micro_batching
+    
+    if batch_window_ms is not None:
+        if 0.0 <= batch_window_ms <= 100.0:
+            matcher.batch_window_ms = batch_window_ms
+            matcher.micro_batcher.window_ms = batch_window_ms
+            updated["batch_window_ms"] = batch_window_ms
+        else:
+            raise HTTPException(status_code=400, detail="batch_window_ms deve estar entre 0 e 100")
+    
+    if batch_max_size is not None:
+        if 1 <= batch_max_size <= 256:
+            matcher.batch_max_size = batch_max_size
+            matcher.micro_batcher.max_size = batch_max_size
+            updated["batch_max_size"] = batch_max_size
+        else:
+            raise HTTPException(status_code=400, detail="batch_max_size deve estar entre 1 e 256")
+    
+    if delta_compact_threshold is not None:
+        if delta_compact_threshold >= 1:
+            matcher.delta_compact_threshold = delta_compact_threshold
+            updated["delta_compact_threshold"] = delta_compact_threshold
+        else:
+            raise HTTPException(status_code=400, detail="delta_compact_threshold deve ser pelo menos 1")
+    
+    if index_generations_keep is not None:
+        if 1 <= index_generations_keep <= 100:
+            matcher.index_generations.keep = index_generations_keep
+            updated["index_generations_keep"] = index_generations_keep
+        else:
+            raise HTTPException(status_code=400, detail="index_generations_keep deve estar entre 1 e 100")
+    
+    if search_backend is not None:
+        if search_backend in ('annoy', 'exact', 'bow', 'mih', 'lsh', 'graph'):
+            matcher.search_backend = search_backend
+            updated["search_backend"] = search_backend
+            # Índice ausente: carregado/construído numa nova geração em segundo plano (até a troca, as buscas usam o Annoy)
+            if search_backend in ('bow', 'mih', 'lsh', 'graph') and getattr(matcher, f"{search_backend}_index") is None:
+                scheduled_jobs[f"{search_backend}_prepare"] = start_rebuild_job(
+                    f"{search_backend}_prepare", getattr(ImageMatcher, f"prepare_{search_backend}_index")
+                )
+        else:
+            raise HTTPException(status_code=400, detail="search_backend deve ser 'annoy', 'exact', 'bow', 'mih', 'lsh' ou 'graph'")
+    
+    if use_result_cache is not None:
+        matcher.use_result_cache = use_result_cache
+        updated["use_result_cache"] = use_result_cache
+    
+    if result_cache_mb is not None:
+        if 1 <= result_cache_mb <= 4096:
+            matcher.result_cache_mb = result_cache_mb
+            matcher.result_cache.resize(result_cache_mb * 1024 * 1024)
+            updated["result_cache_mb"] = result_cache_mb
+        else:
+            raise HTTPException(status_code=400, detail="result_cache_mb deve estar entre 1 e 4096")
+    
+    if use_query_phash_cache is not None:
+        matcher.use_query_phash_cache = use_query_phash_cache
+        updated["use_query_phash_cache"] = use_query_phash_cache
+    
+    if query_cache_max_radius is not None:
+        if 0 <= query_cache_max_radius <= 32:
+            matcher.query_cache_max_radius = query_cache_max_radius
+            updated["query_cache_max_radius"] = query_cache_max_radius
+        else:
+            raise HTTPException(status_code=400, detail="query_cache_max_radius deve estar entre 0 e 32")
+    
+    if query_cache_mb is not None:
+        if 1 <= query_cache_mb <= 4096:
+            matcher.query_cache_mb = query_cache_mb
+            matcher.query_cache.resize(query_cache_mb * 1024 * 1024)
+            updated["query_cache_mb"] = query_cache_mb
+        else:
+            raise HTTPException(status_code=400, detail="query_cache_mb deve estar entre 1 e 4096")
+    
+    if query_cache_verify_rate is not None:
+        if 0.0 <= query_cache_verify_rate <= 1.0:
+            matcher.query_cache_verify_rate = query_cache_verify_rate
+            updated["query_cache_verify_rate"] = query_cache_verify_rate
+        else:
+            raise HTTPException(status_code=400, detail="query_cache_verify_rate deve estar entre 0.0 e 1.0")
+    
+    if use_phash_fast_path is not None:
+        # Índice ausente: construído numa nova geração em segundo plano (até a troca, o atalho fica inativo)
+        if use_phash_fast_path and matcher.phash_index is None:
+            scheduled_jobs["phash_prepare"] = start_rebuild_job("phash_prepare", ImageMatcher.build_phash_index)
+        matcher.use_phash_fast_path = use_phash_fast_path
+        updated["use_phash_fast_path"] = use_phash_fast_path
+    
+    if phash_max_radius is not None:
+        if 0 <= phash_max_radius <= 32:
+            matcher.phash_max_radius = phash_max_radius
+            updated["phash_max_radius"] = phash_max_radius
+        else:
+            raise HTTPException(status_code=400, detail="phash_max_radius deve estar entre 0 e 32")
+    
+    if phash_verify_threshold is not None:
+        if 0.0 <= phash_verify_threshold <= 1.0:
+            matcher.phash_verify_threshold = phash_verify_threshold
+            updated["phash_verify_threshold"] = phash_verify_threshold
+        else:
+            raise HTTPException(status_code=400, detail="phash_verify_threshold deve estar entre 0.0 e 1.0")
+    
+    if use_signature_prefilter is not None:
+        matcher.use_signature_prefilter = use_signature_prefilter
+        updated["use_signature_prefilter"] = use_signature_prefilter
+        # Sem assinaturas a fase 0 fica desligada até a tarefa em segundo plano terminar
+        if use_signature_prefilter and matcher.signature_index is None:
+            scheduled_jobs["signature_prepare"] = start_rebuild_job(
+                "signature_prepare", ImageMatcher.prepare_signature_index
+            )
+    
+    if signature_shortlist is not None:
+        if 10 <= signature_shortlist <= 1000000:
+            matcher.signature_shortlist = signature_shortlist
+            updated["signature_shortlist"] = signature_shortlist
+        else:
+            raise HTTPException(status_code=400, detail="signature_shortlist deve estar entre 10 e 1000000")
+    
+    if exact_neighbors is not None:
+        if 1 <= exact_neighbors <= 1000:
+            matcher.exact_neighbors = exact_neighbors
+            updated["exact_neighbors"] = exact_neighbors
+        else:
+            raise HTTPException(status_code=400, detail="exact_neighbors deve estar entre 1 e 1000")
+    
+    if bow_max_df_ratio is not None:
+        if 0.01 <= bow_max_df_ratio <= 1.0:
+            matcher.bow_max_df_ratio = bow_max_df_ratio
+            updated["bow_max_df_ratio"] = bow_max_df_ratio
+        else:
+            raise HTTPException(status_code=400, detail="bow_max_df_ratio deve estar entre 0.01 e 1.0")
+    
+    if mih_neighbors is not None:
+        if 1 <= mih_neighbors <= 1000:
+            matcher.mih_neighbors = mih_neighbors
+            updated["mih_neighbors"] = mih_neighbors
+        else:
+            raise HTTPException(status_code=400, detail="mih_neighbors deve estar entre 1 e 1000")
+    
+    if mih_max_radius is not None:
+        if 0 <= mih_max_radius <= 255:
+            matcher.mih_max_radius = mih_max_radius
+            updated["mih_max_radius"] = mih_max_radius
+        else:
+            raise HTTPException(status_code=400, detail="mih_max_radius deve estar entre 0 e 255")
+    
+    if lsh_probe_radius is not None:
+        if 0 <= lsh_probe_radius <= 3:
+            matcher.lsh_probe_radius = lsh_probe_radius
+            updated["lsh_probe_radius"] = lsh_probe_radius
+        else:
+            raise HTTPException(status_code=400, detail="lsh_probe_radius deve estar entre 0 e 3")
+    
+    if lsh_neighbors is not None:
+        if 1 <= lsh_neighbors <= 1000:
+            matcher.lsh_neighbors = lsh_neighbors
+            updated["lsh_neighbors"] = lsh_neighbors
+        else:
+            raise HTTPException(status_code=400, detail="lsh_neighbors deve estar entre 1 e 1000")
+    
+    if graph_ef_search is not None:
+        if 1 <= graph_ef_search <= 1000:
+            matcher.graph_ef_search = graph_ef_search
+            updated["graph_ef_search"] = graph_ef_search
+        else:
+            raise HTTPException(status_code=400, detail="graph_ef_search deve estar entre 1 e 1000")
+    
+    if graph_neighbors is not None:
+        if 1 <= graph_neighbors <= 1000:
+            matcher.graph_neighbors = graph_neighbors
+            updated["graph_neighbors"] = graph_neighbors
+        else:
+            raise HTTPException(status_code=400, detail="graph_neighbors deve estar entre 1 e 1000")
     
     return {
         "message": "Configurações atualizadas com sucesso",
         "updated": updated,
+        "jobs": scheduled_jobs,
         "current_config": {
             "early_stop_threshold": matcher.early_stop_threshold,
             "min_threshold": matcher.min_threshold,
@@ -855,10 +5165,108 @@ async def update_performance_config(
             "use_parallel_search": matcher.use_parallel_search,
             "batch_size": matcher.batch_size,
             "use_annoy": matcher.use_annoy,
-            "annoy_search_k": matcher.annoy_search_k
+            "annoy_search_k": matcher.annoy_search_k,
+            "annoy_neighbors": matcher.annoy_neighbors,
+            "query_workers": matcher.query_workers,
+            "search_workers": matcher.search_workers,
+            "search_queue_size": matcher.search_queue_size,
+            "use_process_pool": matcher.use_process_pool,
+            "search_processes": matcher.search_processes,
+            "use_micro_batching": matcher.use_micro_batching,
+            "batch_window_ms": matcher.batch_window_ms,
+            "batch_max_size": matcher.batch_max_size,
+            "delta_compact_threshold": matcher.delta_compact_threshold,
+            "index_generations_keep": matcher.index_generations.keep,
+            "search_backend": matcher.search_backend,
+            "use_result_cache": matcher.use_result_cache,
+            "result_cache_mb": matcher.result_cache_mb,
+            "use_query_phash_cache": matcher.use_query_phash_cache,
+            "query_cache_max_radius": matcher.query_cache_max_radius,
+            "query_cache_mb": matcher.query_cache_mb,
+            "query_cache_verify_rate": matcher.query_cache_verify_rate,
+            "use_phash_fast_path": matcher.use_phash_fast_path,
+            "phash_max_radius": matcher.phash_max_radius,
+            "phash_verify_threshold": matcher.phash_verify_threshold,
+            "use_signature_prefilter": matcher.use_signature_prefilter,
+            "signature_shortlist": matcher.signature_shortlist,
+            "exact_neighbors": matcher.exact_neighbors,
+            "bow_max_df_ratio": matcher.bow_max_df_ratio,
+            "mih_neighbors": matcher.mih_neighbors,
+            "mih_max_radius": matcher.mih_max_radius,
+            "lsh_probe_radius": matcher.lsh_probe_radius,
+            "lsh_neighbors": matcher.lsh_neighbors,
+            "graph_ef_search": matcher.graph_ef_search,
+            "graph_neighbors": matcher.graph_neighbors
         }
     }
 
+def search_uploaded_image(contents: bytes, top_k: int) -> Tuple[List[Dict], tuple, Optional[str]]:
+    """Busca a partir dos bytes enviados passando pelos dois níveis do cache de resultados.
+    
+    Retorna (resultados, shape da imagem, nível do cache que respondeu ou None).
+    1º nível ('exact'): SHA-256 do upload + top_k + configuração de busca ativa.
+    2º nível ('phash'): pHash da imagem decodificada dentro de `query_cache_max_radius`
+    bits, mesmo top_k e mesma configuração (reenvios recomprimidos/redimensionados).
+    """
+    config_key = matcher.search_config_key()
+    key = (hashlib.sha256(contents).hexdigest(), top_k, config_key)
+    generation = matcher.result_cache.generation
+    query_generation = matcher.query_cache.generation
+    if matcher.use_result_cache:
+        cached = matcher.result_cache.get(key)
+        if cached is not None:
+            logger.info(f"💾 Resultado em cache para o upload {key[0][:12]} (top_k={top_k})")
+            return cached[0], cached[1], 'exact'
+    
+    # Converte para array numpy
+    nparr = np.frombuffer(contents, np.uint8)
+    query_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    
+    if query_image is None:
+        raise HTTPException(status_code=400, detail="Não foi possível decodificar a imagem")
+    
+    query_phash = None
+    use_query_cache = matcher.use_result_cache and matcher.use_query_phash_cache
+    if use_query_cache:
+        query_phash = int(perceptual_hash(query_image))
+        scope = (top_k, config_key)
+        near = matcher.query_cache.get_near(scope, query_phash, matcher.query_cache_max_radius)
+        if near is not None:
+            cached_results, distance = near
+            if matcher._query_cache_rng.random() >= matcher.query_cache_verify_rate:
+                logger.info(f"💾 Resultado em cache para pHash a {distance} bits (top_k={top_k})")
+                matcher.result_cache.put(key, (cached_results, query_image.shape), generation)
+                return cached_results, query_image.shape, 'phash'
+            
+            # Amostra de verificação: compara o melhor resultado do cache com o da busca completa
+            results = matcher.search_similar_images(query_image, top_k, query_phash)
+            cached_best = cached_results[0]['image_path'] if cached_results else None
+            best = results[0]['image_path'] if results else None
+            matcher.query_cache.record_verification(cached_best == best)
+            if cached_best != best:
+                logger.warning(f"⚠️  Cache por pHash divergiu a {distance} bits: {cached_best} x {best}")
+            matcher.result_cache.put(key, (results, query_image.shape), generation)
+            return results, query_image.shape, None
+    
+    results = matcher.search_similar_images(query_image, top_k, query_phash)
+    if matcher.use_result_cache:
+        matcher.result_cache.put(key, (results, query_image.shape), generation)
+        if use_query_cache:
+            matcher.query_cache.put((scope, query_phash), results, query_generation)
+    return results, query_image.shape, None
+
+async def run_search_task(fn, *args):
+    """Executa `fn` no executor limitado das buscas sem bloquear o event loop"""
+    future = matcher.search_executor.submit(fn, *args)
+    if future is None:
+        logger.warning(f"🚦 Fila de busca cheia ({matcher.search_executor.max_queue} esperando), requisição recusada")
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado: fila de busca cheia, tente novamente",
+            headers={"Retry-After": "1"}
+        )
+    return await asyncio.wrap_future(future)
+
 @app.post("/search")
 async def search_similar_images(
     file: UploadFile = File(...),
@@ -872,29 +5280,132 @@ async def search_similar_images(
         # Lê a imagem enviada
         contents = await file.read()
         
-        # Converte para array numpy
-        nparr = np.frombuffer(contents, np.uint8)
-        query_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if query_image is None:
-            raise HTTPException(status_code=400, detail="Não foi possível decodificar a imagem")
-        
-        # Busca imagens similares
-        results = matcher.search_similar_images(query_image, top_k)
+        # Busca imagens similares (uploads idênticos ou quase idênticos saem do cache)
+        results, image_shape, cache_tier = await run_search_task(search_uploaded_image, contents, top_k)
         
         return {
             "query_info": {
                 "filename": file.filename,
-                "image_shape": query_image.shape
+                "image_shape": image_shape,
+                "cache_hit": cache_tier is not None,
+                "cache_tier": cache_tier
             },
             "results": results,
             "total_found": len(results)
         }
         
+    except HTTPException:
+        # Re-raise HTTP exceptions (400 de decodificação, 503 de fila cheia)
+        raise
     except Exception as e:
         logger.error(f"Erro na busca: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+def iter_batch_uploads(files: List[UploadFile]) -> Iterator[Tuple[str, Optional[bytes], Optional[str]]]:
+    """Expande os arquivos de /search/batch em (nome, bytes, erro): imagens soltas e membros de zip/tar.
+    
+    Os compactados são lidos membro a membro do arquivo temporário do upload,
+    sem carregar o lote inteiro na memória.
+    """
+    for upload in files:
+        name = upload.filename or "upload"
+        lower_name = name.lower()
+        content_type = upload.content_type or ""
+        try:
+            upload.file.seek(0)
+            if lower_name.endswith('.zip') or content_type in ('application/zip', 'application/x-zip-compressed'):
+                with zipfile.ZipFile(upload.file) as archive:
+                    for member in archive.infolist():
+                        if (not member.is_dir() and not member.filename.startswith('__MACOSX/')
+                                and member.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)):
+                            yield f"{name}/{member.filename}", archive.read(member), None
+            elif (lower_name.endswith(('.tar', '.tar.gz', '.tgz'))
+                    or content_type in ('application/x-tar', 'application/gzip', 'application/x-gzip')):
+                with tarfile.open(fileobj=upload.file, mode='r:*') as archive:
+                    for member in archive:
+                        if member.isfile() and member.name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                            yield f"{name}/{member.name}", archive.extractfile(member).read(), None
+            elif content_type.startswith('image/'):
+                yield name, upload.file.read(), None
+            else:
+                yield name, None, "Arquivo deve ser uma imagem, zip ou tar"
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError, zlib.error) as e:
+            # Compactado truncado ou corrompido no meio: os membros já lidos valem, o resto vira erro
+            yield name, None, f"Arquivo compactado inválido: {e}"
+
+async def search_batch_item(index: int, name: str, contents: bytes, top_k: int) -> Dict:
+    """Uma consulta do lote no executor das buscas; com a fila cheia, espera a vez em vez de falhar"""
+    start_time = time.perf_counter()
+    try:
+        future = matcher.search_executor.submit(search_uploaded_image, contents, top_k)
+        while future is None:
+            await matcher.search_executor.slot_available()
+            future = matcher.search_executor.submit(search_uploaded_image, contents, top_k)
+        results, image_shape, cache_tier = await asyncio.wrap_future(future)
+        return {
+            "index": index,
+            "filename": name,
+            "image_shape": image_shape,
+            "cache_tier": cache_tier,
+            "results": results,
+            "total_found": len(results),
+            "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2)
+        }
+    except HTTPException as e:
+        return {"index": index, "filename": name, "error": e.detail}
+    except Exception as e:
+        logger.error(f"Erro na busca em lote ({name}): {e}")
+        return {"index": index, "filename": name, "error": f"Erro interno: {str(e)}"}
+
+@app.post("/search/batch")
+async def search_batch(
+    files: List[UploadFile] = File(...),
+    top_k: int = 5
+):
+    """Busca várias imagens em uma requisição (arquivos soltos, zip ou tar).
+    
+    Responde em NDJSON, uma linha por consulta assim que ela termina (fora de
+    ordem; `index` dá a posição no lote). Até `search_workers` consultas ficam em
+    andamento ao mesmo tempo: a leitura do próximo arquivo, a decodificação/ORB e
+    a busca das anteriores se sobrepõem.
+    """
+    async def stream_results():
+        items = iter_batch_uploads(files)
+        pending = set()
+        index = 0
+        exhausted = False
+        batch_start = time.perf_counter()
+        
+        try:
+            while True:
+                while not exhausted and len(pending) < max(1, matcher.search_workers):
+                    item = await asyncio.to_thread(next, items, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    name, contents, error = item
+                    if error is not None:
+                        yield json.dumps({"index": index, "filename": name, "error": error}) + "\n"
+                    else:
+                        pending.add(asyncio.ensure_future(search_batch_item(index, name, contents, top_k)))
+                    index += 1
+                
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield json.dumps(task.result(), default=str) + "\n"
+        finally:
+            # Stream encerrado antes do fim (cliente desconectou): consultas ainda na fila não rodam à toa
+            for task in pending:
+                task.cancel()
+        
+        logger.info(f"📦 Lote de {index} consultas concluído em {time.perf_counter() - batch_start:.2f}s")
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @app.post("/searchtest")
 async def search_test_best_match(file: UploadFile = File(...)):
     """Busca e retorna apenas a imagem com maior similaridade"""
@@ -905,15 +5416,8 @@ async def search_test_best_match(file: UploadFile = File(...)):
         # Lê a imagem enviada
         contents = await file.read()
         
-        # Converte para array numpy
-        nparr = np.frombuffer(contents, np.uint8)
-        query_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if query_image is None:
-            raise HTTPException(status_code=400, detail="Não foi possível decodificar a imagem")
-        
         # Busca imagens similares (apenas 1 resultado)
-        results = matcher.search_similar_images(query_image, top_k=1)
+        results, _, cache_tier = await run_search_task(search_uploaded_image, contents, 1)
         
         if not results:
             raise HTTPException(status_code=404, detail="Nenhuma imagem similar encontrada")
@@ -937,7 +5441,8 @@ async def search_test_best_match(file: UploadFile = File(...)):
             headers={
                 "X-Similarity-Score": str(best_match['similarity_score']),
                 "X-Image-Path": image_relative_path,
-                "X-Features-Count": str(best_match['metadata'].get('features_count', 0))
+                "X-Features-Count": str(best_match['metadata'].get('features_count', 0)),
+                "X-Cache": {"exact": "HIT", "phash": "HIT-PHASH"}.get(cache_tier, "MISS")
             }
         )
         
@@ -3,8 +3,10 @@
 Script de teste para a API de reconhecimento de imagens Disney Pin
 """
 
+import json
 import requests
 import sys
+import time
 import os
 from pathlib import Path
 
@@ -117,13 +119,24 @@ def rebuild_database():
         print("\n🔄 Reconstruindo banco de dados...")
         response = requests.post(f"{API_URL}/database/rebuild")
         
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ {data['message']}")
-            print(f"📊 Total de imagens: {data['total_images']}")
+        if response.status_code != 202:
+            print(f"❌ Erro ao reconstruir banco: {response.status_code}")
+            return False
+        
+        # A reconstrução roda em segundo plano: acompanha a tarefa até terminar
+        status_url = response.json()['status_url']
+        while True:
+            job = requests.get(f"{API_URL}{status_url}").json()
+            if job['status'] in ('succeeded', 'failed'):
+                break
+            time.sleep(1)
+        
+        if job['status'] == 'succeeded':
+            print(f"✅ Banco reconstruído em {job['elapsed_seconds']:.1f}s")
+            print(f"📊 Total de imagens: {job['result']['total_images']}")
             return True
         else:
-            print(f"❌ Erro ao reconstruir banco: {response.status_code}")
+            print(f"❌ Erro ao reconstruir banco: {job['error']}")
             return False
     except Exception as e:
         print(f"❌ Erro ao reconstruir banco: {e}")
@@ -174,6 +187,56 @@ def search_best_match(image_path: str):
         print(f"❌ Erro ao buscar melhor match: {e}")
         return False
 
+def search_batch(paths, top_k: int = 5):
+    """Busca várias imagens (ou zip/tar) em uma única requisição, lendo a resposta NDJSON"""
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        print(f"❌ Arquivo não encontrado: {missing[0]}")
+        return False
+    
+    content_types = {'.zip': 'application/zip', '.tar': 'application/x-tar', '.tgz': 'application/gzip',
+                     '.gz': 'application/gzip', '.png': 'image/png'}
+    handles = [open(path, 'rb') for path in paths]
+    try:
+        print(f"\n📦 Enviando lote com {len(paths)} arquivo(s)...")
+        files = [
+            ('files', (os.path.basename(path), handle,
+                       content_types.get(Path(path).suffix.lower(), 'image/jpeg')))
+            for path, handle in zip(paths, handles)
+        ]
+        response = requests.post(f"{API_URL}/search/batch", files=files, params={'top_k': top_k}, stream=True)
+        
+        if response.status_code != 200:
+            print(f"❌ Erro na busca em lote: {response.status_code}")
+            return False
+        
+        # Uma linha por consulta, na ordem em que terminam
+        total = errors = 0
+        for line in response.iter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            total += 1
+            if 'error' in item:
+                errors += 1
+                print(f"   ❌ [{item['index']}] {item['filename']}: {item['error']}")
+            elif item['results']:
+                best = item['results'][0]
+                print(f"   ✅ [{item['index']}] {item['filename']} -> {best['image_path']} "
+                      f"({best['similarity_score']:.4f}, {item['elapsed_ms']:.0f} ms)")
+            else:
+                print(f"   🔴 [{item['index']}] {item['filename']}: nenhuma imagem similar")
+        
+        print(f"\n📊 {total} consultas, {errors} com erro")
+        return errors == 0
+        
+    except Exception as e:
+        print(f"❌ Erro na busca em lote: {e}")
+        return False
+    finally:
+        for handle in handles:
+            handle.close()
+
 def show_help():
     """Mostra ajuda de uso"""
     print("""
@@ -186,6 +249,7 @@ Comandos disponíveis:
     info                    - Mostra informações do banco de dados
     search <caminho>        - Busca imagens similares (retorna lista)
     searchtest <caminho>    - Busca melhor match (retorna imagem)
+    batch <caminhos...>     - Busca várias imagens, zip ou tar em uma requisição (NDJSON)
     rebuild                 - Reconstrói o cache do banco
     test                    - Testa conexão com a API
     help                    - Mostra esta ajuda
@@ -195,6 +259,8 @@ Exemplos:
     python test_api.py search train_image/telegram-cloud-photo-size-1-5026254558854229781-y.jpg
     python test_api.py searchtest train_image/telegram-cloud-photo-size-1-5026254558854229781-y.jpg
     python test_api.py search ./minha_imagem.jpg
+    python test_api.py batch train_image/*.jpg
+    python test_api.py batch fotos_conciliacao.zip
     python test_api.py rebuild
     
 Notas:
@@ -252,6 +318,15 @@ def main():
         if test_api_connection():
             search_best_match(image_path)
     
+    elif command == "batch":
+        if len(sys.argv) < 3:
+            print("❌ Ao menos um arquivo é obrigatório.")
+            print("Uso: python test_api.py batch <imagens, zip ou tar...>")
+            return
+        
+        if test_api_connection():
+            search_batch(sys.argv[2:])
+    
     elif command == "rebuild":
         if test_api_connection():
             rebuild_database()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Testa adição/remoção online de imagens (delta + tombstones) e a compactação
+"""
+
+import cv2
+import os
+import shutil
+import tempfile
+import threading
+import time
+from main import ImageMatcher
+
+def top_path(matcher: ImageMatcher, image) -> str:
+    results = matcher.search_similar_images(image, top_k=3)
+    return results[0]['image_path'] if results else None
+
+def test_online_add_remove(source_dir: str = "image_data"):
+    """Imagem adicionada aparece na busca sem reconstrução; removida some; compactação mantém o resultado"""
+    print("🧪 Delta online: adição, remoção, recarga e compactação")
+    print("=" * 50)
+
+    names = sorted(os.listdir(source_dir)) if os.path.isdir(source_dir) else []
+    assert len(names) >= 3, "⚠️  Banco precisa de pelo menos 3 imagens"
+
+    source_dir = os.path.abspath(source_dir)
+    held_out, removed = names[0], names[1]
+    with open(os.path.join(source_dir, held_out), "rb") as f:
+        new_contents = f.read()
+
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="delta_test_")
+    try:
+        shutil.copytree(source_dir, os.path.join(work_dir, "image_data"),
+                        ignore=lambda _, files: [held_out] if held_out in files else [])
+        os.chdir(work_dir)
+
+        matcher = ImageMatcher()
+        matcher.use_phash_fast_path = False  # Força Annoy + delta
+        new_query = cv2.resize(cv2.imread(os.path.join(source_dir, held_out)), None, fx=0.8, fy=0.8)
+        removed_query = cv2.resize(cv2.imread(os.path.join(source_dir, removed)), None, fx=0.8, fy=0.8)
+        print(f"📦 Banco inicial: {len(matcher.database_features)} imagens ({held_out} fora)")
+
+        start_time = time.perf_counter()
+        added = matcher.add_database_image("novas/" + held_out, new_contents)
+        print(f"➕ Adicionada em {(time.perf_counter() - start_time) * 1000:.0f} ms "
+              f"({added['features_count']} descritores, {added['delta_pending']} pendências)")
+        found = top_path(matcher, new_query) == added['image_path']
+        print(f"🔍 Nova imagem é o 1º resultado: {'✅' if found else '❌'}")
+
+        matcher.remove_database_image(removed)
+        gone = removed not in [r['image_path'] for r in matcher.search_similar_images(removed_query, top_k=10)]
+        matcher.use_phash_fast_path = True
+        gone = gone and removed not in [r['image_path'] for r in matcher.phash_lookup(cv2.imread(
+            os.path.join(source_dir, removed)), top_k=10)]
+        matcher.use_phash_fast_path = False
+        print(f"➖ Removida some das buscas (Annoy e pHash): {'✅' if gone else '❌'}")
+
+        # Alteração concorrente espera o lock de ingestão; só uma reconstrução em andamento recusa
+        other_update = threading.Event()
+        def hold_lock():
+            with matcher._online_update():
+                other_update.set()
+                time.sleep(0.3)
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        other_update.wait()
+        start_time = time.perf_counter()
+        matcher.remove_database_image(names[2])
+        waited_ms = (time.perf_counter() - start_time) * 1000
+        holder.join()
+
+        building, release = threading.Event(), threading.Event()
+        def slow_build(generation):
+            building.set()
+            release.wait()
+        rebuild = threading.Thread(target=matcher.rebuild_generation, args=(slow_build,))
+        rebuild.start()
+        building.wait()
+        try:
+            matcher.add_database_image("novas/outra.jpg", new_contents)
+            refused = False
+        except RuntimeError:
+            refused = True
+        release.set()
+        rebuild.join()
+        matcher = matcher.latest_generation()
+        serialized = waited_ms >= 200 and names[2] in matcher.tombstones and refused
+        print(f"🔒 Remoção concorrente esperou {waited_ms:.0f} ms; durante reconstrução recusada: "
+              f"{'✅' if serialized else '❌'}")
+
+        # Delta e tombstones sobrevivem a um reinício
+        reloaded = ImageMatcher()
+        reloaded.use_phash_fast_path = False
+        restored = (top_path(reloaded, new_query) == added['image_path']
+                    and removed not in [r['image_path'] for r in reloaded.search_similar_images(removed_query, top_k=10)])
+        print(f"💾 Delta recarregado após reinício: {'✅' if restored else '❌'}")
+
+        # Compactação numa nova geração: a geração em uso continua intacta até a troca
+        pending_before = reloaded.delta_pending()
+        compacted_matcher, summary = reloaded.rebuild_generation(lambda generation: generation.compact_delta())
+        compacted = (summary is not None and compacted_matcher.delta_pending() == 0
+                     and "novas/" + held_out in compacted_matcher.database_features
+                     and removed not in compacted_matcher.database_features
+                     and top_path(compacted_matcher, new_query) == added['image_path'])
+        untouched = (reloaded.delta_pending() == pending_before
+                     and top_path(reloaded, new_query) == added['image_path'])
+        print(f"🧹 Compactação funde o delta no Annoy: {'✅' if compacted else '❌'} "
+              f"({len(compacted_matcher.database_features)} imagens no store)")
+        print(f"🔁 Geração anterior intacta até a troca: {'✅' if untouched else '❌'}")
+
+        assert found and gone and serialized and restored and compacted and untouched
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_online_add_remove,):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Delta online OK!" if ok else "\n❌ Delta online com problemas!")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Benchmark do motor Hamming vetorizado vs BFMatcher (crossCheck) do OpenCV
+"""
+
+import cv2
+import numpy as np
+import time
+from main import ImageMatcher
+
+def bfmatcher_similarity(bf_matcher, descriptors1, descriptors2):
+    """Implementação anterior (BFMatcher + ordenação de DMatch) usada como referência"""
+    matches = bf_matcher.match(descriptors1, descriptors2)
+
+    if len(matches) == 0:
+        return 0.0
+
+    matches = sorted(matches, key=lambda x: x.distance)
+
+    excellent_matches = [m for m in matches if m.distance < 25]
+    good_matches = [m for m in matches if m.distance < 40]
+    decent_matches = [m for m in matches if m.distance < 60]
+
+    total_features = min(len(descriptors1), len(descriptors2))
+    excellent_ratio = len(excellent_matches) / total_features
+    good_ratio = len(good_matches) / total_features
+    decent_ratio = len(decent_matches) / total_features
+
+    quality_score = (
+        excellent_ratio * 1.0 +
+        good_ratio * 0.7 +
+        decent_ratio * 0.4
+    ) / 3.0
+
+    if len(good_matches) > 0:
+        avg_distance = sum(m.distance for m in good_matches) / len(good_matches)
+        distance_score = max(0, (80 - avg_distance) / 80)
+    else:
+        distance_score = 0.0
+
+    coverage_score = len(decent_matches) / total_features
+
+    final_score = (
+        quality_score * 0.5 +
+        distance_score * 0.3 +
+        coverage_score * 0.2
+    )
+
+    if excellent_ratio > 0.1:
+        excellent_bonus = min(excellent_ratio * 0.2, 0.1)
+        final_score += excellent_bonus
+
+    return min(final_score, 1.0)
+
+def test_hamming_engine(n_pairs: int = 500):
+    """Compara scores e tempo por par entre as duas implementações"""
+    print("🧪 Benchmark: Motor Hamming NumPy vs BFMatcher")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    image_paths = list(matcher.database_features.keys())
+
+    assert len(image_paths) >= 2, "⚠️  Banco precisa de pelo menos 2 imagens"
+
+    bf_matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    rng = np.random.default_rng(42)
+    pairs = [
+        (matcher.database_features[image_paths[i]], matcher.database_features[image_paths[j]])
+        for i, j in rng.integers(0, len(image_paths), size=(n_pairs, 2))
+    ]
+
+    # Aquecimento
+    bfmatcher_similarity(bf_matcher, *pairs[0])
+    matcher.calculate_similarity(*pairs[0])
+
+    start_time = time.perf_counter()
+    reference_scores = [bfmatcher_similarity(bf_matcher, d1, d2) for d1, d2 in pairs]
+    time_bf = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    numpy_scores = [matcher.calculate_similarity(d1, d2) for d1, d2 in pairs]
+    time_numpy = time.perf_counter() - start_time
+
+    mismatches = sum(1 for a, b in zip(reference_scores, numpy_scores) if a != b)
+
+    print(f"📊 Pares comparados: {n_pairs}")
+    print(f"🔄 BFMatcher: {time_bf / n_pairs * 1000:.3f} ms/par")
+    print(f"🚀 NumPy:     {time_numpy / n_pairs * 1000:.3f} ms/par")
+    print(f"⚡ Speedup: {time_bf / time_numpy:.2f}x")
+    print(f"🎯 Scores divergentes: {mismatches}")
+
+    assert mismatches == 0
+
+def test_batch_rerank(n_queries: int = 20, n_candidates: int = 100):
+    """Compara o rerank em lote (calculate_similarities) com chamadas individuais"""
+    print("\n🧪 Benchmark: Rerank em lote vs calculate_similarity por candidato")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    image_paths = list(matcher.database_features.keys())
+
+    assert len(image_paths) >= 2, "⚠️  Banco precisa de pelo menos 2 imagens"
+
+    rng = np.random.default_rng(7)
+    time_loop = 0.0
+    time_batch = 0.0
+    mismatches = 0
+
+    for _ in range(n_queries):
+        query = matcher.database_features[image_paths[rng.integers(len(image_paths))]]
+        candidates = [
+            matcher.database_features[image_paths[i]]
+            for i in rng.integers(0, len(image_paths), size=n_candidates)
+        ]
+
+        start_time = time.perf_counter()
+        loop_scores = [matcher.calculate_similarity(query, c) for c in candidates]
+        time_loop += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        batch_scores = matcher.calculate_similarities(query, candidates)
+        time_batch += time.perf_counter() - start_time
+
+        mismatches += sum(1 for a, b in zip(loop_scores, batch_scores) if a != b)
+
+    print(f"📊 Consultas: {n_queries} x {n_candidates} candidatos (workers={matcher.query_workers})")
+    print(f"🔄 Individual: {time_loop / n_queries * 1000:.2f} ms/consulta")
+    print(f"🚀 Em lote:    {time_batch / n_queries * 1000:.2f} ms/consulta")
+    print(f"⚡ Speedup: {time_loop / time_batch:.2f}x")
+    print(f"🎯 Scores divergentes: {mismatches}")
+
+    assert mismatches == 0
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_hamming_engine, test_batch_rerank):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Scores idênticos!" if ok else "\n❌ Scores divergentes!")
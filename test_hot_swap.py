@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Testa a reconstrução em segundo plano: buscas continuam durante a tarefa e a troca de geração é atômica
+"""
+
+import asyncio
+import cv2
+import os
+import time
+from fastapi import HTTPException
+import main
+
+def load_queries(image_dir: str = "train_image"):
+    """Fotos de teste reduzidas a 80% e codificadas como upload (não passam pelo atalho pHash)"""
+    queries = []
+    for name in sorted(os.listdir(image_dir)) if os.path.isdir(image_dir) else []:
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            queries.append(cv2.imencode('.png', cv2.resize(image, None, fx=0.8, fy=0.8))[1].tobytes())
+    return queries
+
+def test_hot_swap():
+    """/database/rebuild responde na hora, buscas seguem durante a tarefa e o resultado não muda"""
+    print("🧪 Reconstrução em segundo plano e troca atômica de geração")
+    print("=" * 50)
+
+    queries = load_queries()
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada"
+
+    async def search(contents: bytes):
+        results, _, _ = await main.run_search_task(main.search_uploaded_image, contents, 5)
+        return [r['image_path'] for r in results]
+
+    async def scenario():
+        main.matcher.use_phash_fast_path = False  # Força Annoy + rerank
+        main.matcher.use_result_cache = False
+        before = [await search(q) for q in queries]
+        old_matcher = main.matcher
+
+        start_time = time.perf_counter()
+        job = await main.rebuild_database()
+        accept_ms = (time.perf_counter() - start_time) * 1000
+        duplicate = (await main.rebuild_database())['job_id'] == job['job_id']
+
+        # Buscas e status continuam respondendo enquanto a tarefa roda
+        during, status_ms = [], []
+        while (await main.get_job(job['job_id']))['status'] in ('queued', 'running'):
+            start_time = time.perf_counter()
+            await main.root()
+            status_ms.append((time.perf_counter() - start_time) * 1000)
+            during.append(await search(queries[len(during) % len(queries)]))
+        finished = await main.get_job(job['job_id'])
+
+        after = [await search(q) for q in queries]
+        try:
+            await main.get_job("inexistente")
+            missing = None
+        except HTTPException as e:
+            missing = e.status_code
+        return before, during, after, old_matcher, accept_ms, duplicate, status_ms, finished, missing
+
+    # Os ajustes passam para a geração promovida: restaura no matcher global vigente ao final
+    phash_fast_path, result_cache = main.matcher.use_phash_fast_path, main.matcher.use_result_cache
+    try:
+        before, during, after, old_matcher, accept_ms, duplicate, status_ms, job, missing = asyncio.run(scenario())
+    finally:
+        main.matcher.use_phash_fast_path, main.matcher.use_result_cache = phash_fast_path, result_cache
+    print(f"📋 /database/rebuild respondeu em {accept_ms:.1f} ms (tarefa {job['id'][:8]})")
+    print(f"⏱️  Tarefa {job['status']} em {job['elapsed_seconds']:.2f}s; {len(during)} buscas atendidas durante"
+          + (f", GET / máx {max(status_ms):.1f} ms" if status_ms else ""))
+    print(f"🔂 Pedido repetido reaproveita a tarefa: {'✅' if duplicate else '❌'}")
+
+    swapped = main.matcher is not old_matcher and old_matcher.latest_generation() is main.matcher
+    print(f"🔁 Matcher global trocado: {'✅' if swapped else '❌'}")
+
+    expected = {tuple(r) for r in before}
+    same = before == after and all(tuple(r) in expected for r in during)
+    print(f"🎯 Resultados idênticos antes, durante e depois: {'✅' if same else '❌'}")
+
+    # Requisições que pegaram a geração antiga terminam nela normalmente
+    image = cv2.imdecode(main.np.frombuffer(queries[0], main.np.uint8), cv2.IMREAD_COLOR)
+    old_ok = [r['image_path'] for r in old_matcher.search_similar_images(image, 5)] == before[0]
+    print(f"🕰️  Geração antiga continua buscando: {'✅' if old_ok else '❌'}")
+
+    assert (job['status'] == 'succeeded' and accept_ms < 100 and duplicate and swapped
+            and same and old_ok and missing == 404)
+
+def test_backend_switch_job():
+    """Trocar para um backend sem índice agenda a construção em segundo plano em vez de bloquear a requisição"""
+    print("\n🧪 Troca de backend com índice construído em segundo plano")
+    print("=" * 50)
+
+    async def scenario():
+        main.matcher.graph_index = None
+        start_time = time.perf_counter()
+        response = await main.update_performance_config(search_backend='graph')
+        accept_ms = (time.perf_counter() - start_time) * 1000
+        job_id = response['jobs']['graph_prepare']['job_id']
+        while (await main.get_job(job_id))['status'] in ('queued', 'running'):
+            await asyncio.sleep(0.05)
+        return accept_ms, await main.get_job(job_id)
+
+    backend = main.matcher.search_backend
+    try:
+        accept_ms, job = asyncio.run(scenario())
+        ready = main.matcher.search_backend == 'graph' and main.matcher.graph_index is not None
+    finally:
+        main.matcher.search_backend = backend
+    print(f"📋 Configuração respondeu em {accept_ms:.1f} ms; tarefa {job['status']} em {job['elapsed_seconds']:.2f}s")
+    print(f"🕸️ Grafo pronto na geração promovida: {'✅' if ready else '❌'}")
+
+    assert job['status'] == 'succeeded' and accept_ms < 100 and ready
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_hot_swap, test_backend_switch_job):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Troca de geração OK!" if ok else "\n❌ Troca de geração com problemas!")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Testa a ingestão incremental pelo manifesto: mesmo resultado da reconstrução completa
+"""
+
+import cv2
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+from main import ImageMatcher
+
+def snapshot(matcher: ImageMatcher):
+    """Cópia de features (na ordem do banco) e metadados"""
+    features = [(path, np.array(matcher.database_features[path])) for path in matcher.database_features]
+    return features, {path: dict(meta) for path, meta in matcher.database_metadata.items()}
+
+def same_snapshot(a, b) -> bool:
+    (features_a, metadata_a), (features_b, metadata_b) = a, b
+    return ([p for p, _ in features_a] == [p for p, _ in features_b]
+            and all(np.array_equal(x, y) for (_, x), (_, y) in zip(features_a, features_b))
+            and metadata_a == metadata_b)
+
+def test_incremental_sync(source_dir: str = "image_data"):
+    """Renomear, apagar, adicionar e tocar arquivos; a sincronização deve bater com a reconstrução"""
+    print("🧪 Ingestão incremental: sincronização vs reconstrução completa")
+    print("=" * 50)
+
+    names = sorted(os.listdir(source_dir)) if os.path.isdir(source_dir) else []
+    assert len(names) >= 3, "⚠️  Banco precisa de pelo menos 3 imagens"
+
+    source_dir = os.path.abspath(source_dir)
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="sync_test_")
+    try:
+        shutil.copytree(source_dir, os.path.join(work_dir, "image_data"))
+        os.chdir(work_dir)
+
+        matcher = ImageMatcher()
+        print(f"📦 Banco inicial: {len(matcher.database_features)} imagens")
+
+        # Nada mudou: sem extração nem reconstrução
+        start_time = time.perf_counter()
+        summary = matcher.sync_database_images()
+        time_noop = time.perf_counter() - start_time
+        print(f"⏸️  Sem mudanças: {time_noop * 1000:.0f} ms, changed={summary['changed']}")
+        noop_ok = summary['mode'] == 'incremental' and not summary['changed']
+
+        # Renomeia, apaga, adiciona uma versão reduzida e toca um arquivo
+        os.rename(os.path.join("image_data", names[0]), os.path.join("image_data", "renomeada_" + names[0]))
+        os.remove(os.path.join("image_data", names[1]))
+        image = cv2.imread(os.path.join("image_data", names[2]))
+        cv2.imwrite(os.path.join("image_data", "nova_reduzida.png"),
+                    cv2.resize(image, None, fx=0.7, fy=0.7, interpolation=cv2.INTER_AREA))
+        os.utime(os.path.join("image_data", names[2]))
+
+        start_time = time.perf_counter()
+        summary = matcher.sync_database_images()
+        time_sync = time.perf_counter() - start_time
+        print(f"🗂️  Sincronização: {time_sync:.2f}s — extraídos {summary['extracted']}, "
+              f"reaproveitados {summary['renamed']}, removidos {summary['deleted']}, "
+              f"inalterados {summary['unchanged']}")
+        counts_ok = summary['extracted'] == 1 and summary['renamed'] == 1 and summary['deleted'] == 2
+        synced = snapshot(matcher)
+
+        start_time = time.perf_counter()
+        matcher.process_database_images()
+        time_full = time.perf_counter() - start_time
+        print(f"🔄 Reconstrução completa: {time_full:.2f}s")
+        equal = same_snapshot(synced, snapshot(matcher))
+        print(f"🎯 Mesmo banco da reconstrução: {'✅' if equal else '❌'}")
+
+        # Parâmetros do ORB diferentes invalidam todos os descriptors
+        matcher.orb.setMaxFeatures(matcher.orb.getMaxFeatures() // 2)
+        summary = matcher.sync_database_images()
+        print(f"⚙️  nfeatures alterado → modo {summary['mode']}: {'✅' if summary['mode'] == 'full' else '❌'}")
+
+        assert noop_ok and counts_ok and equal and summary['mode'] == 'full'
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_incremental_sync,):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Ingestão incremental OK!" if ok else "\n❌ Ingestão incremental com problemas!")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Testa as gerações versionadas dos índices: manifesto com checksums, rollback e recuperação após falha
+"""
+
+import cv2
+import json
+import os
+import shutil
+import tempfile
+from main import ImageMatcher
+
+def top_paths(matcher: ImageMatcher, image):
+    return [r['image_path'] for r in matcher.search_similar_images(image, top_k=3)]
+
+def test_index_generations(source_dir: str = "image_data"):
+    """Cada construção vira uma geração; rollback e carga após corrupção usam a anterior íntegra"""
+    print("🧪 Gerações dos índices: manifesto, rollback e recuperação")
+    print("=" * 50)
+
+    names = sorted(os.listdir(source_dir)) if os.path.isdir(source_dir) else []
+    assert names, "⚠️  Banco vazio"
+
+    source_dir = os.path.abspath(source_dir)
+    query = cv2.resize(cv2.imread(os.path.join(source_dir, names[0])), None, fx=0.8, fy=0.8)
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="generations_test_")
+    try:
+        shutil.copytree(source_dir, os.path.join(work_dir, "image_data"))
+        os.chdir(work_dir)
+
+        matcher = ImageMatcher()
+        matcher.use_phash_fast_path = False  # Força Annoy + rerank
+        first_dir = matcher.index_dir
+        before = top_paths(matcher, query)
+        manifest = matcher.index_generations.read_manifest(first_dir)
+        manifest_ok = (manifest['annoy_params']['n_trees'] == matcher.annoy_n_trees
+                       and manifest['feature_params'] == matcher.feature_params()
+                       and all(len(entry['sha256']) == 64 for entry in manifest['files'].values()))
+        print(f"🗃️  {os.path.basename(first_dir)}: {len(manifest['files'])} arquivos no manifesto "
+              f"com tamanho, SHA-256 e parâmetros: {'✅' if manifest_ok else '❌'}")
+
+        # Reconstruir só o Annoy: o store entra como hard link da geração anterior
+        def rebuild_annoy(generation: ImageMatcher):
+            generation.build_annoy_index()
+            generation.save_annoy_index()
+        matcher, _ = matcher.rebuild_generation(rebuild_annoy)
+        second_dir = matcher.index_dir
+        shared = (os.stat(os.path.join(first_dir, "features_store.npy")).st_ino
+                  == os.stat(os.path.join(second_dir, "features_store.npy")).st_ino)
+        print(f"🔗 {os.path.basename(second_dir)} reaproveita o store sem cópia: {'✅' if shared else '❌'}")
+
+        matcher, summary = matcher.rollback_index_generation()
+        rolled_back = (matcher.index_dir == first_dir and matcher.index_generations.current() == summary['generation']
+                       and top_paths(matcher, query) == before)
+        print(f"⏪ Rollback {summary['rolled_back_from']} → {summary['generation']}: {'✅' if rolled_back else '❌'}")
+
+        # Geração apontada corrompida e construção interrompida (sem manifesto)
+        with open(os.path.join(second_dir, "annoy_index.ann"), "r+b") as f:
+            f.seek(64)
+            f.write(b"\xde\xad\xbe\xef")
+        matcher.index_generations.set_current(second_dir)
+        crashed_dir = os.path.join(matcher.index_generations.root, "gen-999999")
+        os.makedirs(crashed_dir)
+        with open(os.path.join(crashed_dir, "features_paths.json"), "w") as f:
+            json.dump([], f)
+
+        restarted = ImageMatcher()
+        restarted.use_phash_fast_path = False
+        recovered = (restarted.index_dir == first_dir and not os.path.exists(crashed_dir)
+                     and top_paths(restarted, query) == before)
+        print(f"🛟 Reinício ignora a geração corrompida e a interrompida: {'✅' if recovered else '❌'}")
+
+        assert manifest_ok and shared and rolled_back and recovered
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_index_generations,):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Gerações dos índices OK!" if ok else "\n❌ Gerações dos índices com problemas!")
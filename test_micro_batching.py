@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Testa o micro-batching: consultas concorrentes agrupadas em uma fase 1 Annoy e um rerank por lote
+"""
+
+import concurrent.futures
+import cv2
+import os
+import time
+from main import ImageMatcher
+
+def load_queries(image_dir: str = "train_image"):
+    """Fotos de teste reduzidas a 80% (não passam pelo atalho pHash)"""
+    queries = []
+    for name in sorted(os.listdir(image_dir)):
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            queries.append(cv2.resize(image, None, fx=0.8, fy=0.8, interpolation=cv2.INTER_AREA))
+    return queries
+
+def run_concurrent(matcher: ImageMatcher, queries, n_threads: int):
+    """Dispara as consultas com `n_threads` requisições simultâneas"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(lambda image: matcher.search_similar_images(image, top_k=3), queries))
+
+def test_micro_batching(n_threads: int = 8, repeat: int = 3):
+    """Lotes devolvem os mesmos resultados das consultas isoladas"""
+    print("🧪 Micro-batching: resultados e tamanhos de lote")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    queries = load_queries() * repeat
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada"
+    matcher.use_phash_fast_path = False  # Força as fases 1 e 2
+
+    start_time = time.perf_counter()
+    single_results = run_concurrent(matcher, queries, n_threads)
+    time_single = time.perf_counter() - start_time
+
+    matcher.use_micro_batching = True
+    start_time = time.perf_counter()
+    batched_results = run_concurrent(matcher, queries, n_threads)
+    time_batched = time.perf_counter() - start_time
+
+    stats = matcher.micro_batcher.stats()
+    print(f"🔄 Sem lote: {len(queries) / time_single:.1f} consultas/s")
+    print(f"📦 Com lote: {len(queries) / time_batched:.1f} consultas/s "
+          f"(janela {stats['window_ms']} ms, máximo {stats['max_size']})")
+    print(f"📊 Lotes: {stats['batches']}, tamanho médio {stats['mean_batch_size']}, "
+          f"histograma {stats['batch_size_histogram']}")
+    print(f"⏱️  Espera média na fila: {stats['mean_queue_wait_ms']:.1f} ms")
+
+    same = single_results == batched_results
+    print(f"🎯 Resultados idênticos: {'✅' if same else '❌'}")
+
+    assert same and stats['mean_batch_size'] > 1
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_micro_batching,):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Micro-batching OK!" if ok else "\n❌ Micro-batching com problemas!")
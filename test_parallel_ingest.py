@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Testa a extração paralela do banco: mesmo resultado da extração serial
+"""
+
+import numpy as np
+import os
+import time
+from main import ImageMatcher
+
+def snapshot(matcher: ImageMatcher):
+    """Cópia de features (na ordem do banco) e metadados após uma extração"""
+    features = [(path, np.array(matcher.database_features[path])) for path in matcher.database_features]
+    return features, {path: dict(meta) for path, meta in matcher.database_metadata.items()}
+
+def test_parallel_matches_serial(n_workers: int = 2, chunk_size: int = 2):
+    """Extração em processos deve gerar features e metadados idênticos aos da serial"""
+    print("🧪 Extração do banco: paralela vs serial")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    assert len(matcher.database_features) >= 2, "⚠️  Banco precisa de pelo menos 2 imagens"
+
+    matcher.ingest_workers = 1
+    start_time = time.perf_counter()
+    matcher.process_database_images()
+    time_serial = time.perf_counter() - start_time
+    serial_features, serial_metadata = snapshot(matcher)
+
+    matcher.ingest_workers = n_workers
+    matcher.ingest_chunk_size = chunk_size
+    start_time = time.perf_counter()
+    matcher.process_database_images()
+    time_parallel = time.perf_counter() - start_time
+    parallel_features, parallel_metadata = snapshot(matcher)
+
+    same_order = [p for p, _ in serial_features] == [p for p, _ in parallel_features]
+    same_descriptors = all(np.array_equal(a, b) for (_, a), (_, b) in zip(serial_features, parallel_features))
+    same_metadata = serial_metadata == parallel_metadata
+
+    print(f"🔄 Serial:   {time_serial:.2f}s (reconstrução completa)")
+    print(f"🧩 Paralela: {time_parallel:.2f}s ({n_workers} processos, blocos de {chunk_size}, {os.cpu_count()} núcleos)")
+    print(f"📋 Ordem das imagens: {'✅' if same_order else '❌'}")
+    print(f"🔍 Descriptors: {'✅' if same_descriptors else '❌'}")
+    print(f"🏷️  Metadados: {'✅' if same_metadata else '❌'}")
+    print(f"⚠️  Erros registrados: {len(matcher.ingest_errors)}")
+
+    assert same_order and same_descriptors and same_metadata
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_parallel_matches_serial,):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Extração paralela OK!" if ok else "\n❌ Extração paralela com problemas!")
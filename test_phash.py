@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Testa o atalho pHash para reenvios das fotos do catálogo
+"""
+
+import cv2
+import numpy as np
+import os
+import time
+import asyncio
+import main
+from main import ImageMatcher
+
+def reencode(image: np.ndarray, scale: float, quality: int) -> np.ndarray:
+    """Simula um reenvio: redimensiona e recomprime em JPEG"""
+    resized = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def test_phash_hits(limit: int = 50):
+    """Fotos do catálogo reenviadas devem ser respondidas pelo atalho (pHash + confirmação ORB)"""
+    print("🧪 Atalho pHash: reenvios do catálogo")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+
+    assert matcher.phash_index is not None, "⚠️  Índice pHash não carregado"
+
+    image_paths = matcher.database_features.image_paths[:limit]
+    print(f"🖼️  Raio: {matcher.phash_max_radius} bits, {len(matcher.phash_codes)} imagens indexadas")
+
+    hits = 0
+    times = []
+    for path in image_paths:
+        image = cv2.imread(os.path.join(matcher.database_path, path))
+        if image is None:
+            continue
+        query = reencode(image, 0.7, 75)
+
+        start_time = time.perf_counter()
+        results = matcher.search_similar_images(query, top_k=1)
+        times.append(time.perf_counter() - start_time)
+
+        hit = bool(results) and results[0]['search_method'] == 'phash' and results[0]['image_path'] == path
+        hits += hit
+        if not hit:
+            method = results[0]['search_method'] if results else 'nenhum resultado'
+            print(f"  ❌ {path}: {method}")
+
+    print(f"\n🎯 Acertos pelo atalho: {hits}/{len(times)}")
+    print(f"⏱️  Tempo mediano: {np.median(times) * 1000:.2f} ms/consulta (pHash + confirmação ORB)")
+
+    assert hits == len(times)
+
+def test_phash_separation():
+    """Imagens diferentes do banco não podem cair dentro do raio umas das outras"""
+    print("\n🧪 Atalho pHash: separação entre imagens do banco")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    codes = matcher.phash_codes.ravel()
+    assert len(codes) >= 2, "⚠️  Banco precisa de pelo menos 2 imagens"
+
+    bits = np.unpackbits(codes.view(np.uint8).reshape(-1, 8), axis=1)
+    distances = (bits[:, None, :] != bits[None, :, :]).sum(axis=2)
+    np.fill_diagonal(distances, 64)
+    closest = distances.min(axis=1)
+
+    print(f"📏 Menor distância entre imagens distintas: {closest.min()} bits (raio {matcher.phash_max_radius})")
+    print(f"⚠️  Imagens com vizinho dentro do raio: {np.count_nonzero(closest <= matcher.phash_max_radius)}")
+
+    assert closest.min() > matcher.phash_max_radius
+
+def test_phash_verification(limit: int = 20):
+    """Candidatos pHash só respondem se o ORB confirmar; a busca completa preenche o resto do top_k"""
+    print("\n🧪 Atalho pHash: confirmação ORB dos candidatos")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    assert matcher.phash_index is not None, "⚠️  Índice pHash não carregado"
+
+    # Raio máximo: todas as imagens viram candidatas, só a certa pode passar pelo ORB
+    matcher.phash_max_radius = 64
+    wrong = filled = 0
+    for path in matcher.database_features.image_paths[:limit]:
+        image = cv2.imread(os.path.join(matcher.database_path, path))
+        if image is None:
+            continue
+        results = matcher.search_similar_images(reencode(image, 0.7, 75), top_k=5)
+        wrong += sum(r['search_method'] == 'phash' and r['image_path'] != path for r in results)
+        filled += bool(results) and results[0]['search_method'] == 'phash' and len(results) > 1
+
+    noise = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    noise_results = matcher.search_similar_images(noise, top_k=5)
+    noise_ok = not any(r['search_method'] == 'phash' for r in noise_results)
+
+    print(f"🚫 Imagens erradas respondidas pelo atalho: {wrong}")
+    print(f"📋 Consultas com o top_k completado pela busca normal: {filled}")
+    print(f"🎲 Ruído cai na busca completa: {'✅' if noise_ok else '❌'} (estatísticas {matcher.phash_stats})")
+
+    assert wrong == 0 and filled > 0 and noise_ok and matcher.phash_stats["rejected"] > 0
+
+def test_phash_enable_job():
+    """Ligar o atalho sem índice agenda a construção em segundo plano em vez de bloquear a requisição"""
+    print("\n🧪 Atalho pHash: índice construído em segundo plano")
+    print("=" * 50)
+
+    async def scenario():
+        main.matcher.phash_index = None
+        start_time = time.perf_counter()
+        response = await main.update_performance_config(use_phash_fast_path=True)
+        accept_ms = (time.perf_counter() - start_time) * 1000
+        job_id = response['jobs']['phash_prepare']['job_id']
+        while (await main.get_job(job_id))['status'] in ('queued', 'running'):
+            await asyncio.sleep(0.05)
+        return accept_ms, await main.get_job(job_id)
+
+    use_phash_fast_path = main.matcher.use_phash_fast_path
+    try:
+        accept_ms, job = asyncio.run(scenario())
+        ready = main.matcher.phash_index is not None
+    finally:
+        main.matcher.use_phash_fast_path = use_phash_fast_path
+    print(f"📋 Configuração respondeu em {accept_ms:.1f} ms; tarefa {job['status']} em {job['elapsed_seconds']:.2f}s")
+    print(f"🖼️ Índice pHash pronto na geração promovida: {'✅' if ready else '❌'}")
+
+    assert job['status'] == 'succeeded' and accept_ms < 100 and ready
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_phash_hits, test_phash_separation, test_phash_verification, test_phash_enable_job):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Atalho pHash OK!" if ok else "\n❌ Atalho pHash com problemas!")
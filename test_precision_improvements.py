@@ -16,6 +16,7 @@ def test_precision_improvements():
     
     # Cria matcher com configurações otimizadas
     matcher = ImageMatcher()
+    matcher.use_phash_fast_path = False  # Mede a precisão da busca híbrida, não do atalho pHash
     
     print("📊 Configurações atuais:")
     print(f"   ORB features: {matcher.orb.getMaxFeatures()}")
@@ -125,6 +126,7 @@ def test_different_thresholds():
     print("=" * 40)
     
     matcher = ImageMatcher()
+    matcher.use_phash_fast_path = False
     
     # Configurações para testar
     test_configs = [
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Testa o modo de busca em pool de processos (forkserver; índice e store compartilhados via mmap)
+"""
+
+import concurrent.futures
+import cv2
+import os
+import time
+from main import ImageMatcher
+
+def load_queries(image_dir: str = "train_image"):
+    """Fotos de teste reduzidas a 80% (a extração ORB roda no processo da API)"""
+    matcher = ImageMatcher()
+    queries = []
+    for name in sorted(os.listdir(image_dir)):
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            queries.append(cv2.resize(image, None, fx=0.8, fy=0.8, interpolation=cv2.INTER_AREA))
+    return matcher, queries
+
+def run_queries(matcher: ImageMatcher, queries, n_threads: int):
+    """Executa todas as consultas com `n_threads` requisições simultâneas"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(lambda image: matcher.search_similar_images(image, top_k=3), queries))
+
+def test_process_pool_results(n_threads: int = 4, repeat: int = 3):
+    """Os processos devem devolver exatamente os mesmos resultados das threads"""
+    print("🧪 Pool de processos: resultados e vazão")
+    print("=" * 50)
+
+    matcher, queries = load_queries()
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada"
+    matcher.use_phash_fast_path = False  # Força as fases 1 e 2
+    queries = queries * repeat
+
+    start_time = time.perf_counter()
+    thread_results = run_queries(matcher, queries, n_threads)
+    time_threads = time.perf_counter() - start_time
+
+    matcher.use_process_pool = True
+    run_queries(matcher, queries[:matcher.search_processes], n_threads)  # Sobe o pool
+
+    start_time = time.perf_counter()
+    process_results = run_queries(matcher, queries, n_threads)
+    time_processes = time.perf_counter() - start_time
+
+    print(f"🧵 Threads:    {len(queries) / time_threads:.1f} consultas/s")
+    print(f"🧩 Processos:  {len(queries) / time_processes:.1f} consultas/s "
+          f"({matcher.search_processes} processos, {os.cpu_count()} núcleos)")
+
+    same = thread_results == process_results
+    print(f"🎯 Resultados idênticos: {'✅' if same else '❌'}")
+
+    # Configuração alterada no processo da API chega aos processos do pool
+    matcher.rerank_candidates = 1
+    narrow = matcher.search_similar_images(queries[0], top_k=3)
+    matcher.rerank_candidates = 100
+    print(f"⚙️  rerank_candidates=1 aplicado no pool: {'✅' if len(narrow) <= 1 else '❌'}")
+
+    # Processos vêm do forkserver, não de um fork do processo da API (com threads)
+    pool = matcher._get_process_pool()
+    forkserver = pool._mp_context.get_start_method() == 'forkserver'
+    print(f"🍴 Processos criados pelo forkserver: {'✅' if forkserver else '❌'}")
+
+    # Só a troca de índice recria o pool (invalidar os caches de resultado não)
+    matcher.clear_result_caches()
+    kept = matcher._get_process_pool() is pool
+    matcher.tombstones = frozenset(matcher.tombstones)
+    renewed = matcher._get_process_pool() is not pool
+    print(f"🔄 Pool mantido após invalidar caches: {'✅' if kept else '❌'}; recriado após troca de índice: {'✅' if renewed else '❌'}")
+
+    # Índice carregado do disco com o pool já aberto (sem invalidar caches): os processos
+    # precisam vê-lo em vez de cair no Annoy
+    matcher.use_process_pool = False
+    matcher.prepare_bow_index()
+    matcher.bow_index = None
+    matcher.use_process_pool = True
+    matcher.search_similar_images(queries[0], top_k=3)  # Pool aberto sem BoVW
+    matcher.prepare_bow_index()  # Carrega bow_index.npz
+    matcher.search_backend = 'bow'
+    pool_bow = matcher.search_similar_images(queries[0], top_k=3)
+    matcher.use_process_pool = False
+    thread_bow = matcher.search_similar_images(queries[0], top_k=3)
+    loaded_ok = pool_bow == thread_bow
+    print(f"📚 BoVW carregado do disco chega ao pool: {'✅' if loaded_ok else '❌'}")
+    matcher._process_pool.shutdown()
+
+    assert same and len(narrow) <= 1 and forkserver and kept and renewed and loaded_ok
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_process_pool_results,):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Pool de processos OK!" if ok else "\n❌ Pool de processos com problemas!")
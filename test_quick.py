@@ -15,6 +15,7 @@ def test_matcher():
     
     # Cria matcher
     matcher = ImageMatcher()
+    matcher.use_phash_fast_path = False  # Compara os caminhos ORB (Annoy vs tradicional)
     
     print(f"📊 Banco carregado: {len(matcher.database_features)} imagens")
     print(f"🚀 Annoy habilitado: {matcher.use_annoy}")
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Mede o recall da fase 0 (assinaturas globais) e da fase 1 (Annoy, BoVW, MIH, LSH e grafo) usando a busca exata por força bruta como ground truth
+"""
+
+import concurrent.futures
+import cv2
+import numpy as np
+import os
+import time
+from main import ImageMatcher, pack_descriptors
+
+def load_query_descriptors(matcher, folder: str = "train_image", limit: int = 5):
+    """Extrai descriptors das imagens de teste"""
+    queries = []
+    for file in sorted(os.listdir(folder))[:limit]:
+        image = cv2.imread(os.path.join(folder, file))
+        if image is None:
+            continue
+        _, descriptors = matcher.extract_features(image)
+        if descriptors is not None and len(descriptors) > 0:
+            queries.append((file, descriptors))
+    return queries
+
+def test_annoy_recall(k: int = 10, min_recall: float = 0.9):
+    """Compara os vizinhos do Annoy com os vizinhos exatos de cada descriptor (recall médio mínimo no search_k padrão)"""
+    print("🧪 Recall do Annoy vs Busca Exata")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+
+    assert matcher.annoy_index is not None, "⚠️  Índice Annoy não carregado"
+
+    queries = load_query_descriptors(matcher)
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada na pasta train_image/"
+
+    print(f"📊 Banco: {len(matcher.database_features)} imagens")
+    print(f"🚀 Annoy: search_k={matcher.annoy_search_k}, vizinhos={k}")
+
+    total_recall = 0.0
+    total_descriptors = 0
+    time_annoy = 0.0
+    time_exact = 0.0
+
+    for file, descriptors in queries:
+        start_time = time.perf_counter()
+        exact_query_idx, exact_ids, _ = matcher.exact_knn(descriptors, k=k)
+        time_exact += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        annoy_query_idx, annoy_ids, _ = matcher.annoy_batch_lookup(descriptors, n_neighbors=k)
+        time_annoy += time.perf_counter() - start_time
+
+        # IDs do Annoy seguem a ordem contígua do store
+        image_recall = 0.0
+        for i in range(len(descriptors)):
+            truth = set(exact_ids[exact_query_idx == i].tolist())
+            found = set(annoy_ids[annoy_query_idx == i].tolist())
+            image_recall += len(truth & found) / len(truth)
+
+        total_recall += image_recall
+        total_descriptors += len(descriptors)
+        print(f"  {file}: recall@{k} = {image_recall / len(descriptors):.3f}")
+
+    print(f"\n🎯 Recall@{k} médio: {total_recall / total_descriptors:.3f}")
+    print(f"⏱️  Annoy: {time_annoy / len(queries) * 1000:.1f} ms/imagem")
+    print(f"⏱️  Exata: {time_exact / len(queries) * 1000:.1f} ms/imagem")
+
+    assert total_recall / total_descriptors >= min_recall, f"recall@{k} abaixo de {min_recall}"
+
+def test_bow_candidates(max_score_gap: float = 0.05):
+    """Verifica se a melhor imagem da busca exata está entre os candidatos do BoVW
+    e se o score híbrido do BoVW fica na escala do score da busca exata"""
+    print("\n🧪 Candidatos do BoVW vs Busca Exata")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    matcher.prepare_bow_index()
+
+    assert matcher.bow_index is not None, "⚠️  Índice BoVW não disponível"
+
+    queries = load_query_descriptors(matcher)
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada na pasta train_image/"
+
+    print(f"📚 Vocabulário: {matcher.bow_index.n_words} palavras, "
+          f"{len(matcher.bow_index.postings_image):,} entradas no arquivo invertido")
+
+    hits = 0
+    scores_ok = 0
+    time_bow = 0.0
+    for file, descriptors in queries:
+        exact_results = matcher._search_exact(descriptors, top_k=1)
+
+        start_time = time.perf_counter()
+        candidate_idxs, scores, _ = matcher.bow_index.query(
+            pack_descriptors(descriptors), matcher.bow_max_df_ratio
+        )
+        time_bow += time.perf_counter() - start_time
+
+        top = candidate_idxs[np.argsort(-scores, kind='stable')[:matcher.rerank_candidates]]
+        top_paths = {matcher.database_features.image_paths[idx] for idx in top.tolist()}
+        found = bool(exact_results) and exact_results[0]['image_path'] in top_paths
+        hits += found
+
+        # Score híbrido completo: mesma imagem e score próximo ao da busca exata
+        bow_results = matcher._search_bow(descriptors, top_k=1)
+        same_scale = (bool(exact_results) and bool(bow_results)
+                      and bow_results[0]['image_path'] == exact_results[0]['image_path']
+                      and abs(bow_results[0]['similarity_score'] - exact_results[0]['similarity_score']) <= max_score_gap)
+        scores_ok += same_scale
+        bow_score = bow_results[0]['similarity_score'] if bow_results else 0.0
+        exact_score = exact_results[0]['similarity_score'] if exact_results else 0.0
+        print(f"  {file}: {'✅' if found else '❌'} ({len(candidate_idxs)} imagens com palavras em comum), "
+              f"score {bow_score:.3f} vs exato {exact_score:.3f} {'✅' if same_scale else '❌'}")
+
+    print(f"\n🎯 Top-1 exato entre os {matcher.rerank_candidates} candidatos BoVW: {hits}/{len(queries)}")
+    print(f"📏 Score híbrido BoVW a até {max_score_gap} do exato: {scores_ok}/{len(queries)}")
+    print(f"⏱️  Fase 1 BoVW: {time_bow / len(queries) * 1000:.2f} ms/imagem")
+
+    assert hits == len(queries) and scores_ok == len(queries)
+
+def test_mih_exact(k: int = 30):
+    """O MIH deve devolver exatamente os vizinhos da força bruta dentro do raio"""
+    print("\n🧪 MIH vs Busca Exata")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    matcher.prepare_mih_index()
+
+    queries = load_query_descriptors(matcher)
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada na pasta train_image/"
+
+    print(f"#️⃣ MIH: {matcher.mih_substrings} tabelas, raio={matcher.mih_max_radius}, vizinhos={k}")
+
+    mismatches = 0
+    time_mih = 0.0
+    time_exact = 0.0
+    for file, descriptors in queries:
+        start_time = time.perf_counter()
+        exact_query_idx, exact_ids, exact_distances = matcher.exact_knn(descriptors, k=k)
+        time_exact += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        mih_query_idx, mih_ids, mih_distances = matcher.mih_knn(descriptors, k=k)
+        time_mih += time.perf_counter() - start_time
+
+        # Vizinhos exatos além do raio não fazem parte da resposta do MIH
+        within = exact_distances <= matcher.mih_max_radius
+        same = (np.array_equal(exact_query_idx[within], mih_query_idx) and
+                np.array_equal(exact_ids[within], mih_ids) and
+                np.array_equal(exact_distances[within], mih_distances))
+        mismatches += not same
+        print(f"  {file}: {'✅' if same else '❌'} ({len(mih_ids)} vizinhos dentro do raio)")
+
+    print(f"\n⏱️  MIH:   {time_mih / len(queries) * 1000:.1f} ms/imagem")
+    print(f"⏱️  Exata: {time_exact / len(queries) * 1000:.1f} ms/imagem")
+
+    assert mismatches == 0
+
+def test_lsh_recall(k: int = 10):
+    """Recall do LSH multi-probe por raio de sondagem e custo de uma atualização incremental"""
+    print("\n🧪 Recall do LSH vs Busca Exata")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    matcher.lsh_index = None
+    matcher.build_lsh_index()
+
+    queries = load_query_descriptors(matcher)
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada na pasta train_image/"
+
+    # Índice recém-construído: linhas do LSH seguem a ordem do store
+    truth = [matcher.exact_knn(descriptors, k=k) for _, descriptors in queries]
+
+    for probe_radius in range(3):
+        total_recall = 0.0
+        total_descriptors = 0
+        start_time = time.perf_counter()
+        for (file, descriptors), (exact_query_idx, exact_ids, _) in zip(queries, truth):
+            lsh_query_idx, lsh_ids, _ = matcher.lsh_knn(descriptors, k=k, probe_radius=probe_radius)
+            for i in range(len(descriptors)):
+                found = set(lsh_ids[lsh_query_idx == i].tolist())
+                total_recall += len(set(exact_ids[exact_query_idx == i].tolist()) & found) / k
+            total_descriptors += len(descriptors)
+        elapsed = time.perf_counter() - start_time
+        print(f"  probe_radius={probe_radius}: recall@{k} = {total_recall / total_descriptors:.3f} "
+              f"({elapsed / len(queries) * 1000:.1f} ms/imagem)")
+
+    # Atualização incremental: remove uma imagem e insere uma nova
+    image_paths = list(matcher.database_features.keys())
+    features = {path: matcher.database_features[path] for path in image_paths[1:]}
+    features["novo_pin.jpg"] = queries[0][1]
+
+    start_time = time.perf_counter()
+    n_inserted, n_deleted = matcher.lsh_index.sync(features)
+    elapsed = time.perf_counter() - start_time
+
+    # Cada descriptor deve reencontrar sua cópia (distância 0) na imagem inserida
+    lsh_query_idx, lsh_ids, lsh_distances = matcher.lsh_index.knn(
+        pack_descriptors(queries[0][1]), queries[0][1], 5, matcher.lsh_probe_radius
+    )
+    new_image = matcher.lsh_index.path_to_image["novo_pin.jpg"]
+    hits = (matcher.lsh_index.row_image[lsh_ids] == new_image) & (lsh_distances == 0)
+    found_new = len(np.unique(lsh_query_idx[hits])) == len(queries[0][1])
+
+    print(f"\n🪣 Sync: +{n_inserted} / -{n_deleted} imagens em {elapsed * 1000:.1f} ms")
+    print(f"🎯 Imagem inserida encontrada: {'✅' if found_new else '❌'}")
+
+    assert found_new and image_paths[0] not in matcher.lsh_index.path_to_image
+
+def test_graph_recall(k: int = 10):
+    """Recall do grafo navegável por tamanho do beam e inserção incremental de uma imagem"""
+    print("\n🧪 Recall do Grafo vs Busca Exata")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    matcher.graph_index = None
+    matcher.build_graph_index()
+
+    queries = load_query_descriptors(matcher)
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada na pasta train_image/"
+
+    print(f"🕸️ Grafo: grau={matcher.graph_max_degree}, construído em {matcher.graph_stats['build_seconds']:.1f}s")
+
+    # Grafo recém-construído: linhas seguem a ordem do store
+    truth = [matcher.exact_knn(descriptors, k=k) for _, descriptors in queries]
+
+    for ef in (32, 64, 128, 256):
+        total_recall = 0.0
+        total_descriptors = 0
+        start_time = time.perf_counter()
+        for (file, descriptors), (exact_query_idx, exact_ids, _) in zip(queries, truth):
+            graph_query_idx, graph_ids, _ = matcher.graph_knn(descriptors, k=k, ef=ef)
+            for i in range(len(descriptors)):
+                found = set(graph_ids[graph_query_idx == i].tolist())
+                total_recall += len(set(exact_ids[exact_query_idx == i].tolist()) & found) / k
+            total_descriptors += len(descriptors)
+        elapsed = time.perf_counter() - start_time
+        print(f"  ef={ef}: recall@{k} = {total_recall / total_descriptors:.3f} "
+              f"({elapsed / len(queries) * 1000:.1f} ms/imagem)")
+
+    # Inserção incremental: a nova imagem deve ser alcançável sem reconstruir o grafo
+    features = dict(matcher.database_features)
+    features["novo_pin.jpg"] = queries[0][1]
+
+    start_time = time.perf_counter()
+    n_inserted, _ = matcher.graph_index.sync(features, ef_construction=matcher.graph_ef_construction,
+                                             expand_width=matcher.graph_expand_width)
+    elapsed = time.perf_counter() - start_time
+
+    # Cada descriptor deve reencontrar sua cópia (distância 0) na imagem inserida
+    graph_query_idx, graph_ids, graph_distances = matcher.graph_knn(queries[0][1], k=5)
+    new_image = matcher.graph_index.path_to_image["novo_pin.jpg"]
+    hits = (matcher.graph_index.row_image[graph_ids] == new_image) & (graph_distances == 0)
+    found_new = len(np.unique(graph_query_idx[hits])) == len(queries[0][1])
+
+    print(f"\n🕸️ Sync: +{n_inserted} imagem em {elapsed * 1000:.1f} ms")
+    print(f"🎯 Imagem inserida encontrada: {'✅' if found_new else '❌'}")
+
+    # Buscas simultâneas não podem perder atualizações das estatísticas do grafo
+    queries_before = matcher.graph_stats["queries"]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda query: matcher.graph_knn(query[1], k=k), queries * 8))
+    counted = matcher.graph_stats["queries"] - queries_before == len(queries) * 8
+    print(f"📊 Estatísticas com {len(queries) * 8} buscas em 4 threads: {'✅' if counted else '❌'}")
+
+    assert found_new and counted
+
+def test_signature_shortlist():
+    """Posição da melhor imagem da busca exata no ranking das assinaturas globais (fase 0)"""
+    print("\n🧪 Shortlist da Fase 0 vs Busca Exata")
+    print("=" * 50)
+
+    matcher = ImageMatcher()
+    matcher.prepare_signature_index()
+
+    assert matcher.signature_index is not None, "⚠️  Assinaturas globais não disponíveis"
+
+    queries = load_query_descriptors(matcher)
+    assert queries, "⚠️  Nenhuma imagem de teste encontrada na pasta train_image/"
+
+    image_paths = matcher.database_features.image_paths
+    print(f"🧭 Assinaturas: {matcher.signature_index.n_images} imagens x "
+          f"{matcher.signature_index.vocabulary.n_words} palavras, shortlist={matcher.signature_shortlist}")
+
+    worst_rank = 0
+    for file, descriptors in queries:
+        matcher.use_signature_prefilter = False
+        exact_results = matcher._search_exact(descriptors, top_k=1)
+        matcher.use_signature_prefilter = True
+        if not exact_results:
+            continue
+
+        ranking = matcher.signature_ranking(descriptors)
+        rank = ranking.tolist().index(image_paths.index(exact_results[0]['image_path'])) + 1
+        worst_rank = max(worst_rank, rank)
+        print(f"  {file}: top-1 exato na posição {rank} da fase 0")
+
+    print(f"\n🎯 Pior posição: {worst_rank} (shortlist de {matcher.signature_shortlist})")
+
+    assert worst_rank <= matcher.signature_shortlist
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_signature_shortlist, test_annoy_recall, test_bow_candidates,
+                 test_mih_exact, test_lsh_recall, test_graph_recall):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Recall OK!" if ok else "\n❌ Recall com problemas!")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Testa o cache de resultados (LRU com orçamento em bytes) de /search e /searchtest
+"""
+
+import cv2
+import numpy as np
+import os
+import time
+import main
+from main import ResultCache, search_uploaded_image
+
+def test_lru_budget():
+    """Entradas antigas saem quando o orçamento estoura; a última usada é preservada"""
+    print("🧪 Cache de resultados: LRU com orçamento em bytes")
+    print("=" * 50)
+
+    cache = ResultCache(max_bytes=300)
+    for i in range(5):
+        cache.put(f"upload-{i}", [{"image_path": f"pin_{i:040d}.jpg", "similarity_score": 0.5}], cache.generation)
+        cache.get("upload-0")  # Mantém a primeira entrada como a mais recente
+
+    stats = cache.stats()
+    print(f"📦 Entradas: {stats['entries']}, bytes: {stats['bytes_used']}/{stats['max_bytes']}, "
+          f"despejos: {stats['evictions']}")
+
+    ok = stats['bytes_used'] <= 300 and cache.get("upload-0") is not None and stats['evictions'] > 0
+
+    # Busca iniciada antes de uma reconstrução não grava depois dela
+    generation = cache.generation
+    cache.clear()
+    cache.put("stale", [], generation)
+    ok = ok and cache.get("stale") is None
+    print(f"🔄 Resultado de geração antiga descartado: {'✅' if cache.get('stale') is None else '❌'}")
+
+    assert ok
+
+def test_repeated_upload(image_path: str = "train_image/mfms.jpg"):
+    """O mesmo upload repetido deve sair do cache com o mesmo resultado"""
+    print("\n🧪 Cache de resultados: upload repetido")
+    print("=" * 50)
+
+    try:
+        with open(image_path, "rb") as f:
+            contents = f.read()
+    except FileNotFoundError:
+        raise AssertionError(f"⚠️  Imagem de teste não encontrada: {image_path}")
+
+    main.matcher.clear_result_caches()
+
+    start_time = time.perf_counter()
+    first, _, first_hit = search_uploaded_image(contents, top_k=3)
+    time_miss = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    second, _, second_hit = search_uploaded_image(contents, top_k=3)
+    time_hit = time.perf_counter() - start_time
+
+    print(f"🔍 Primeira busca: {time_miss * 1000:.1f} ms (cache: {'HIT' if first_hit else 'MISS'})")
+    print(f"💾 Repetida:       {time_hit * 1000:.3f} ms (cache: {'HIT' if second_hit else 'MISS'})")
+
+    # Outra configuração de busca não reaproveita o resultado
+    main.matcher.annoy_search_k += 1
+    _, _, other_config_hit = search_uploaded_image(contents, top_k=3)
+    main.matcher.annoy_search_k -= 1
+    print(f"⚙️  Outra configuração: {'HIT' if other_config_hit else 'MISS'}")
+
+    assert not first_hit and second_hit == "exact" and first == second and not other_config_hit
+
+def reencode(contents: bytes, scale: float, quality: int) -> bytes:
+    """Simula um reenvio por app de mensagem: redimensiona e recomprime em JPEG"""
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+    resized = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+def test_near_duplicate_uploads(image_dir: str = "train_image", variants=((0.8, 80), (0.6, 70), (0.5, 60))):
+    """Reenvios recomprimidos respondem pelo cache por pHash com o mesmo melhor resultado da busca completa"""
+    print("\n🧪 Cache de resultados: reenvios quase idênticos (pHash)")
+    print("=" * 50)
+
+    image_paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir)) if os.path.isdir(image_dir) else []
+    assert image_paths, f"⚠️  Pasta de teste não encontrada: {image_dir}"
+
+    main.matcher.clear_result_caches()
+    verify_rate = main.matcher.query_cache_verify_rate
+    main.matcher.query_cache_verify_rate = 0.0
+
+    # Primeiro envio de cada foto preenche o cache
+    for path in image_paths:
+        with open(path, "rb") as f:
+            search_uploaded_image(f.read(), top_k=3)
+
+    lookups = hits = agreed = 0
+    for path in image_paths:
+        with open(path, "rb") as f:
+            contents = f.read()
+        for scale, quality in variants:
+            variant = reencode(contents, scale, quality)
+            cached, _, tier = search_uploaded_image(variant, top_k=3)
+
+            main.matcher.use_result_cache = False
+            fresh, _, _ = search_uploaded_image(variant, top_k=3)
+            main.matcher.use_result_cache = True
+
+            lookups += 1
+            if tier == 'phash':
+                hits += 1
+                same_best = [r['image_path'] for r in cached[:1]] == [r['image_path'] for r in fresh[:1]]
+                agreed += same_best
+                if not same_best:
+                    print(f"  ❌ {path} ({scale}x, q{quality}): cache divergiu da busca completa")
+
+    main.matcher.query_cache_verify_rate = verify_rate
+    precision = agreed / hits if hits else 0.0
+    print(f"🎯 Hit rate (reenvios): {hits}/{lookups} ({hits / lookups:.0%}), raio {main.matcher.query_cache_max_radius} bits")
+    print(f"✅ Precisão (melhor resultado igual ao da busca completa): {agreed}/{hits} ({precision:.0%})")
+
+    assert hits > 0 and precision == 1.0
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_lru_budget, test_repeated_upload, test_near_duplicate_uploads):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Cache de resultados OK!" if ok else "\n❌ Cache de resultados com problemas!")
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Testa o executor limitado das buscas (fila, 503 e event loop livre) e a busca em lote sobre ele
+"""
+
+import asyncio
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+import main
+from main import BoundedExecutor, iter_batch_uploads, root, run_search_task, search_batch, search_uploaded_image
+
+def test_queue_limit():
+    """Com workers e fila ocupados, novas tarefas são recusadas em vez de esperar"""
+    print("🧪 Executor de buscas: limite da fila")
+    print("=" * 50)
+
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    futures = [executor.submit(release.wait) for _ in range(3)]
+    print(f"📥 Aceitas: {sum(f is not None for f in futures)}/3 (1 worker + fila de 1)")
+
+    time.sleep(0.05)
+    release.set()
+    for future in futures:
+        if future is not None:
+            future.result()
+
+    stats = executor.stats()
+    print(f"📊 Concluídas: {stats['completed']}, recusadas: {stats['rejected']}, "
+          f"espera p95: {stats['wait_ms_p95']:.1f} ms")
+
+    assert futures[2] is None and stats['completed'] == 2 and stats['rejected'] == 1 and stats['queue_depth'] == 0
+
+def test_event_loop_free(image_path: str = "train_image/mfms.jpg"):
+    """Uma busca lenta não pode travar outras rotas; fila cheia vira 503"""
+    print("\n🧪 Executor de buscas: event loop livre durante a busca")
+    print("=" * 50)
+
+    try:
+        with open(image_path, "rb") as f:
+            contents = f.read()
+    except FileNotFoundError:
+        raise AssertionError(f"⚠️  Imagem de teste não encontrada: {image_path}")
+
+    release = threading.Event()
+
+    def slow_search(contents: bytes, top_k: int):
+        release.wait()
+        return search_uploaded_image(contents, top_k)
+
+    async def scenario():
+        main.matcher.clear_result_caches()
+        main.matcher.search_executor.resize(1, 0)
+        search = asyncio.ensure_future(run_search_task(slow_search, contents, 3))
+        await asyncio.sleep(0.05)
+
+        # Busca em andamento: a rota de status responde e uma nova busca recebe 503
+        start_time = time.perf_counter()
+        await root()
+        status_ms = (time.perf_counter() - start_time) * 1000
+        try:
+            await run_search_task(search_uploaded_image, contents, 3)
+            rejected = None
+        except HTTPException as e:
+            rejected = e.status_code
+
+        release.set()
+        results, _, _ = await search
+        main.matcher.search_executor.resize(main.matcher.search_workers, main.matcher.search_queue_size)
+        return status_ms, rejected, results
+
+    status_ms, rejected, results = asyncio.run(scenario())
+    print(f"⏱️  GET / durante a busca: {status_ms:.2f} ms")
+    print(f"🚦 Busca extra com a fila cheia: {rejected}")
+    print(f"🔍 Busca lenta concluída com {len(results)} resultados")
+
+    assert status_ms < 100 and rejected == 503 and len(results) > 0
+
+def make_upload(name: str, data: bytes, content_type: str) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=name, headers=Headers({"content-type": content_type}))
+
+def test_batch_archives_and_cancel(folder: str = "train_image"):
+    """Compactado truncado/corrompido vira linha de erro; lote espera a fila sem polling e cancela ao encerrar"""
+    print("\n🧪 Busca em lote: compactados inválidos, espera da fila e cancelamento")
+    print("=" * 50)
+
+    names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+    assert len(names) >= 3, f"⚠️  Poucas imagens de teste em {folder}/"
+    images = {}
+    for name in names:
+        with open(os.path.join(folder, name), "rb") as f:
+            images[name] = f.read()
+
+    # .tar.gz cortado no meio e .zip com dados deflate corrompidos
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode="w:gz") as archive:
+        for name, data in images.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    truncated_tar = tar_buffer.getvalue()[:len(tar_buffer.getvalue()) * 2 // 3]
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in images.items():
+            archive.writestr(name, data)
+    corrupt_zip = bytearray(zip_buffer.getvalue())
+    corrupt_zip[100:400] = bytes(300)
+
+    items = list(iter_batch_uploads([make_upload("lote.tar.gz", truncated_tar, "application/gzip"),
+                                     make_upload("lote.zip", bytes(corrupt_zip), "application/zip")]))
+    errors = [name for name, _, error in items if error is not None]
+    archives_ok = errors == ["lote.tar.gz", "lote.zip"]
+    print(f"🗜️  {len(items) - len(errors)} membros lidos antes do erro, erros em {errors}: {'✅' if archives_ok else '❌'}")
+
+    workers, queue_size = main.matcher.search_workers, main.matcher.search_queue_size
+    release = threading.Event()
+
+    async def consume(files, limit: int = None):
+        response = await search_batch(files=files, top_k=3)
+        lines = []
+        async for line in response.body_iterator:
+            lines.append(json.loads(line))
+            if limit is not None and len(lines) >= limit:
+                await response.body_iterator.aclose()
+                break
+        return lines
+
+    async def scenario():
+        main.matcher.clear_result_caches()
+        uploads = lambda: [make_upload(name, data, "image/jpeg") for name, data in images.items()]
+
+        # Fila cheia por outra requisição: o lote espera a vaga e termina quando ela abre
+        main.matcher.search_executor.resize(1, 0)
+        blocker = main.matcher.search_executor.submit(release.wait)
+        batch = asyncio.ensure_future(consume(uploads()))
+        await asyncio.sleep(0.2)
+        waited = not batch.done() and main.matcher.search_executor.stats()['running'] == 1
+        release.set()
+        lines = await batch
+        blocker.result()
+        complete = waited and len(lines) == len(images) and all('results' in line for line in lines)
+
+        # Stream encerrado após a primeira linha: consultas ainda na fila são canceladas
+        main.matcher.clear_result_caches()
+        main.matcher.search_workers = len(images)
+        main.matcher.search_executor.resize(1, len(images))
+        completed_before = main.matcher.search_executor.stats()['completed']
+        first = await consume(uploads(), limit=1)
+        await asyncio.sleep(0.5)
+        stats = main.matcher.search_executor.stats()
+        ran = stats['completed'] - completed_before
+        cancelled = len(first) == 1 and stats['queue_depth'] == 0 and stats['running'] == 0 and ran < len(images)
+        return complete, cancelled, ran
+
+    try:
+        complete, cancelled, ran = asyncio.run(scenario())
+    finally:
+        main.matcher.search_workers = workers
+        main.matcher.search_executor.resize(workers, queue_size)
+    print(f"⏳ Lote espera a fila cheia e conclui {len(images)} consultas: {'✅' if complete else '❌'}")
+    print(f"🛑 Encerrar o stream cancela as consultas pendentes ({ran}/{len(images)} rodaram): {'✅' if cancelled else '❌'}")
+
+    assert archives_ok and complete and cancelled
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_queue_limit, test_event_loop_free, test_batch_archives_and_cancel):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} {e}".rstrip())
+            ok = False
+    print("\n✅ Executor de buscas OK!" if ok else "\n❌ Executor de buscas com problemas!")